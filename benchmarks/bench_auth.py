@@ -0,0 +1,59 @@
+#!/usr/bin/python
+"""ログイン判定のベンチマーク
+
+アイコン（既定では200KB）を持つユーザーについて、SessionMiddlewareで1リクエストごとに行う
+User.check_jwt（JWTのデコードとUserの読み込み）と、mitama.models.identityのキャッシュを使った
+identities.authenticateの1回あたりの時間とクエリ数を比較します。
+
+    python -m benchmarks.bench_auth [繰り返し回数] [アイコンのバイト数]
+"""
+import os
+import sys
+import timeit
+
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.models import User
+from mitama.models.identity import identities
+
+DatabaseManager.create_all()
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    icon_size = int(sys.argv[2]) if len(sys.argv) > 2 else 200 * 1024
+    user = User()
+    user.name = user.screen_name = "bench"
+    user.email = "bench@example.com"
+    user.icon = os.urandom(icon_size)
+    user.create()
+    token = user.get_jwt()
+    session = DatabaseManager.session
+
+    statements = list()
+
+    def count(*args):
+        statements.append(args)
+
+    def check_jwt():
+        User.check_jwt(token).screen_name
+        session.expire_all()
+
+    def authenticate():
+        identities.authenticate(token).screen_name
+
+    event.listen(DatabaseManager.engine, "before_cursor_execute", count)
+    print("%-14s %12s %10s" % ("method", "time", "queries"))
+    for label, func in (("check_jwt", check_jwt), ("authenticate", authenticate)):
+        func()
+        del statements[:]
+        elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+        print("%-14s %9.1f us %10.2f" % (label, elapsed, len(statements) / (number * 3)))
+
+
+if __name__ == "__main__":
+    main()
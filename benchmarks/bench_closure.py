@@ -0,0 +1,146 @@
+#!/usr/bin/python
+"""グループの所属関係の判定のベンチマーク
+
+ユーザー10000人、グループ2000個の木を作り、関係を辿る従来の判定と、
+所属関係のインデックスを使う判定の1回あたりの時間と発行したクエリの数を比較します。
+
+    python -m benchmarks.bench_closure [ユーザー数] [グループ数]
+"""
+import random
+import sys
+import time
+
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.models import Group, User
+from mitama.models.closure import closure
+from mitama.models.nodes import user_group
+
+DatabaseManager.create_all()
+
+
+def legacy_user_is_ancestor(user, node):
+    layer = user.groups
+    while len(layer) > 0:
+        if isinstance(node, Group) and node in layer:
+            return True
+        for node_ in layer:
+            if isinstance(node, User) and node in node_.users:
+                return True
+        layer_ = list()
+        for node_ in layer:
+            layer_.extend(node_.groups)
+        layer = layer_
+    return False
+
+
+def legacy_group_is_ancestor(group, node):
+    layer = [group.parent] if group.parent is not None else []
+    while len(layer) > 0:
+        if isinstance(node, Group) and node in layer:
+            return True
+        for node_ in layer:
+            if isinstance(node, User) and node in node_.users:
+                return True
+        layer = [node_.parent for node_ in layer if node_.parent is not None]
+    return False
+
+
+def legacy_group_is_descendant(group, node):
+    layer = group.groups
+    while len(layer) > 0:
+        if node in layer:
+            return True
+        layer_ = list()
+        for node_ in layer:
+            layer_.extend(node_.groups)
+        layer = layer_
+    return False
+
+
+def populate(n_users, n_groups, rand):
+    engine = DatabaseManager.engine
+    groups = list()
+    for i in range(n_groups):
+        parent = rand.choice(groups)["_id"] if groups and rand.random() < 0.9 else None
+        groups.append({
+            "_id": "group-%d" % i,
+            "name": "g%d" % i,
+            "_screen_name": "g%d" % i,
+            "parent_id": parent,
+        })
+    users = [
+        {
+            "_id": "user-%d" % i,
+            "name": "u%d" % i,
+            "_screen_name": "u%d" % i,
+            "email": "u%d@example.com" % i,
+        }
+        for i in range(n_users)
+    ]
+    members = [
+        {"_id": "ug-%d-%d" % (i, j), "user_id": user["_id"], "group_id": group["_id"]}
+        for i, user in enumerate(users)
+        for j, group in enumerate(rand.sample(groups, 2))
+    ]
+    with engine.begin() as conn:
+        conn.execute(Group.__table__.insert(), groups)
+        conn.execute(User.__table__.insert(), users)
+        conn.execute(user_group.insert(), members)
+
+
+def measure(label, checks, repeat=1):
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    engine = DatabaseManager.engine
+    event.listen(engine, "before_cursor_execute", count)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for func, a, b in checks:
+            func(a, b)
+    elapsed = time.perf_counter() - start
+    event.remove(engine, "before_cursor_execute", count)
+    n = len(checks) * repeat
+    print("%-10s %10.1f us/check %8.2f queries/check" % (
+        label, elapsed / n * 1e6, statements[0] / n
+    ))
+    return elapsed / n
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_groups = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rand = random.Random(0)
+    populate(n_users, n_groups, rand)
+    groups = Group.query.all()
+    users = User.query.limit(200).all()
+    pairs = [(rand.choice(groups), rand.choice(groups + users)) for _ in range(200)]
+    user_pairs = [(rand.choice(users), rand.choice(groups)) for _ in range(200)]
+
+    print("%d users, %d groups" % (n_users, n_groups))
+    legacy = [(legacy_group_is_ancestor, a, b) for a, b in pairs]
+    legacy += [(legacy_group_is_descendant, a, b) for a, b in pairs]
+    legacy += [(legacy_user_is_ancestor, a, b) for a, b in user_pairs]
+    indexed = [(Group.is_ancestor, a, b) for a, b in pairs]
+    indexed += [(Group.is_descendant, a, b) for a, b in pairs]
+    indexed += [(User.is_ancestor, a, b) for a, b in user_pairs]
+
+    DatabaseManager.session.expire_all()
+    before = measure("legacy", legacy)
+    closure.invalidate()
+    start = time.perf_counter()
+    closure.snapshot()
+    print("%-10s %10.1f ms" % ("build", (time.perf_counter() - start) * 1e3))
+    after = measure("closure", indexed, repeat=10)
+    print("speedup    %10.1fx" % (before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""アイコンの遅延読み込みのベンチマーク
+
+アイコン（既定では8KB）を持つユーザー10000人について、
+User.list()（アイコンを読み込まない）とUser.list(with_icon=True)（従来と同じく全カラムを読み込む）の
+データベースから受け取るバイト数と、1回あたりの時間を比較します。
+
+    python -m benchmarks.bench_icons [ユーザー数] [アイコンのバイト数]
+"""
+import os
+import sys
+import time
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.models import User
+
+DatabaseManager.create_all()
+
+
+def populate(n_users, icon_size):
+    icon = os.urandom(icon_size)
+    rows = [
+        {
+            "_id": "user-%d" % i,
+            "screen_name": "u%d" % i,
+            "name": "User %d" % i,
+            "email": "u%d@example.com" % i,
+            "_icon": icon,
+        }
+        for i in range(n_users)
+    ]
+    with DatabaseManager.engine.begin() as conn:
+        conn.execute(User.__table__.insert(), rows)
+
+
+def transferred(query):
+    """クエリの結果として受け取る値のバイト数"""
+    total = 0
+    with DatabaseManager.engine.connect() as conn:
+        for row in conn.execute(query.statement):
+            for value in row:
+                if isinstance(value, bytes):
+                    total += len(value)
+                elif value is not None:
+                    total += len(str(value).encode("utf-8"))
+    return total
+
+
+def measure(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        DatabaseManager.session.expunge_all()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    icon_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8 * 1024
+    populate(n_users, icon_size)
+    print("%-22s %14s %10s" % ("query", "bytes", "time"))
+    cases = (
+        ("User.list()", User.query, lambda: User.list()),
+        ("User.list(with_icon)", User.with_icon(), lambda: User.list(with_icon=True)),
+    )
+    for label, query, func in cases:
+        print("%-22s %14d %7.1f ms" % (label, transferred(query), measure(func) * 1000))
+
+
+if __name__ == "__main__":
+    main()
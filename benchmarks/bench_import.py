@@ -0,0 +1,98 @@
+#!/usr/bin/python
+"""import時間のベンチマーク
+
+モジュールごとに新しいPythonプロセスで ``python -X importtime`` を使ってimportし、
+そのモジュールの累積時間と、プロセス全体のimport時間の中央値を表示します。
+モデルを定義するモジュールは、先にDatabaseManager.test()でデータベースを設定してからimportします。
+また、mitama.modelsのimport中にデータベースへ発行したクエリの数を表示します。
+
+    python -m benchmarks.bench_import [繰り返し回数]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+# (モジュール, 先にデータベースの設定が必要か)
+MODULES = [
+    ("mitama", False),
+    ("mitama.db", False),
+    ("mitama.app", False),
+    ("mitama.utils.controllers", False),
+    ("mitama.utils.middlewares", False),
+    ("mitama.models", True),
+    ("mitama.portal", True),
+]
+
+COUNT_QUERIES = """
+import tempfile, os
+from sqlalchemy import event
+from mitama.db import DatabaseManager
+path = os.path.join(tempfile.mkdtemp(), "db.sqlite3")
+DatabaseManager({"type": "sqlite", "path": path})
+statements = []
+event.listen(DatabaseManager.engine, "before_cursor_execute", lambda *args: statements.append(args))
+import mitama.models
+print(len(statements))
+"""
+
+
+def environ():
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    env.setdefault("MITAMA_SESSION_KEY", "MDEyMzQ1Njc4OWFiY2RlZg==")
+    return env
+
+
+def import_time(module, needs_db, env):
+    code = "import " + module
+    if needs_db:
+        code = "from mitama.db import DatabaseManager; DatabaseManager.test(); " + code
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+        check=True,
+    )
+    cumulative = None
+    total = 0
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # 先頭の空白が1つの行はトップレベルのimport
+        if not fields[2].startswith("  "):
+            total += int(fields[1])
+            if fields[2].strip() == module:
+                cumulative = int(fields[1])
+    if cumulative is None:
+        raise RuntimeError("import time of %s not found" % module)
+    return cumulative, total
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = environ()
+    print("%-26s %11s %11s" % ("module", "module", "process"))
+    for module, needs_db in MODULES:
+        samples = [import_time(module, needs_db, env) for _ in range(repeat)]
+        print("%-26s %8.1f ms %8.1f ms" % (
+            module,
+            statistics.median(sample[0] for sample in samples) / 1e3,
+            statistics.median(sample[1] for sample in samples) / 1e3,
+        ))
+    queries = subprocess.run(
+        [sys.executable, "-c", COUNT_QUERIES],
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.strip()
+    print("%-26s %8s queries" % ("mitama.models", queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+"""所属関係のテーブルとログイン名の索引のベンチマーク
+
+索引のない従来のスキーマにユーザー20000人、グループ2000個の所属関係とRoleを作り、
+migrateコマンドと同じマイグレーションで索引を追加する前と後の、よく使うクエリの実行計画と1回あたりの時間を比較します。
+
+    python -m benchmarks.bench_indexes [ユーザー数] [グループ数]
+"""
+import random
+import sys
+import time
+
+from sqlalchemy import and_, create_engine, select
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.db.migration import Migrator
+from mitama.models import schema
+from mitama.models.nodes import Group, User, role_group, role_relation, role_user, user_group
+
+
+def legacy_engine():
+    engine = create_engine("sqlite://")
+    tables = schema.tables()
+    DatabaseManager.metadata.create_all(engine, tables=tables)
+    for table in tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+    return engine
+
+
+def populate(engine, n_users, n_groups, rand):
+    users = [
+        {"_id": "user-%d" % i, "screen_name": "u%d" % i, "email": "u%d@example.com" % i}
+        for i in range(n_users)
+    ]
+    groups = [{"_id": "group-%d" % i, "screen_name": "g%d" % i} for i in range(n_groups)]
+    members = [
+        {"_id": "ug-%d-%d" % (i, j), "user_id": user["_id"], "group_id": group["_id"]}
+        for i, user in enumerate(users)
+        for j, group in enumerate(rand.sample(groups, 3))
+    ]
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), users)
+        conn.execute(Group.__table__.insert(), groups)
+        conn.execute(user_group.insert(), members)
+        conn.execute(role_user.insert(), [
+            {"role_id": "role-%d" % (i % 20), "user_id": user["_id"]}
+            for i, user in enumerate(users[::5])
+        ])
+        conn.execute(role_group.insert(), [
+            {"role_id": "role-%d" % (i % 20), "group_id": group["_id"]}
+            for i, group in enumerate(groups[::2])
+        ])
+        conn.execute(role_relation.insert(), [
+            {"_id": "rr-%d" % i, "role_id": "inner-%d" % (i % 5), "relation_id": member["_id"]}
+            for i, member in enumerate(members[::4])
+        ])
+    return users, groups
+
+
+def queries(rand, users, groups):
+    user = rand.choice(users)
+    group = rand.choice(groups)
+    users_t = User.__table__
+    return [
+        ("login", select([users_t.c._id]).where(users_t.c.screen_name == user["screen_name"])),
+        ("membership", select([user_group.c._id]).where(and_(
+            user_group.c.group_id == group["_id"],
+            user_group.c.user_id == user["_id"],
+        ))),
+        ("user roles", select([role_user.c.role_id]).where(role_user.c.user_id == user["_id"])),
+        ("group roles", select([role_group.c.role_id]).where(role_group.c.group_id == group["_id"])),
+        ("inner role", select([role_relation.c.role_id]).where(and_(
+            role_relation.c.relation_id == user_group.c._id,
+            user_group.c.user_id == user["_id"],
+            user_group.c.group_id == group["_id"],
+        ))),
+    ]
+
+
+def report(engine, rand, users, groups, repeat):
+    samples = [queries(rand, users, groups) for _ in range(repeat)]
+    with engine.connect() as conn:
+        for n, (label, query) in enumerate(samples[0]):
+            compiled = query.compile(bind=engine)
+            params = tuple(compiled.params[name] for name in compiled.positiontup)
+            plan = conn.execute("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+            start = time.perf_counter()
+            for sample in samples:
+                conn.execute(sample[n][1]).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat
+            print("  %-12s %10.1f us" % (label, elapsed * 1e6))
+            for row in plan:
+                print("      " + row[-1])
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_groups = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rand = random.Random(0)
+    engine = legacy_engine()
+    users, groups = populate(engine, n_users, n_groups, rand)
+    print("%d users, %d groups" % (n_users, n_groups))
+    print("before")
+    report(engine, random.Random(1), users, groups, 50)
+    pending = schema.pending(engine)
+    start = time.perf_counter()
+    Migrator(engine).upgrade(prefix="mitama")
+    print("upgrade    %10.1f ms (%d indexes)" % ((time.perf_counter() - start) * 1e3, len(pending)))
+    print("after")
+    report(engine, random.Random(1), users, groups, 50)
+
+
+if __name__ == "__main__":
+    main()
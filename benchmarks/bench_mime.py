@@ -0,0 +1,49 @@
+#!/usr/bin/python
+"""MIMEタイプの判定のベンチマーク
+
+アイコン（既定では200KBのPNG）について、1回ごとにmagic.Magicを作って全体を判定する従来の方法と、
+mitama.mime.MimeDetector（ハンドルのプールと先頭部分のハッシュによるLRU）の1回あたりの時間を比較します。
+
+    python -m benchmarks.bench_mime [繰り返し回数] [アイコンのバイト数]
+"""
+import io
+import os
+import sys
+import timeit
+
+import magic
+from PIL import Image
+
+from mitama.mime import MimeDetector
+
+
+def make_icon(size):
+    output = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(output, format="PNG")
+    return output.getvalue() + os.urandom(max(size - output.tell(), 0))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    icon = make_icon(int(sys.argv[2]) if len(sys.argv) > 2 else 200 * 1024)
+    detector = MimeDetector()
+    icons = [make_icon(4096) for _ in range(number)]
+    icons_ = iter(icons * 3)
+
+    def legacy():
+        magic.Magic(mime=True, uncompress=True).from_buffer(icon)
+
+    def cached():
+        detector.from_buffer(icon)
+
+    def uncached():
+        detector.from_buffer(next(icons_))
+
+    print("%-10s %12s" % ("method", "time"))
+    for label, func in (("legacy", legacy), ("cached", cached), ("uncached", uncached)):
+        elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+        print("%-10s %9.1f us" % (label, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+"""NoImage画像のベンチマーク
+
+アイコンのないユーザーのdata URLを作る処理について、
+従来のようにファイルを読み込んでMIMEタイプを判定しbase64に変換する場合と、
+mitama.noimage.assetsに読み込み済みのdata URLを使う場合の1回あたりの時間を比較します。
+
+    python -m benchmarks.bench_noimage [回数]
+"""
+import os
+import sys
+import time
+from base64 import b64encode
+from pathlib import Path
+
+import magic
+
+import mitama
+from mitama.app.app import dataurl
+from mitama.noimage import load_noimage_user
+
+
+def legacy():
+    path = Path(os.path.dirname(mitama.__file__)) / "app/static/noimage_user.png"
+    with open(path, "rb") as f:
+        icon = f.read()
+    mime = magic.Magic(mime=True, uncompress=True).from_buffer(icon)
+    return "data:" + mime + ";base64," + b64encode(icon).decode()
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    assert legacy() == dataurl(load_noimage_user())
+    print("%-28s %10s" % ("noimage data URL", "time"))
+    cases = (
+        ("read + magic + base64", legacy),
+        ("assets", lambda: dataurl(load_noimage_user())),
+    )
+    for label, func in cases:
+        print("%-28s %7.2f us" % (label, measure(func, repeat) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""アイコンの縮小画像のベンチマーク
+
+アップロードされたアイコン（既定では1200x900のJPEG）について、
+従来のようにリクエストの中でresize_icon（200x200のPNGに変換）する場合と、
+元の画像をそのまま保存してmitama.models.renditionsで縮小画像を作る場合（その場で作る・Executorで作る）の
+保存にかかる時間と、メモリのキャッシュがない状態で縮小画像を1回返す時間を比較します。
+
+    python -m benchmarks.bench_renditions [回数] [幅] [高さ]
+"""
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.models import User
+from mitama.models.renditions import pipeline
+
+DatabaseManager.create_all()
+
+
+def legacy_resize(icon):
+    """従来のportalのresize_icon"""
+    img = Image.open(io.BytesIO(icon))
+    width, height = img.size
+    scale = 200 / min(width, height)
+    width, height = int(width * scale), int(height * scale)
+    resize = img.resize((width, height), resample=Image.NEAREST)
+    left, top = (width - min(width, height)) // 2, (height - min(width, height)) // 2
+    cropped = resize.crop((left, top, left + min(width, height), top + min(width, height)))
+    export = io.BytesIO()
+    cropped.save(export, format="PNG")
+    return export.getvalue()
+
+
+def legacy_serve(blob, size):
+    """従来の/_mitama/iconsのリクエストごとの縮小"""
+    img = Image.open(io.BytesIO(blob))
+    img.load()
+    img = img.convert("RGBA")
+    img.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    img.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def photo(width, height):
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def create(i, icon):
+    user = User()
+    user.name = user.screen_name = "bench_%d" % i
+    user.email = "bench_%d@example.com" % i
+    user.icon = icon
+    user.create()
+    return user
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1200
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 900
+    icons = [photo(width, height) for _ in range(repeat * 3)]
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    print("%-34s %10s" % ("upload", "time"))
+    uploads = (
+        ("resize_icon in request", lambda i: create(i, legacy_resize(icons[i]))),
+        ("renditions (inline)", lambda i: create(repeat + i, icons[repeat + i])),
+    )
+    for label, func in uploads:
+        print("%-34s %7.2f ms" % (label, measure(func, repeat) * 1000))
+    pipeline.executor = executor
+    func = lambda i: create(repeat * 2 + i, icons[repeat * 2 + i])
+    print("%-34s %7.2f ms" % ("renditions (executor)", measure(func, repeat) * 1000))
+    executor.shutdown(wait=True)
+    pipeline.executor = None
+
+    users = User.list(with_icon=True)
+    print("%-34s %10s" % ("serve size=80 (cold cache)", "time"))
+    serves = (
+        ("resize per request", lambda i: legacy_serve(users[i].icon, 80)),
+        ("stored rendition", lambda i: pipeline.get(users[i].icon_hash, 80, "png", None)),
+    )
+    for label, func in serves:
+        print("%-34s %7.2f ms" % (label, measure(func, repeat) * 1000))
+
+
+if __name__ == "__main__":
+    main()
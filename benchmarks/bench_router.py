@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""ルーティングエンジンのベンチマーク
+
+ポータルと同じ形のルーティングテーブルに複数のアプリを加え、
+線形探索のRouter.matchとコンパイル済みのDispatcher.matchの1リクエストあたりの時間を比較します。
+
+    python -m benchmarks.bench_router [アプリの数]
+"""
+import sys
+import timeit
+from wsgiref.util import setup_testing_defaults
+
+from mitama.app import Controller, Middleware, Router
+from mitama.app.http import Request
+from mitama.app.method import group, post, view
+
+
+class BenchController(Controller):
+    def handle(self, request):
+        return request.params
+
+
+class BenchMiddleware(Middleware):
+    def process(self, request, handler):
+        return handler(request)
+
+
+def portal_router():
+    return Router(
+        [
+            view("/static/<path:path>", BenchController),
+            view("/favicon.ico", BenchController),
+            view("/sw.js", BenchController),
+            view("/manifest.json", BenchController),
+            Router(
+                [
+                    view("/setup", BenchController),
+                    view("/signup", BenchController),
+                    view("/login", BenchController),
+                    Router(
+                        [
+                            view("/", BenchController),
+                            view("/settings", BenchController),
+                            view("/logout", BenchController),
+                            view("/users", BenchController),
+                            view("/users/invite", BenchController),
+                            view("/users/invite/<id>/delete", BenchController),
+                            view("/users/<id>", BenchController),
+                            view("/users/<id>/settings", BenchController),
+                            view("/users/<id>/settings/profile", BenchController),
+                            view("/users/<id>/settings/password", BenchController),
+                            view("/users/<id>/settings/notification", BenchController),
+                            view("/users/<id>/delete", BenchController),
+                            view("/groups", BenchController),
+                            view("/groups/create", BenchController),
+                            view("/groups/<id>", BenchController),
+                            post("/groups/<id>/append", BenchController),
+                            view("/groups/<id>/groups/<gid>/remove", BenchController),
+                            view("/groups/<id>/users/<uid>/remove", BenchController),
+                            view("/groups/<id>/users/<uid>/accept", BenchController),
+                            view("/groups/<id>/users/<uid>/forbit", BenchController),
+                            view("/groups/<id>/settings", BenchController),
+                            view("/groups/<id>/delete", BenchController),
+                            view("/apps", BenchController),
+                            view("/apps/settings", BenchController),
+                            view("/acs/post<hoge:re:.*>", BenchController),
+                            view("/acs/redirect<hoge:re:.*>", BenchController),
+                            view("/slo/post<hoge:re:.*>", BenchController),
+                            view("/slo/redirect<hoge:re:.*>", BenchController),
+                        ],
+                        middlewares=[BenchMiddleware],
+                    ),
+                ],
+                middlewares=[BenchMiddleware],
+            ),
+        ]
+    )
+
+
+def project_router(apps):
+    routes = [group("/app%d" % i, portal_router()) for i in range(apps)]
+    routes.append(group("/portal", portal_router()))
+    return Router(routes, middlewares=[BenchMiddleware])
+
+
+def request(path):
+    environ = {"PATH_INFO": path}
+    setup_testing_defaults(environ)
+    return Request(environ)
+
+
+def bench(matcher, path, number):
+    def run():
+        req = request(path)
+        req_, handle, _ = matcher.match(req)
+
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+    apps = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    number = 2000
+    router = project_router(apps)
+    dispatcher = router.compile()
+    paths = [
+        "/portal/",
+        "/portal/users/alice/settings/notification",
+        "/portal/slo/redirect?x",
+        "/portal//groups/team//settings/",
+        "/portal/static/css/style.css",
+    ]
+    print("apps: %d" % (apps + 1))
+    print("%-45s %12s %12s %8s" % ("path", "Router", "Dispatcher", "ratio"))
+    for path in paths:
+        linear = bench(router, path, number)
+        compiled = bench(dispatcher, path, number)
+        print(
+            "%-45s %10.2fus %10.2fus %7.1fx"
+            % (path, linear * 1e6, compiled * 1e6, linear / compiled)
+        )
+
+
+if __name__ == "__main__":
+    main()
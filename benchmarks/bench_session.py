@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""セッションCookieのストレージのベンチマーク
+
+ログイン済みのユーザーのセッション（JWTとCSRFトークン）を想定し、
+EncryptedCookieStorage（AES-CBC + JSON）とAEADCookieStorage（AES-GCM）、
+サーバー側に保存するServerSideStorage（メモリ、SQLite）の1リクエストあたりの読み込みだけ、読み込みと書き込み、内容が変わらない場合の読み込みと書き込みの時間と、
+Cookieの長さを比較します。
+
+    python -m benchmarks.bench_session [繰り返し回数]
+"""
+import base64
+import secrets
+import sys
+import timeit
+
+from sqlalchemy import create_engine
+
+from mitama.app.http import Response
+from mitama.app.http import session as session_module
+from mitama.app.http.session import AEADCookieStorage, EncryptedCookieStorage
+from mitama.app.http.session_store import MemoryBackend, ServerSideStorage, SQLBackend
+
+KEY = base64.urlsafe_b64decode("MDEyMzQ1Njc4OWFiY2RlZg==")
+
+
+class FakeRequest:
+    def __init__(self, cookie):
+        self.cookies = {"MITAMA_SESSION": cookie} if cookie is not None else {}
+
+
+def session_data():
+    jwt = ".".join(
+        base64.urlsafe_b64encode(secrets.token_bytes(n)).decode().rstrip("=")
+        for n in (27, 60, 32)
+    )
+    return {"jwt_token": jwt, "csrf_token": secrets.token_hex(32)}
+
+
+def storages():
+    yield "cbc+json", EncryptedCookieStorage(KEY)
+    yield "gcm+json", AEADCookieStorage(KEY, serializer="json")
+    if session_module.msgpack is not None:
+        yield "gcm+msgpack", AEADCookieStorage(KEY, serializer="msgpack")
+    yield "server+mem", ServerSideStorage(KEY, MemoryBackend())
+    yield "server+sql", ServerSideStorage(KEY, SQLBackend(create_engine("sqlite://")))
+
+
+def cookie_of(storage, data):
+    request = FakeRequest(None)
+    session = storage.load_session(request)
+    session.update(data)
+    response = Response()
+    storage.save_session(request, response, session)
+    return response._cookies["MITAMA_SESSION"].value
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = session_data()
+    print("%-12s %12s %12s %12s %8s" % ("storage", "load", "load+save", "unchanged", "cookie"))
+    for label, storage in storages():
+        cookie = cookie_of(storage, data)
+        request = FakeRequest(cookie)
+
+        def load():
+            storage.load_session(request)
+
+        def save():
+            session = storage.load_session(request)
+            session["csrf_token"] = secrets.token_hex(32)
+            storage.save_session(request, Response(), session)
+
+        def unchanged():
+            session = storage.load_session(request)
+            session["jwt_token"] = data["jwt_token"]
+            storage.save_session(request, Response(), session)
+
+        results = [
+            min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+            for func in (load, save, unchanged)
+        ]
+        print("%-12s %9.1f us %9.1f us %9.1f us %8d" % tuple([label] + results + [len(cookie)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""静的ファイルの配信のベンチマーク
+
+大きさの違うファイル（既定では4KBと1MB）について、
+従来のStaticFileControllerのようにguess_typeしてファイル全体を読み込む場合と、
+StaticFilesでレスポンスを作る場合（200と、If-None-Matchが一致した304）の1回あたりの時間を比較します。
+StaticFilesの200は、wsgi.file_wrapperに渡すところまで（中身の送信はサーバーが行います）を測ります。
+
+    python -m benchmarks.bench_static [回数]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from mimetypes import guess_type
+from pathlib import Path
+from wsgiref.util import FileWrapper, setup_testing_defaults
+
+from mitama.app.http import Request, Response
+from mitama.app.http.static import StaticFiles
+
+
+def legacy(root, path):
+    filename = root / path
+    if filename.is_file():
+        mime = guess_type(str(filename)) or ("application/octet-stream",)
+        with open(filename, "rb") as f:
+            return Response(body=f.read(), content_type=mime[0])
+
+
+def send(response, request):
+    body = response.start(request, lambda status, headers: None)
+    if hasattr(body, "close"):
+        body.close()
+
+
+def make_request(**headers):
+    env = {"REQUEST_METHOD": "GET", "PATH_INFO": "/", "wsgi.file_wrapper": FileWrapper}
+    env.update(headers)
+    setup_testing_defaults(env)
+    return Request(env)
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    root = Path(tempfile.mkdtemp())
+    try:
+        sizes = (("small.js", 4 * 1024), ("large.js", 1024 * 1024))
+        for name, size in sizes:
+            (root / name).write_bytes(os.urandom(size))
+        files = StaticFiles([root])
+        print("%-10s %-22s %10s" % ("file", "handler", "time"))
+        for name, _ in sizes:
+            request = make_request()
+            etag = files.response(request, name).headers["ETag"]
+            revalidate = make_request(HTTP_IF_NONE_MATCH=etag)
+            cases = (
+                ("read()", lambda: send(legacy(root, name), request)),
+                ("StaticFiles 200", lambda: send(files.response(request, name), request)),
+                ("StaticFiles 304", lambda: send(files.response(revalidate, name), revalidate)),
+            )
+            for label, func in cases:
+                print("%-10s %-22s %7.1f us" % (name, label, measure(func, repeat) * 1e6))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,12 +15,16 @@ class Controller:
 
     メソッドを記述すると、それをリクエスト処理に利用できる。
     ルーティング時にメソッドを特に指定しない場合はhandleメソッドが実行される。
+    lifecycleに"singleton"を指定すると、インスタンスはアプリとルートごとに一度だけ生成され、全てのリクエストで共有される。
+    この場合、複数のスレッドやgreenletから同時にメソッドが呼ばれるので、リクエスト固有のデータはselfではなくRequestに持たせること。
     :param app: Controllerを起動するAppのインスタンスの参照
     :param view: Controllerが利用するJinja2のEnvironmentインスタンス
+    :param lifecycle: "request"（リクエストごとに生成）または"singleton"（一度だけ生成して使い回す）
     """
 
     app = None
     view = None
+    lifecycle = "request"
 
     def __init__(self, app=None):
         self.app = app
@@ -49,10 +53,17 @@ class Middleware(metaclass=ABCMeta):
     """Requestを加工するMiddlewareの抽象クラス
 
     processメソッドによって受け取ったRequestを変更し、handler（次のMiddleware、またはControllerのメソッド）に受け渡す。
+    processをasync defで定義した場合、handlerはawaitできる関数になる。
+    同期的なprocessに加えてasync defのprocess_asyncを定義すると、ASGIで内側にasync defの処理がある場合はprocess_asyncが使われ、
+    ワーカースレッドを占有しない。
+    lifecycleの扱いはControllerと同じで、"singleton"の場合はリクエスト固有のデータをselfに持たせてはならない。
     :param app: Middlewareを起動するAppのインスタンスの参照
     :param view: Middlewareが利用するJinja2のEnvironmentインスタンス
+    :param lifecycle: "request"（リクエストごとに生成）または"singleton"（一度だけ生成して使い回す）
     """
 
+    lifecycle = "request"
+
     def __init__(self, app=None):
         self.app = app
         if app:
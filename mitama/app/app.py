@@ -1,31 +1,97 @@
 #!/usr/bin/python
 import os
+import threading
 from base64 import b64encode
+from collections import OrderedDict
 from pathlib import Path
 
-import magic
 import markdown
 import traceback
-from jinja2 import Markup, Environment, ChoiceLoader, FileSystemLoader
+from jinja2 import (
+    BytecodeCache,
+    Markup,
+    Environment,
+    ChoiceLoader,
+    FileSystemLoader
+)
 import uuid
 
-from mitama.noimage import load_noimage_app
+from mitama.mime import guess_mime
+from mitama.noimage import assets, load_noimage_app
 
+from .asgi import call, serve
 from .http import Request, Response
+from .router import Router
 from mitama.db import DatabaseManager
 
 
 def dataurl(blob):
-    f = magic.Magic(mime=True, uncompress=True)
-    mime = f.from_buffer(blob)
-    return "data:" + mime + ";base64," + b64encode(blob).decode()
+    asset = assets.find(blob)
+    if asset is not None:
+        return asset.dataurl
+    return "data:" + guess_mime(blob) + ";base64," + b64encode(blob).decode()
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """上限付きのメモリ上のバイトコードキャッシュ
+
+    コンパイル済みのテンプレートのバイトコードを、最近使われた順に最大capacity件まで保持します。
+    全アプリで共有するので、ツールキットのテンプレートは一度だけコンパイルされます。
+    :param capacity: 保持するテンプレートの最大数
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load_bytecode(self, bucket):
+        with self._lock:
+            code = self._buckets.get(bucket.key)
+            if code is not None:
+                self._buckets.move_to_end(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        code = bucket.bytecode_to_string()
+        with self._lock:
+            self._buckets[bucket.key] = code
+            self._buckets.move_to_end(bucket.key)
+            while len(self._buckets) > self.capacity:
+                self._buckets.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+bytecode_cache = MemoryBytecodeCache()
 
 
 class App:
+    """アプリの基底クラス
+
+    ルーティングテーブルとテンプレートのEnvironmentはアプリごとに一度だけ生成し、以降のリクエストでは使い回します。
+    開発中にテンプレートの変更を即座に反映したい場合は、 :samp:`template_auto_reload = True` を指定してください。
+    :param template_dir: テンプレートを置くディレクトリ
+    :param template_auto_reload: テンプレートの更新を検知して再読み込みするかどうか
+    :param template_cache_size: Environmentが保持するテンプレートの最大数
+    :param asgi_executor: ASGIで起動した時に同期的な処理を実行するExecutor（Noneの場合はイベントループの既定のもの）
+    """
+
     template_dir = "templates"
+    template_auto_reload = False
+    template_cache_size = 400
+    asgi_executor = None
     description = ""
     name = ""
     models = list()
+    _view = None
+    _router = None
 
     @property
     def icon(self):
@@ -47,11 +113,28 @@ class App:
         self.install_dir = Path(install_dir)
         self.params = kwargs
         self.router._app = self
+        self.router.freeze()
         self.init_app()
 
     def init_app(self):
         pass
 
+    @property
+    def router(self):
+        """アプリのルーティングテーブル"""
+        if self._router is None:
+            self._router = self.create_router()
+        return self._router
+
+    def create_router(self):
+        """ルーティングテーブルを生成します
+
+        アプリの起動時に一度だけ呼び出され、返したRouterは凍結されて全てのリクエストで使い回されます。
+        クラス変数routerにRouterインスタンスを直接指定することもできます。
+        :return: Routerインスタンス
+        """
+        return Router()
+
     def wsgi(self, env, start_response):
         request = Request(env)
         try:
@@ -62,6 +145,44 @@ class App:
             body = self.error(request, 500).start(request, start_response)
         return body
 
+    async def asgi(self, scope, receive, send):
+        """ASGIのエントリポイント
+
+        uvicornなどのASGIサーバーから :samp:`project.asgi` として起動できます。
+        ルーティングとasync defのControllerやMiddlewareはイベントループ上で、同期的なものはasgi_executorで実行します。
+        """
+        await serve(self, scope, receive, send, self.asgi_executor)
+
+    async def handle_asgi(self, env, start_response):
+        """wsgiメソッドのASGI版です
+
+        :param env: WSGIのenviron
+        :param start_response: WSGIのstart_response
+        :return: レスポンスのボディ
+        """
+        request = Request(env)
+        try:
+            response = await self.dispatch(request)
+            body = response.start(request, start_response)
+        except Exception:
+            print(traceback.format_exc())
+            body = self.error(request, 500).start(request, start_response)
+        return body
+
+    async def dispatch(self, request):
+        """__call__のASGI版です
+
+        ルーティングはイベントループ上で行い、マッチしたハンドラはmitama.app.asgi.callで実行します。
+        :param request: Requestインスタンス
+        :return: Responseインスタンス
+        """
+        request.app = self
+        result = self.router.match(request)
+        if not result:
+            return self.error(request, 404)
+        request, handle, method = result
+        return await call(handle, request)
+
     def __call__(self, request):
         if not isinstance(request, Request):
             request = Request.from_request(request)
@@ -110,12 +231,26 @@ class App:
 
     @property
     def view(self):
+        """アプリが利用するJinja2のEnvironmentインスタンス"""
+        if self._view is None:
+            self._view = self.create_view()
+        return self._view
+
+    def create_view(self):
+        """Jinja2のEnvironmentを生成します
+
+        フィルタやグローバル変数を追加したい場合は、このメソッドをオーバーライドしてください。
+        :return: Environmentインスタンス
+        """
         toolkit = Path(os.path.dirname(__file__)) / "templates"
-        self._view = Environment(
+        view = Environment(
             loader=ChoiceLoader([
                 FileSystemLoader(self.install_dir / self.template_dir),
                 FileSystemLoader(toolkit),
-            ])
+            ]),
+            auto_reload=self.template_auto_reload,
+            cache_size=self.template_cache_size,
+            bytecode_cache=bytecode_cache,
         )
 
         def filter_user(arg):
@@ -146,16 +281,19 @@ class App:
                 )
             )
 
-        self._view.filters["user"] = filter_user
-        self._view.filters["group"] = filter_group
-        self._view.filters["markdown"] = markdown_
-        self._view.globals.update(
+        view.filters["user"] = filter_user
+        view.filters["group"] = filter_group
+        view.filters["markdown"] = markdown_
+        from mitama.utils.icons import icon_url
+
+        view.globals.update(
             url=self.convert_url,
             fullurl=self.convert_fullurl,
             dataurl=dataurl,
+            icon_url=icon_url,
             uuid=uuid.uuid4
         )
-        return self._view
+        return view
 
     def error(self, request, code):
         template = self.view.get_template(str(code) + ".html")
@@ -172,64 +310,30 @@ class App:
                 request.app = self
                 return handle(request)
 
+            coroutine = getattr(handle, "coroutine", None)
+            if coroutine is not None:
+                async def _handle_async(request):
+                    request.app = self
+                    return await coroutine(request)
+
+                _handle.coroutine = _handle_async
             return request, _handle, method
 
     def save_params(self):
         self.params
 
     def uninstall(self):
+        from mitama.db.migration import Migrator
+
         db = DatabaseManager()
         for model in self.models:
             model.__table__.drop(db.engine)
+        migrator = Migrator(db.engine)
+        for prefix in set(getattr(model, "prefix", None) for model in self.models):
+            if prefix is not None:
+                migrator.forget(prefix)
 
     def model(self, modelname):
         for model in self.models:
             if model.__name__ == modelname:
                 return model
-
-
-def _session_middleware():
-    import base64
-
-    from Crypto.Random import get_random_bytes
-
-    from mitama.app import Middleware
-    from mitama.app.http.session import EncryptedCookieStorage
-
-    if "MITAMA_SESSION_KEY" in os.environ:
-        session_key = os.environ["MITAMA_SESSION_KEY"]
-    elif os.path.exists(".tmp/MITAMA_SESSION_KEY"):
-        with open(".tmp/MITAMA_SESSION_KEY", "r") as f:
-            session_key = f.read()
-    else:
-        key = get_random_bytes(16)
-        session_key = base64.urlsafe_b64encode(key).decode("utf-8")
-        if not os.path.exists(".tmp"):
-            os.mkdir(".tmp")
-        with open(".tmp/MITAMA_SESSION_KEY", "w") as f:
-            f.write(session_key)
-
-    class SessionMiddleware(Middleware):
-        fernet_key = session_key
-
-        def __init__(self):
-            secret_key = base64.urlsafe_b64decode(self.fernet_key.encode("utf-8"))
-            cookie_storage = EncryptedCookieStorage(secret_key)
-            self.storage = cookie_storage
-
-        def process(self, request, handler):
-            request["mitama_session_storage"] = self.storage
-            raise_response = False
-            response = handler(request)
-            if not isinstance(response, Response):
-                return response
-            session = request.get("mitama_session")
-            if session is not None:
-                if session._changed:
-                    self.storage.save_session(request, response, session)
-            if raise_response:
-                raise response
-            return response
-
-    return SessionMiddleware
-
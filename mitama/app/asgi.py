@@ -0,0 +1,300 @@
+"""ASGIのエントリポイント
+
+    * uvicornやhypercornなどのASGIサーバーからMitamaを起動するためのアダプタです
+    * ルーティングはイベントループ上で行い、async defで定義したControllerやMiddlewareのメソッドはイベントループ上で直接awaitします
+    * 同期的なControllerやMiddlewareだけをExecutorで実行するので、async defのロングポーリングやWebSocketはスレッドを占有しません
+    * 同期的なMiddlewareの内側のasync defの処理は、そのMiddlewareを実行しているワーカースレッドからイベントループに渡します
+    * async defのMiddlewareから呼ばれる同期的なハンドラは、そのMiddlewareを待っているワーカースレッドがあればそこで実行するので、
+      同時に処理するリクエストがスレッドプールの大きさを超えてもデッドロックしません
+    * レスポンスのボディは、チャンクが作られるたびに送ります（FileResponseなどは全体をメモリに読み込みません）
+"""
+
+import asyncio
+import contextvars
+import inspect
+import io
+import queue
+import threading
+
+_context = threading.local()
+_calls = contextvars.ContextVar("mitama_asgi_calls", default=None)
+_executor = contextvars.ContextVar("mitama_asgi_executor", default=None)
+
+
+def run_coroutine(coro):
+    """コルーチンを実行して結果を返します
+
+    ASGIのワーカースレッドから呼ばれた場合はイベントループ上でawaitし、それ以外の場合は新しいイベントループで実行します。
+    :param coro: コルーチン
+    :return: コルーチンの返り値
+    """
+    loop = getattr(_context, "loop", None)
+    if loop is None:
+        return asyncio.run(coro)
+    calls = queue.SimpleQueue()
+    future = asyncio.run_coroutine_threadsafe(
+        _restore(contextvars.copy_context(), calls, coro), loop
+    )
+    future.add_done_callback(lambda future: calls.put(None))
+    # コルーチンの完了を待つ間、コルーチンから頼まれた同期的なハンドラをこのスレッドで実行する
+    while True:
+        call = calls.get()
+        if call is None:
+            return future.result()
+        call()
+
+
+async def _restore(context, calls, coro):
+    # イベントループ側のタスクに、呼び出し元のスレッドのコンテキスト変数（DBのスコープなど）を引き継ぐ
+    for var, value in context.items():
+        var.set(value)
+    _calls.set(calls)
+    return await coro
+
+
+def _resolve(loop, future, context, handler, request):
+    try:
+        result = context.run(handler, request)
+    except BaseException as err:
+        loop.call_soon_threadsafe(_set_exception, future, err)
+    else:
+        loop.call_soon_threadsafe(_set_result, future, result)
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, err):
+    if not future.done():
+        future.set_exception(err)
+
+
+def awaitable(handler):
+    """同期的なハンドラを、awaitできる関数に変換します
+
+    async defで定義したMiddlewareのprocessには、この関数で変換したハンドラが渡されます。
+    ハンドラは、run_coroutineでそのMiddlewareの完了を待っているスレッドで実行します。
+    そのようなスレッドがない場合は、serveに渡したExecutor（なければイベントループの既定のもの）で実行します。
+    :param handler: Requestを受け取る関数
+    :return: Requestを受け取るコルーチン関数
+    """
+    async def call(request):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        calls = _calls.get()
+        if calls is None:
+            return await loop.run_in_executor(
+                _executor.get(), context.run, _in_worker, loop, handler, request
+            )
+        future = loop.create_future()
+        calls.put(lambda: _resolve(loop, future, context, handler, request))
+        return await future
+
+    return call
+
+
+def is_async(func):
+    return inspect.iscoroutinefunction(func)
+
+
+async def call(handler, request):
+    """ルーティングで得たハンドラをイベントループ上で実行します
+
+    async defの部分を含むハンドラ（coroutine属性を持つもの）はそのままawaitし、
+    同期的なハンドラはExecutorで実行します。
+    :param handler: Requestを受け取る関数
+    :param request: Requestインスタンス
+    :return: ハンドラの返り値
+    """
+    coroutine = getattr(handler, "coroutine", None)
+    if coroutine is not None:
+        return await coroutine(request)
+    return await awaitable(handler)(request)
+
+
+def _in_worker(loop, func, *args):
+    previous = getattr(_context, "loop", None)
+    _context.loop = loop
+    try:
+        return func(*args)
+    finally:
+        _context.loop = previous
+
+
+def _environ(scope, body):
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope.get("method", "GET"),
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "asgi.scope": scope,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = "HTTP_" + name
+        if key in environ:
+            environ[key] += "," + value
+        else:
+            environ[key] = value
+    environ.setdefault("HTTP_HOST", "%s:%s" % (host, port))
+    environ.setdefault("CONTENT_LENGTH", str(len(body)))
+    return environ
+
+
+class ASGIWebSocket:
+    """ASGIのWebSocketを、Request.websocketと同じインターフェースで扱うためのクラス
+
+    同期的なControllerからはreceive、send、closeを、async defのControllerからはareceive、asend、acloseを使ってください。
+    """
+
+    def __init__(self, loop, receive, send):
+        self._loop = loop
+        self._receive = receive
+        self._send = send
+        self.closed = False
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def receive(self):
+        return self._run(self.areceive())
+
+    def send(self, message):
+        self._run(self.asend(message))
+
+    def close(self, code=1000):
+        self._run(self.aclose(code))
+
+    async def areceive(self):
+        if self.closed:
+            return None
+        message = await self._receive()
+        if message["type"] == "websocket.disconnect":
+            self.closed = True
+            return None
+        if message.get("text") is not None:
+            return message["text"]
+        return message.get("bytes")
+
+    async def asend(self, message):
+        if isinstance(message, str):
+            event = {"type": "websocket.send", "text": message}
+        else:
+            event = {"type": "websocket.send", "bytes": bytes(message)}
+        await self._send(event)
+
+    async def aclose(self, code=1000):
+        if not self.closed:
+            self.closed = True
+            await self._send({"type": "websocket.close", "code": code})
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+async def serve(app, scope, receive, send, executor=None):
+    """ASGIのリクエストを処理します
+
+    :param app: リクエストを処理するApp（handle_asgiを呼び出します）
+    :param scope: ASGIのscope
+    :param receive: ASGIのreceive
+    :param send: ASGIのsend
+    :param executor: 同期的な処理を実行するExecutor（Noneの場合はイベントループの既定のもの）
+    """
+    loop = asyncio.get_running_loop()
+    _executor.set(executor)
+    result = dict()
+
+    def start_response(status, headers, exc_info=None):
+        result["status"] = status
+        result["headers"] = headers
+
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    elif scope["type"] == "http":
+        body = await _read_body(receive)
+        body = await app.handle_asgi(_environ(scope, body), start_response)
+        try:
+            if isinstance(body, (list, tuple)):
+                chunks = None
+                first = b"".join(body)
+            else:
+                # start_responseは最初のチャンクを取得するまで呼ばれないことがある
+                chunks = iter(body)
+                first = await loop.run_in_executor(
+                    executor, _in_worker, loop, next, chunks, b""
+                )
+            await send({
+                "type": "http.response.start",
+                "status": int(result["status"].split(" ")[0]),
+                "headers": [
+                    (k.encode("latin-1"), str(v).encode("latin-1"))
+                    for k, v in result["headers"]
+                ],
+            })
+            if chunks is None:
+                # 既にメモリ上にあるボディは、まとめて送る
+                await send({"type": "http.response.body", "body": first})
+                return
+            chunk = first
+            while chunk is not None:
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": True,
+                })
+                chunk = await loop.run_in_executor(
+                    executor, _in_worker, loop, next, chunks, None
+                )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+    elif scope["type"] == "websocket":
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        websocket = ASGIWebSocket(loop, receive, send)
+        environ = _environ(scope, b"")
+        environ["wsgi.websocket"] = websocket
+        try:
+            body = await app.handle_asgi(environ, start_response)
+            if hasattr(body, "close"):
+                body.close()
+        finally:
+            await websocket.aclose()
@@ -0,0 +1,438 @@
+import inspect
+import re
+
+from .asgi import awaitable, is_async, run_coroutine
+from .method import _GroupRoute, _Path, _Route
+from .router import Router, RoutingError, _construct
+
+
+def _is_tail(mode, conf):
+    # スラッシュを跨いでマッチしうるワイルドカードは、それ以降のパスをまとめて照合する
+    return mode == "path" or (mode == "re" and conf is not None)
+
+
+def _compile_tokens(tokens):
+    pattern = ""
+    converters = list()
+    for key, mode, conf in tokens:
+        if mode:
+            mask, in_filter, out_filter = _Path.filters[mode](conf)
+            if not key:
+                pattern += "(?:%s)" % mask
+                continue
+            pattern += "(?P<%s>%s)" % (key, mask)
+            if in_filter:
+                converters.append((key, in_filter))
+        elif key:
+            pattern += re.escape(key)
+    return re.compile("^%s$" % pattern), tuple(converters)
+
+
+def _split_segments(path):
+    """ルールをスラッシュ区切りのセグメントのリストに分解します"""
+    parser = _Path(path)
+    segments = [[]]
+    for key, mode, conf in parser._itertoken(path):
+        if mode:
+            if mode == "default":
+                mode = _Path.default_filter
+            segments[-1].append((key, mode, conf))
+        elif key:
+            pieces = key.split("/")
+            if pieces[0]:
+                segments[-1].append((pieces[0], None, None))
+            for piece in pieces[1:]:
+                segments.append([(piece, None, None)] if piece else [])
+    return segments
+
+
+class _Entry:
+    def __init__(self, route, layers, prefix, order, slash=False):
+        self.route = route
+        self.prefix = prefix
+        self.slash = slash
+        self.methods = frozenset(getattr(route, "methods", ()))
+        self.wrappers = _wrappers(layers)
+        # Routerは各階層でパスの候補（末尾のスラッシュの有無）ごとにルートを登録順に試すので、その順に並ぶ順位にします
+        outer = tuple((0, index) for index in order[:-1])
+        self.ranks = (outer + ((0, order[-1]),), outer + ((1, order[-1]),))
+        self.handler = None
+        self.handlers = dict()
+
+    def rank(self, exact):
+        return self.ranks[0 if exact else 1]
+
+    def compose(self, handler, method):
+        """内側のルーティングが返したハンドラを合成します
+
+        Controllerのクラスはメソッドとの組ごとに一度だけ合成して使い回します。
+        リクエストごとに作られる関数は使い回せないので、ミドルウェアだけ使い回して毎回合成します。
+        """
+        if not inspect.isclass(handler):
+            return _compose(self.wrappers, handler, method)
+        key = (handler, method)
+        composed = self.handlers.get(key)
+        if composed is None:
+            composed = self.handlers.setdefault(key, _compose(self.wrappers, handler, method))
+        return composed
+
+
+class _Tail:
+    def __init__(self, regex, converters, leading, entry):
+        self.regex = regex
+        self.converters = converters
+        self.leading = leading
+        self.entry = entry
+
+
+class _Node:
+    __slots__ = ("static", "dynamic", "captures", "entries")
+
+    def __init__(self):
+        self.static = dict()
+        self.dynamic = list()
+        self.captures = dict()
+        self.entries = list()
+
+    def capture(self, regex, converters):
+        key = (regex.pattern, converters)
+        if key not in self.captures:
+            node = _Node()
+            self.captures[key] = node
+            self.dynamic.append(("capture", (regex, converters, node)))
+        return self.captures[key]
+
+
+class _Lookup:
+    def __init__(self, request, path):
+        self.request = request
+        self.method = request.method
+        self.path = re.sub("//+", "/", path)
+        self.slash = self.path.endswith("/")
+        self.segments = list()
+        self.offsets = list()
+        offset = 0
+        for segment in self.path.split("/"):
+            if segment:
+                self.segments.append(segment)
+                self.offsets.append(offset)
+            offset += len(segment) + 1
+
+    def rest(self, index, leading):
+        if index < len(self.segments):
+            start = self.offsets[index]
+        else:
+            start = len(self.path)
+        if leading and start > 0 and self.path[start - 1] == "/":
+            start -= 1
+        return self.path[start:]
+
+
+class Dispatcher:
+    """コンパイル済みのルーティングエンジン
+
+    Routerの木構造（Router、group、各ルート）を一度だけ平坦化し、パスをスラッシュで区切ったセグメント単位のトライ木に変換します。
+    静的なセグメントは辞書引きで、 :samp:`<id>` や :samp:`<id:int>` などのセグメントは事前にコンパイルした正規表現で照合し、
+    :samp:`<path:path>` のようにスラッシュを跨ぐものは残りのパスをまとめて照合します。
+    ルートの数によらず、パスの深さに比例した時間でリクエストを解決します。
+    連続したスラッシュは1つにまとめ、末尾のスラッシュの有無は区別せずにマッチします。
+    複数のルートがマッチする場合は、Routerと同じく末尾のスラッシュまで一致するものを、その中では先に登録したものを優先します。
+    各ルートのハンドラは、外側のRouterから順にミドルウェアを通ってControllerに至る1つの関数としてコンパイル時に合成されます。
+    Routerでないアプリなど、内側でルーティングするものが返したハンドラは、マッチした時に合成します（ミドルウェアのインスタンスは使い回します）。
+    async defで定義されたControllerのメソッドやMiddlewareのprocessは合成時に検出し、ASGIではイベントループ上で直接awaitします。
+    Routerと同じ :samp:`match(Request)` のインターフェースを持つので、Routerの代わりに使えます。
+    """
+
+    def __init__(self, router):
+        """初期化処理
+
+        :param router: コンパイルするRouterインスタンス
+        """
+        self.router = router
+        self.root = _Node()
+        self._flatten(router, (), "", ())
+
+    def _flatten(self, router, layers, prefix, order):
+        if router.middlewares:
+            layers = layers + (router,)
+        for index, route in enumerate(router.routes):
+            position = order + (index,)
+            if isinstance(route, Router):
+                self._flatten(route, layers, prefix, position)
+            elif isinstance(route, _GroupRoute):
+                path = str(route.path)
+                prefix_ = prefix if path in ("", "/") else prefix + path
+                self._flatten_target(route.router, layers, prefix_, position)
+            elif isinstance(route, _Route):
+                self._insert(route, layers, prefix, position)
+            else:
+                self._insert_opaque(route, layers, prefix, position)
+
+    def _flatten_target(self, target, layers, prefix, order):
+        from .app import App
+
+        if isinstance(target, Router):
+            self._flatten(target, layers, prefix, order)
+        elif isinstance(target, App) and isinstance(target.router, Router):
+            self._flatten(target.router, layers + (target,), prefix, order)
+        else:
+            self._insert_opaque(target, layers, prefix, order)
+
+    def _walk(self, segments):
+        node = self.root
+        for index, segment in enumerate(segments):
+            if all(mode is None for key, mode, conf in segment):
+                static = "".join(key for key, mode, conf in segment)
+                if static:
+                    node = node.static.setdefault(static, _Node())
+            elif any(_is_tail(mode, conf) for key, mode, conf in segment):
+                return node, index
+            else:
+                regex, converters = _compile_tokens(segment)
+                node = node.capture(regex, converters)
+        return node, None
+
+    def _insert(self, route, layers, prefix, order):
+        segments = _split_segments(prefix + route.path.raw)
+        slash = len(segments) > 1 and segments[-1] == []
+        entry = _Entry(route, layers, prefix, order, slash)
+        entry.handler = _compose(entry.wrappers, route.handler, route.method_name)
+        node, tail = self._walk(segments)
+        if tail is None:
+            node.entries.append(entry)
+            return
+        tokens = list()
+        for segment in segments[tail:]:
+            if tokens:
+                tokens.append(("/", None, None))
+            tokens.extend(segment)
+        regex, converters = _compile_tokens(tokens)
+        node.dynamic.append(("tail", _Tail(regex, converters, tail == 0, entry)))
+
+    def _insert_opaque(self, target, layers, prefix, order):
+        entry = _Entry(target, layers, prefix, order)
+        node, tail = self._walk(_split_segments(prefix))
+        node.dynamic.append(("opaque", entry))
+
+    def _convert(self, match, converters, params):
+        args = dict(params)
+        args.update(match.groupdict())
+        for name, converter in converters:
+            try:
+                args[name] = converter(args[name])
+            except ValueError:
+                return None
+        return args
+
+    def _tail(self, tail, rest):
+        """残りのパスを照合します。末尾のスラッシュを付け外ししてマッチした場合は完全な一致ではないものとします"""
+        match = tail.regex.match(rest)
+        exact = match is not None
+        if not exact:
+            match = tail.regex.match(rest[:-1] if rest.endswith("/") else rest + "/")
+            if match is None:
+                return None, exact
+        return match, exact
+
+    def _search(self, node, lookup, index, params, found):
+        segments = lookup.segments
+        if index == len(segments):
+            for entry in node.entries:
+                if lookup.method in entry.methods:
+                    found.append((entry.rank(entry.slash == lookup.slash), entry, params))
+        else:
+            child = node.static.get(segments[index])
+            if child is not None:
+                self._search(child, lookup, index + 1, params, found)
+        for kind, target in node.dynamic:
+            if kind == "capture":
+                if index == len(segments):
+                    continue
+                regex, converters, child = target
+                match = regex.match(segments[index])
+                if match is None:
+                    continue
+                args = self._convert(match, converters, params)
+                if args is not None:
+                    self._search(child, lookup, index + 1, args, found)
+            elif kind == "tail":
+                if lookup.method not in target.entry.methods:
+                    continue
+                match, exact = self._tail(target, lookup.rest(index, target.leading))
+                if match is None:
+                    continue
+                args = self._convert(match, target.converters, params)
+                if args is not None:
+                    found.append((target.entry.rank(exact), target.entry, args))
+            elif lookup.path.startswith(target.prefix):
+                found.append((target.rank(True), target, params))
+
+    def resolve(self, request):
+        """リクエストにマッチするルートを探索します
+
+        マッチしたルートのうち、Routerが先に試すものから順に確かめます。
+        :param request: Requestインスタンス
+        :return: マッチしたルートとパスパラメータのタプル、またはNone
+        """
+        path = request.subpath if hasattr(request, "subpath") else request.path
+        lookup = _Lookup(request, path)
+        found = list()
+        self._search(self.root, lookup, 0, dict(), found)
+        found.sort(key=lambda candidate: candidate[0])
+        for rank, entry, params in found:
+            request.subpath = lookup.path[len(entry.prefix):]
+            if entry.handler is not None:
+                request.params = params
+                return entry, params, None
+            result = entry.route.match(request)
+            if result is not False:
+                return entry, params, result
+        return None
+
+    def match(self, request):
+        result = self.resolve(request)
+        if result is None:
+            return False
+        entry, params, inner = result
+        if inner is None:
+            return request, entry.handler, None
+        request, handler, method = inner
+        return request, entry.compose(handler, method), None
+
+
+def _factory(cls):
+    """lifecycleに応じて、リクエストからインスタンスを取得する関数を作ります"""
+    if getattr(cls, "lifecycle", "request") != "singleton":
+        def create(request):
+            return _construct(cls, request)
+
+        return create
+    instances = dict()
+
+    def get(request):
+        app = getattr(request, "app", None)
+        instance = instances.get(app)
+        if instance is None:
+            instance = instances.setdefault(app, _construct(cls, request))
+        return instance
+
+    return get
+
+
+def _endpoint(result, method):
+    """Controllerなどのルーティング先から、(同期的なハンドラ, コルーチン関数)の組を作ります
+
+    コルーチン関数は、async defの部分を含む場合だけ作ります（それ以外はNoneです）。
+    """
+    if not inspect.isclass(result):
+        if not callable(result):
+            raise RoutingError(
+                "Unsupported interface object. Only callables and Controller instances are supported."
+            )
+        if is_async(result):
+            def endpoint(request):
+                return run_coroutine(result(request))
+
+            return endpoint, result
+        return result, getattr(result, "coroutine", None)
+    get = _factory(result)
+    if is_async(getattr(result, method or "handle", None)):
+        async def coroutine(request):
+            return await get(request)(request, method)
+
+        def endpoint(request):
+            return run_coroutine(coroutine(request))
+
+        return endpoint, coroutine
+    if method is None:
+        def endpoint(request):
+            return get(request)(request)
+    else:
+        def endpoint(request):
+            return get(request)(request, method)
+    return endpoint, None
+
+
+def _middleware(cls):
+    """Middlewareのクラスから、内側の(ハンドラ, コルーチン関数)を包む関数を作ります"""
+    get = _factory(cls)
+    if is_async(cls.process):
+        def wrap(handler, coroutine):
+            next_handler = coroutine if coroutine is not None else awaitable(handler)
+
+            async def process_async(request):
+                return await get(request).process(request, next_handler)
+
+            def process(request):
+                return run_coroutine(process_async(request))
+
+            return process, process_async
+
+        return wrap
+
+    if is_async(getattr(cls, "process_async", None)):
+        def wrap(handler, coroutine):
+            def process(request):
+                return get(request).process(request, handler)
+
+            if coroutine is None:
+                return process, None
+
+            async def process_async(request):
+                return await get(request).process_async(request, coroutine)
+
+            return process, process_async
+
+        return wrap
+
+    def wrap(handler, coroutine):
+        def process(request):
+            return get(request).process(request, handler)
+
+        # 内側にasync defの部分があれば、このMiddlewareはワーカースレッドで実行してからイベントループに戻る
+        return process, (awaitable(process) if coroutine is not None else None)
+
+    return wrap
+
+
+def _enter(app):
+    def wrap(handler, coroutine):
+        def enter(request):
+            request.app = app
+            return handler(request)
+
+        if coroutine is None:
+            return enter, None
+
+        async def enter_async(request):
+            request.app = app
+            return await coroutine(request)
+
+        return enter, enter_async
+
+    return wrap
+
+
+def _wrappers(layers):
+    """Routerのミドルウェアとアプリの切り替えを、内側から順にハンドラを包む関数のリストにします"""
+    wrappers = list()
+    for layer in reversed(layers):
+        if isinstance(layer, Router):
+            for middleware in reversed(layer.middlewares):
+                wrappers.append(_middleware(middleware))
+        else:
+            wrappers.append(_enter(layer))
+    return tuple(wrappers)
+
+
+def _compose(wrappers, result, method):
+    """ミドルウェアとアプリの切り替えを、外側から順に呼び出す1つの関数に合成します
+
+    async defの部分を含む場合は、ASGIからイベントループ上でawaitするためのコルーチン関数をcoroutine属性に入れます。
+    """
+    handler, coroutine = _endpoint(result, method)
+    for wrap in wrappers:
+        handler, coroutine = wrap(handler, coroutine)
+    if coroutine is not None:
+        handler.coroutine = coroutine
+    return handler
@@ -9,9 +9,31 @@ from .request import Request
 from .response import Response
 
 
-def run_app(app, port):
+def run_app(app, port, bind="localhost", workers=1, max_requests=0, graceful_timeout=30):
+    """アプリを起動します
+
+    workersに2以上を指定すると、待ち受けソケットを共有する複数のワーカープロセスをfork()して起動します。
+    :param app: wsgiメソッドを持つアプリ
+    :param port: 待ち受けるポート番号（bindにポートが含まれる場合はそちらが優先されます）
+    :param bind: 待ち受けるアドレス（:samp:`host` または :samp:`host:port`）
+    :param workers: ワーカープロセスの数
+    :param max_requests: 各ワーカーがこの数のリクエストを処理したら新しいワーカーに入れ替える（0の場合は無制限）
+    :param graceful_timeout: 停止時に処理中のリクエストを待つ秒数
+    """
+    from .prefork import PreforkServer, parse_bind
+
+    address = parse_bind(bind, port)
+    if workers > 1 or max_requests:
+        PreforkServer(
+            app,
+            address,
+            workers=max(workers, 1),
+            max_requests=max_requests,
+            graceful_timeout=graceful_timeout,
+        ).run()
+        return
     server = WSGIServer(
-        ("localhost", int(port)),
+        address,
         app.wsgi,
         handler_class=WebSocketHandler
     )
@@ -0,0 +1,190 @@
+"""プリフォーク型のサーバー
+
+    * マスタープロセスが待ち受けソケットを開き、それを共有するワーカープロセスをfork()で起動します
+    * ワーカーはそれぞれgeventのWSGIServerでリクエストを処理します
+    * SIGHUPで新しいワーカーを起動してから古いワーカーを停止する（グレースフルリスタート）
+    * SIGTERM、SIGINTで全てのワーカーの処理が終わるのを待ってから終了します
+"""
+
+import os
+import signal
+import socket
+import sys
+import time
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from geventwebsocket.handler import WebSocketHandler
+
+
+def parse_bind(bind, port):
+    """:samp:`host` または :samp:`host:port` 形式の文字列をアドレスのタプルに変換します
+
+    :param bind: 待ち受けるアドレス
+    :param port: bindにポートが含まれない場合に使うポート番号
+    :return: (host, port)のタプル
+    """
+    host = bind
+    if bind.startswith("["):
+        host, _, rest = bind[1:].partition("]")
+        if rest.startswith(":"):
+            port = rest[1:]
+    elif bind.count(":") == 1:
+        host, port = bind.split(":")
+    return host or "0.0.0.0", int(port)
+
+
+def create_listener(address, backlog=2048):
+    """ワーカー間で共有する待ち受けソケットを作ります"""
+    family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Worker:
+    """fork()された子プロセスでリクエストを処理するワーカー
+
+    :param app: wsgiメソッドを持つアプリ
+    :param listener: 共有された待ち受けソケット
+    :param max_requests: この数のリクエストを処理したら終了する（0の場合は無制限）
+    :param graceful_timeout: 停止時に処理中のリクエストを待つ秒数
+    """
+
+    def __init__(self, app, listener, max_requests=0, graceful_timeout=30):
+        self.app = app
+        self.listener = listener
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.requests = 0
+        self.server = None
+
+    def wsgi(self, env, start_response):
+        self.requests += 1
+        if self.max_requests and self.requests == self.max_requests:
+            gevent.spawn(self.stop)
+        return self.app.wsgi(env, start_response)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop(timeout=self.graceful_timeout)
+
+    def run(self):
+        from mitama.db import DatabaseManager
+
+        DatabaseManager.reinitialize()
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(self.stop))
+        self.server = WSGIServer(
+            self.listener,
+            self.wsgi,
+            handler_class=WebSocketHandler,
+        )
+        self.server.serve_forever()
+
+
+class PreforkServer:
+    """ワーカープロセスを管理するマスタープロセス
+
+    :param app: wsgiメソッドを持つアプリ
+    :param address: 待ち受けるアドレスのタプル
+    :param workers: ワーカープロセスの数
+    :param max_requests: 各ワーカーがこの数のリクエストを処理したら新しいワーカーに入れ替える（0の場合は無制限）
+    :param graceful_timeout: 停止時に処理中のリクエストを待つ秒数
+    """
+
+    def __init__(self, app, address, workers=2, max_requests=0, graceful_timeout=30):
+        self.app = app
+        self.address = address
+        self.workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.children = dict()
+        self.listener = None
+        self._reload = False
+        self._stop = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                Worker(
+                    self.app,
+                    self.listener,
+                    self.max_requests,
+                    self.graceful_timeout
+                ).run()
+            except BaseException:
+                status = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(status)
+        self.children[pid] = time.time()
+        return pid
+
+    def kill(self, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            self.children.pop(pid, None)
+
+    def reload(self):
+        old = list(self.children)
+        for _ in range(self.workers):
+            self.spawn()
+        self.kill(old)
+
+    def shutdown(self):
+        self.kill(list(self.children))
+        limit = time.time() + self.graceful_timeout
+        while self.children and time.time() < limit:
+            self.reap()
+            time.sleep(0.1)
+        self.kill(list(self.children), signal.SIGKILL)
+        self.reap()
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _on_stop(self, signum, frame):
+        self._stop = True
+
+    def run(self):
+        self.listener = create_listener(self.address)
+        host, port = self.listener.getsockname()[:2]
+        print("Listening on %s:%s with %d workers" % (host, port, self.workers))
+        sys.stdout.flush()
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        for _ in range(self.workers):
+            self.spawn()
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                self.reap()
+                for _ in range(self.workers - len(self.children)):
+                    self.spawn()
+                time.sleep(0.1)
+        finally:
+            self.shutdown()
+            self.listener.close()
@@ -233,6 +233,16 @@ class Request:
             self["mitama_session"] = sess
         return sess
 
+    def regenerate_session(self):
+        """セッションIDを振り直します
+
+        ログインやログアウトなど、ユーザーや権限が変わる時に呼び出してください。
+        :return: セッションの辞書データ
+        """
+        sess = self.session()
+        self.get("mitama_session_storage").regenerate(sess)
+        return sess
+
     @classmethod
     def parse_stream(cls, rfile, ssl=False):
         words = rfile.readline().decode().rstrip("\r\n").split(" ")
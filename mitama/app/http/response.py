@@ -25,6 +25,15 @@ class ResponseBase(metaclass=ABCMeta):
         for k, v in kwargs.items():
             self._cookies[key][k] = v or ""
 
+    def del_cookie(self, key, domain=None, path="/"):
+        self.set_cookie(
+            key,
+            "",
+            expires="Thu, 01 Jan 1970 00:00:00 GMT",
+            domain=domain,
+            path=path
+        )
+
     @abstractmethod
     def start(self, request, stream):
         pass
@@ -7,6 +7,16 @@ from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Util import Padding
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
 
 class Session(MutableMapping):
     def __init__(self, identity, *, data, new, max_age=None):
@@ -132,6 +142,16 @@ class EncryptedCookieStorage:
             data = {}
         return data
 
+    def regenerate(self, session):
+        """セッションを新しいものとして扱い、保存する時にCookieを作り直します
+
+        Cookieに中身を入れるストレージではサーバー側に古いセッションが残らないので、Cookieを作り直すだけです。
+        :param session: 振り直すセッション
+        """
+        session._new = True
+        session._loaded = None
+        session.changed()
+
     def load_session(self, request):
         cookie = self.load_cookie(request)
         if cookie is None:
@@ -195,3 +215,132 @@ class EncryptedCookieStorage:
             )
         else:
             response.set_cookie(self._cookie_name, cookie_data, **params_)
+
+
+class _JSONSerializer:
+    """区切りの空白を省いたJSON"""
+
+    version = 1
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, payload):
+        return json.loads(payload.decode("utf-8"))
+
+
+class _MsgpackSerializer:
+    version = 2
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class _GCM:
+    """AES-GCMの暗号化・復号
+
+    cryptographyがあれば、鍵スケジュールを保持したAESGCMを使い回します。
+    なければpycryptodomeで都度暗号器を作ります。どちらも nonce + 暗号文 + タグ の形式です。
+    """
+
+    def __init__(self, key):
+        self._key = bytes(key)
+        self._aead = AESGCM(self._key) if AESGCM is not None else None
+
+    def encrypt(self, nonce, data, aad):
+        if self._aead is not None:
+            return self._aead.encrypt(nonce, data, aad)
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(aad)
+        encrypted, tag = cipher.encrypt_and_digest(data)
+        return encrypted + tag
+
+    def decrypt(self, nonce, data, aad):
+        if self._aead is not None:
+            return self._aead.decrypt(nonce, data, aad)
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(aad)
+        return cipher.decrypt_and_verify(data[:-16], data[-16:])
+
+
+class AEADCookieStorage(EncryptedCookieStorage):
+    """AES-GCMで暗号化したセッションをCookieに保存するストレージ
+
+    EncryptedCookieStorageと違い、改ざんされたCookieは認証タグの検証で必ず弾かれます。
+
+    * Cookieは 形式のバージョン(1バイト) + nonce(12バイト) + 暗号文 + タグ(16バイト) をbase64urlにしたものです
+    * Cookie名を追加認証データにしているので、別のCookieの値を流用することはできません
+    * msgpackがインストールされていればmsgpackで、なければ空白を省いたJSONでシリアライズします
+    * 読み込んだ時から内容が変わっていなければ、暗号化し直さずに保存を省略します
+
+    :param secret_key: 16、24、32バイトのいずれかの鍵
+    :param serializer: "msgpack"、"json"、またはNone（msgpackがあればmsgpack）
+    """
+
+    NONCE_SIZE = 12
+
+    def __init__(self, secret_key, *, serializer=None, **kwargs):
+        super().__init__(secret_key, **kwargs)
+        if serializer is None:
+            serializer = "msgpack" if msgpack is not None else "json"
+        if serializer == "msgpack":
+            if msgpack is None:
+                raise ImportError("msgpack is required for serializer='msgpack'")
+            self._serializer = _MsgpackSerializer()
+        elif serializer == "json":
+            self._serializer = _JSONSerializer()
+        else:
+            raise ValueError("Unknown serializer: %s" % serializer)
+        self._serializers = {_JSONSerializer.version: _JSONSerializer()}
+        if msgpack is not None:
+            self._serializers[_MsgpackSerializer.version] = _MsgpackSerializer()
+        self._cipher = _GCM(self.secret_key)
+        self._aad = self._cookie_name.encode("utf-8")
+
+    def encode(self, data):
+        """セッションのデータをCookieの値にします"""
+        version = self._serializer.version
+        nonce = get_random_bytes(self.NONCE_SIZE)
+        encrypted = self._cipher.encrypt(nonce, self._serializer.dumps(data), self._aad)
+        token = base64.urlsafe_b64encode(bytes((version,)) + nonce + encrypted)
+        return token.rstrip(b"=").decode("ascii")
+
+    def decode(self, cookie):
+        """Cookieの値をセッションのデータに戻します
+
+        :return: (データ, シリアライズされたデータ)
+        """
+        token = cookie.encode("ascii")
+        raw = base64.urlsafe_b64decode(token + b"=" * (-len(token) % 4))
+        serializer = self._serializers.get(raw[0]) if raw else None
+        if serializer is None:
+            raise ValueError("Unknown session cookie format")
+        nonce = raw[1:1 + self.NONCE_SIZE]
+        payload = self._cipher.decrypt(nonce, raw[1 + self.NONCE_SIZE:], self._aad)
+        return serializer.loads(payload), (serializer.version, payload)
+
+    def load_session(self, request):
+        cookie = self.load_cookie(request)
+        if cookie:
+            try:
+                data, loaded = self.decode(cookie)
+                session = Session(None, data=data, new=False, max_age=self.max_age)
+                session._loaded = loaded
+                return session
+            except Exception:
+                pass
+        return Session(None, data=None, new=True, max_age=self.max_age)
+
+    def save_session(self, request, response, session):
+        if session.empty:
+            if self.load_cookie(request):
+                self.save_cookie(response, "", max_age=session.max_age)
+            return
+        data = self._get_session_data(session)
+        loaded = getattr(session, "_loaded", None)
+        if loaded is not None and loaded == (self._serializer.version, self._serializer.dumps(data)):
+            return
+        self.save_cookie(response, self.encode(data), max_age=session.max_age)
@@ -0,0 +1,374 @@
+#!/usr/bin/python
+"""サーバー側にセッションを保存するストレージ
+
+    * Cookieには署名付きのセッションIDだけを入れ、セッションの中身はバックエンドに保存します
+    * Cookieの長さと、リクエストごとの暗号処理（HMACの検証1回）はセッションの中身によらず一定です
+    * バックエンドはget/set/delete/touch/sweepを実装したオブジェクトで、次のものを用意しています
+
+        * MemoryBackend: プロセス内のLRU（複数のワーカーで起動する場合はワーカー間で共有されません）
+        * SQLBackend: DatabaseManagerのEngineを使うmitama_sessionテーブル
+        * RedisBackend: Redisプロトコルを話すサーバー（Redisや互換のサーバー）
+
+    .. code-block:: python
+
+        from mitama.app.http.session_store import ServerSideStorage, SQLBackend
+
+        project = Project(
+            ...,
+            session_storage=lambda key: ServerSideStorage(key, SQLBackend()),
+        )
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, Float, LargeBinary, MetaData, String, Table
+
+from .session import EncryptedCookieStorage, Session
+
+
+class MemoryBackend:
+    """プロセス内のLRUにセッションを保存するバックエンド
+
+    :param maxsize: 保持するセッションの最大数（超えたら最も長く使われていないものから捨てます）
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, sid):
+        """(データ, 有効期限)を返します。なければNoneを返します"""
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return entry
+
+    def set(self, sid, payload, ttl):
+        with self._lock:
+            self._data[sid] = (payload, time.time() + ttl)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def touch(self, sid, ttl):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is not None:
+                self._data[sid] = (entry[0], time.time() + ttl)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def sweep(self):
+        """有効期限の切れたセッションを削除し、削除した数を返します"""
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, entry in self._data.items() if entry[1] <= now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+class SQLBackend:
+    """データベースのテーブルにセッションを保存するバックエンド
+
+    テーブルは最初に使う時に作ります。クエリはリクエストのSessionとは別の接続で実行します。
+    :param engine: 使うEngine（省略した場合はDatabaseManagerのEngine）
+    :param table_name: テーブル名
+    """
+
+    def __init__(self, engine=None, table_name="mitama_session"):
+        self._engine = engine
+        self.table = Table(
+            table_name,
+            MetaData(),
+            Column("sid", String(64), primary_key=True),
+            Column("data", LargeBinary),
+            Column("expires_at", Float, index=True),
+        )
+        self._created = False
+
+    @property
+    def engine(self):
+        if self._engine is not None:
+            return self._engine
+        from mitama.db import DatabaseManager
+        return DatabaseManager.engine
+
+    def _ensure_table(self):
+        if not self._created:
+            self.table.create(bind=self.engine, checkfirst=True)
+            self._created = True
+
+    def get(self, sid):
+        self._ensure_table()
+        table = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                table.select().where(table.c.sid == sid)
+            ).first()
+        if row is None or row["expires_at"] <= time.time():
+            return None
+        return bytes(row["data"]), row["expires_at"]
+
+    def set(self, sid, payload, ttl):
+        self._ensure_table()
+        table = self.table
+        values = dict(data=payload, expires_at=time.time() + ttl)
+        with self.engine.begin() as conn:
+            result = conn.execute(table.update().where(table.c.sid == sid).values(**values))
+            if result.rowcount == 0:
+                conn.execute(table.insert().values(sid=sid, **values))
+
+    def touch(self, sid, ttl):
+        self._ensure_table()
+        table = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                table.update().where(table.c.sid == sid)
+                .values(expires_at=time.time() + ttl)
+            )
+
+    def delete(self, sid):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def sweep(self):
+        self._ensure_table()
+        table = self.table
+        with self.engine.begin() as conn:
+            result = conn.execute(table.delete().where(table.c.expires_at <= time.time()))
+        return result.rowcount
+
+
+class RedisBackend:
+    """Redisプロトコル（RESP）を話すサーバーにセッションを保存するバックエンド
+
+    有効期限はサーバー側のEXで管理するので、sweepは何もしません。
+    接続はスレッド（greenlet）ごとに1つ作って使い回します。
+    :param host: ホスト
+    :param port: ポート
+    :param db: SELECTするデータベース番号
+    :param prefix: キーの接頭辞
+    :param timeout: ソケットのタイムアウト（秒）
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, prefix="mitama:session:", timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.db:
+                self._command("SELECT", self.db)
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def _read(self, rfile):
+        line = rfile.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            return rfile.read(size + 2)[:-2]
+        if kind == b"*":
+            size = int(rest)
+            if size < 0:
+                return None
+            return [self._read(rfile) for _ in range(size)]
+        raise RuntimeError("Unknown reply: %r" % line)
+
+    def _encode(self, args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _pipeline(self, *commands):
+        """複数のコマンドを1往復で送り、返事のリストを返します"""
+        sock, rfile = self._connection()
+        try:
+            sock.sendall(b"".join(self._encode(args) for args in commands))
+            replies = list()
+            for _ in commands:
+                try:
+                    replies.append(self._read(rfile))
+                except RuntimeError as err:
+                    replies.append(err)
+        except (OSError, ConnectionError):
+            self._close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RuntimeError):
+                raise reply
+        return replies
+
+    def _command(self, *args):
+        return self._pipeline(args)[0]
+
+    def get(self, sid):
+        key = self.prefix + sid
+        payload, pttl = self._pipeline(("GET", key), ("PTTL", key))
+        if payload is None:
+            return None
+        if pttl < 0:
+            return payload, float("inf")
+        return payload, time.time() + pttl / 1000
+
+    def set(self, sid, payload, ttl):
+        self._command("SET", self.prefix + sid, payload, "EX", max(int(ttl), 1))
+
+    def touch(self, sid, ttl):
+        self._command("EXPIRE", self.prefix + sid, max(int(ttl), 1))
+
+    def delete(self, sid):
+        self._command("DEL", self.prefix + sid)
+
+    def sweep(self):
+        return 0
+
+
+class ServerSideStorage(EncryptedCookieStorage):
+    """セッションをバックエンドに保存し、CookieにはセッションIDだけを入れるストレージ
+
+    * セッションIDはランダムな32バイトで、鍵によるHMACの署名を付けてCookieに入れます
+    * 内容が変わらないリクエストではバックエンドに書き込まず、有効期限が残り半分を切った時だけ延長します
+    * sweep_interval秒ごとに、有効期限の切れたセッションをバックエンドから削除します
+    * ログインなどで権限が変わる時はregenerateでセッションIDを振り直します（セッション固定攻撃の対策）
+
+    :param secret_key: 署名の鍵
+    :param backend: MemoryBackend、SQLBackend、RedisBackendなどのバックエンド
+    :param ttl: 最後に使われてからセッションを保持する秒数
+    :param sweep_interval: 期限切れのセッションを削除する間隔（秒）
+    """
+
+    def __init__(self, secret_key, backend=None, *, ttl=86400, sweep_interval=60, **kwargs):
+        super().__init__(secret_key, **kwargs)
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._sweep_lock = threading.Lock()
+
+    def _sign(self, sid):
+        digest = hmac.new(self.secret_key, sid.encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode("ascii")
+
+    def _sid(self, cookie):
+        sid, _, signature = cookie.partition(".")
+        if sid and hmac.compare_digest(signature, self._sign(sid)):
+            return sid
+        return None
+
+    def _dumps(self, data):
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def maybe_sweep(self):
+        """前回からsweep_interval秒経っていれば、期限切れのセッションを削除します"""
+        if time.monotonic() < self._next_sweep or not self._sweep_lock.acquire(False):
+            return
+        try:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.backend.sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def regenerate(self, session):
+        """セッションIDを振り直します
+
+        古いIDのレコードはすぐに削除し、新しいIDは保存する時に発行してCookieに入れます。
+        :param session: 振り直すセッション
+        """
+        if session.identity is not None:
+            self.backend.delete(session.identity)
+        session._identity = None
+        session._new = True
+        session._loaded = None
+        session.changed()
+
+    def load_session(self, request):
+        self.maybe_sweep()
+        cookie = self.load_cookie(request)
+        sid = self._sid(cookie) if cookie else None
+        entry = self.backend.get(sid) if sid is not None else None
+        if entry is None:
+            return Session(None, data=None, new=True, max_age=self.max_age)
+        payload, expires_at = entry
+        try:
+            data = json.loads(payload.decode("utf-8"))
+        except ValueError:
+            return Session(None, data=None, new=True, max_age=self.max_age)
+        session = Session(sid, data=data, new=False, max_age=self.max_age)
+        session._loaded = payload
+        if expires_at - time.time() < self.ttl / 2:
+            self.backend.touch(sid, self.ttl)
+        return session
+
+    def save_session(self, request, response, session):
+        sid = session.identity
+        if session.empty:
+            if sid is not None:
+                self.backend.delete(sid)
+            if self.load_cookie(request):
+                self.save_cookie(response, "", max_age=session.max_age)
+            return
+        payload = self._dumps(self._get_session_data(session))
+        if sid is not None and payload == getattr(session, "_loaded", None):
+            return
+        if sid is None:
+            sid = secrets.token_urlsafe(32)
+            session._identity = sid
+        self.backend.set(sid, payload, self.ttl)
+        session._loaded = payload
+        if session.new or self.load_cookie(request) is None:
+            self.save_cookie(
+                response,
+                sid + "." + self._sign(sid),
+                max_age=session.max_age
+            )
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+"""静的ファイルの配信
+
+    * パスの解決（ファイルの実体、MIMEタイプ、圧縮済みのファイルの有無）は最初のリクエストで行い、結果を保持します
+    * 以降のリクエストでは、ファイルのstatを1回取るだけでレスポンスを作ります
+    * ETagとLast-Modifiedはstatから作り、If-None-MatchやIf-Modified-Sinceが一致すれば304を返します
+    * Rangeヘッダーで指定された範囲（1つだけ）を206で返します
+    * :file:`style.css.br` や :file:`style.css.gz` があれば、Accept-Encodingに応じてそちらを返します
+    * ファイルの中身はwsgi.file_wrapperがあればそれに渡し、サーバーがsendfileなどで送ります
+
+    .. code-block:: python
+
+        from mitama.app.http.static import StaticFiles
+
+        files = StaticFiles([Path("static")], cache_control="public, max-age=3600")
+        response = files.response(request, "css/style.css")
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+
+from .response import Response
+
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class FileResponse(Response):
+    """ファイルの中身を返すレスポンス
+
+    :param filename: ファイルのパス
+    :param size: ファイルの大きさ
+    :param offset: 返す範囲の先頭
+    :param length: 返すバイト数
+    :param block_size: wsgi.file_wrapperがない場合に、一度に読み込むバイト数
+    """
+
+    def __init__(self, filename, size, offset, length, block_size=65536, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        self.size = size
+        self.offset = offset
+        self.length = length
+        self.block_size = block_size
+
+    def _read(self, f):
+        try:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(self.block_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    def start(self, request, start_response):
+        super().start(request, start_response)
+        if request is not None and request.method == "HEAD":
+            return []
+        f = open(self.filename, "rb")
+        environ = request.environ if request is not None else dict()
+        wrapper = environ.get("wsgi.file_wrapper")
+        if wrapper is not None and self.offset == 0 and self.length == self.size:
+            return wrapper(f, self.block_size)
+        return self._read(f)
+
+
+class _Entry:
+    __slots__ = ("filename", "mime", "variants", "validators")
+
+    def __init__(self, filename, mime, variants):
+        self.filename = filename
+        self.mime = mime
+        self.variants = variants
+        self.validators = dict()
+
+    def validate(self, filename, encoding, stat):
+        """statからETagとLast-Modifiedを返します（statが変わるまで使い回します）"""
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.validators.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        etag = '"%x-%x%s"' % (stat.st_mtime_ns, stat.st_size, "-" + encoding if encoding else "")
+        validators = (etag, formatdate(stat.st_mtime, usegmt=True))
+        self.validators[filename] = (key, validators)
+        return validators
+
+
+def parse_range(header, size):
+    """Rangeヘッダーを解釈します
+
+    :return: (先頭, 末尾)。範囲が不正な場合はFalse、無視する場合（複数の範囲など）はNone
+    """
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start == "":
+            suffix = int(end)
+            if suffix <= 0:
+                return False
+            return max(size - suffix, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _accepted(header):
+    """Accept-Encodingで受け入れられる（q=0でない）エンコーディングの集合を返します"""
+    accepted = set()
+    for value in header.split(","):
+        coding, _, param = value.partition(";")
+        param = param.strip()
+        if param.startswith("q="):
+            try:
+                if float(param[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    return etag in [tag.strip().replace("W/", "", 1) for tag in header.split(",")]
+
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+class StaticFiles:
+    """ディレクトリ内の静的ファイルを配信するエンジン
+
+    ファイルを追加・削除した場合、新しい圧縮済みのファイルはclear()するまで使われません。
+    :param paths: 配信するディレクトリのリスト（前にあるものを優先します）
+    :param cache_control: Cache-Controlヘッダーの値
+    :param index: ディレクトリを指定された時に返すファイル名
+    :param maxsize: 解決結果を保持するパスの最大数
+    :param block_size: 一度に送るバイト数
+    """
+
+    def __init__(self, paths, cache_control="no-cache", index="index.html", maxsize=4096, block_size=65536):
+        self.paths = paths
+        self.cache_control = cache_control
+        self.index = index
+        self.maxsize = maxsize
+        self.block_size = block_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def _find(self, path):
+        for root in self.paths:
+            root = os.path.realpath(root)
+            filename = os.path.realpath(os.path.join(root, path))
+            # ディレクトリの外（../やシンボリックリンクの先）は配信しません
+            if filename != root and not filename.startswith(root + os.sep):
+                continue
+            if os.path.isdir(filename):
+                filename = os.path.join(filename, self.index)
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def resolve(self, path):
+        """パスを解決します。見つからなければNoneを返します
+
+        :param path: ディレクトリからの相対パス
+        :return: _Entryインスタンス
+        """
+        path = path.lstrip("/")
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                return entry
+        filename = self._find(path)
+        if filename is None:
+            return None
+        mime = guess_type(filename)[0] or "application/octet-stream"
+        variants = tuple(
+            (encoding, filename + suffix)
+            for encoding, suffix in ENCODINGS
+            if os.path.isfile(filename + suffix)
+        )
+        entry = _Entry(filename, mime, variants)
+        with self._lock:
+            self._entries[path] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _forget(self, path):
+        with self._lock:
+            self._entries.pop(path.lstrip("/"), None)
+
+    def _select(self, request, entry):
+        """Accept-Encodingに応じて、(Content-Encoding, ファイルのパス)を選びます"""
+        if entry.variants and "HTTP_RANGE" not in request.environ:
+            accepted = _accepted(request.environ.get("HTTP_ACCEPT_ENCODING", ""))
+            for encoding, filename in entry.variants:
+                if encoding in accepted:
+                    return encoding, filename
+        return None, entry.filename
+
+    def response(self, request, path):
+        """ファイルを返すResponseを作ります。ファイルが見つからなければNoneを返します
+
+        :param request: Requestインスタンス
+        :param path: ディレクトリからの相対パス
+        """
+        for _ in range(2):
+            entry = self.resolve(path)
+            if entry is None:
+                return None
+            encoding, filename = self._select(request, entry)
+            try:
+                stat = os.stat(filename)
+                break
+            except FileNotFoundError:
+                # 保持していた解決結果が古くなったので、解決し直します
+                self._forget(path)
+        else:
+            return None
+        environ = request.environ
+        etag, last_modified = entry.validate(filename, encoding, stat)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Cache-Control": self.cache_control,
+            "Accept-Ranges": "bytes",
+        }
+        if entry.variants:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if "HTTP_IF_NONE_MATCH" in environ:
+            not_modified = _etag_matches(environ["HTTP_IF_NONE_MATCH"], etag)
+        else:
+            not_modified = _not_modified_since(environ.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime)
+        if not_modified:
+            return Response(status=304, headers=headers, content_type=entry.mime)
+        offset, length, status = 0, stat.st_size, 200
+        header = environ.get("HTTP_RANGE")
+        if header is not None and environ.get("HTTP_IF_RANGE", etag) == etag:
+            byte_range = parse_range(header, stat.st_size)
+            if byte_range is False:
+                headers["Content-Range"] = "bytes */%d" % stat.st_size
+                return Response(status=416, headers=headers, content_type=entry.mime)
+            if byte_range is not None:
+                offset, length, status = byte_range[0], byte_range[1] - byte_range[0] + 1, 206
+                headers["Content-Range"] = "bytes %d-%d/%d" % (byte_range + (stat.st_size,))
+        headers["Content-Length"] = str(length)
+        return FileResponse(
+            filename,
+            stat.st_size,
+            offset,
+            length,
+            block_size=self.block_size,
+            status=status,
+            headers=headers,
+            content_type=entry.mime,
+        )
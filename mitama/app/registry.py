@@ -6,7 +6,6 @@ from watchdog.observers import Observer
 
 from mitama._extra import _Singleton
 from mitama.app.http import Response
-from mitama.app.app import _session_middleware
 
 from .method import group
 from .router import Router
@@ -23,6 +22,7 @@ class AppRegistry(_Singleton):
     _map = dict()
     _server = None
     _router = None
+    project = None
 
     def __init__(self):
         super().__init__()
@@ -63,13 +63,17 @@ class AppRegistry(_Singleton):
 
         from mitama.app.method import view
         from mitama.utils.controllers import static_files
+        from mitama.utils.icons import IconController
         if self._router is None:
             app_mod_dir = Path(os.path.dirname(__file__))
             router = Router(
                 [
-                    view("/_mitama/<path:path>", static_files(app_mod_dir / "static"))
+                    view("/_mitama/icons/<kind>/<id>", IconController),
+                    view("/_mitama/<path:path>", static_files(app_mod_dir / "static")),
                 ],
-                middlewares=[_session_middleware()]
+                middlewares=[_session_middleware(
+                    getattr(self.project, "session_storage", None)
+                )]
             )
             for app in self:
                 router.add_route(group(app.path, app))
@@ -78,7 +82,11 @@ class AppRegistry(_Singleton):
 
 
 
-def _session_middleware():
+def _session_middleware(storage_factory=None):
+    """セッションを読み書きするMiddlewareを作ります
+
+    :param storage_factory: 鍵を受け取ってストレージを返す関数（省略した場合はEncryptedCookieStorage）
+    """
     import base64
 
     from Crypto.Random import get_random_bytes
@@ -101,27 +109,38 @@ def _session_middleware():
 
     class SessionMiddleware(Middleware):
         fernet_key = session_key
+        lifecycle = "singleton"
+        shared_storage = None
 
         def __init__(self, app = None):
             self.app = app
-            secret_key = base64.urlsafe_b64decode(
-                self.fernet_key.encode("utf-8")
-            )
-            cookie_storage = EncryptedCookieStorage(secret_key)
-            self.storage = cookie_storage
+            # Middlewareはアプリごとに作られるので、ストレージは全アプリで1つを共有します
+            cls = type(self)
+            if cls.shared_storage is None:
+                secret_key = base64.urlsafe_b64decode(
+                    self.fernet_key.encode("utf-8")
+                )
+                if storage_factory is None:
+                    cls.shared_storage = EncryptedCookieStorage(secret_key)
+                else:
+                    cls.shared_storage = storage_factory(secret_key)
+            self.storage = cls.shared_storage
 
         def process(self, request, handler):
             request["mitama_session_storage"] = self.storage
-            raise_response = False
-            response = handler(request)
+            return self.save(request, handler(request))
+
+        async def process_async(self, request, handler):
+            request["mitama_session_storage"] = self.storage
+            return self.save(request, await handler(request))
+
+        def save(self, request, response):
             if not isinstance(response, Response):
                 return response
             session = request.get("mitama_session")
             if session is not None:
                 if session._changed:
                     self.storage.save_session(request, response, session)
-            if raise_response:
-                raise response
             return response
 
     return SessionMiddleware
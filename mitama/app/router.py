@@ -7,6 +7,28 @@ class RoutingError(Exception):
     pass
 
 
+def _construct(cls, request):
+    if hasattr(request, "app"):
+        return cls(request.app)
+    else:
+        return cls()
+
+
+def _instantiate(cls, request, instances, key):
+    """ControllerやMiddlewareのクラスからインスタンスを取得します
+
+    lifecycleが"singleton"のクラスはkeyとアプリの組ごとに一度だけ生成し、以降のリクエストで使い回します。
+    それ以外のクラスはリクエストごとに生成します。
+    """
+    if getattr(cls, "lifecycle", "request") != "singleton":
+        return _construct(cls, request)
+    cache_key = (key, getattr(request, "app", None))
+    instance = instances.get(cache_key)
+    if instance is None:
+        instance = instances.setdefault(cache_key, _construct(cls, request))
+    return instance
+
+
 class Router:
     """ルーティングエンジン
 
@@ -16,6 +38,8 @@ class Router:
     """
 
     _app = None
+    _frozen = False
+    _dispatcher = None
 
     def __init__(self, routes=[], middlewares=[]):
         """初期化処理
@@ -29,6 +53,7 @@ class Router:
         self.add_routes(routes)
         self.add_middlewares(middlewares)
         self.i = 0
+        self._instances = dict()
 
     def add_route(self, route):
         """ルーティング先を追加します
@@ -36,6 +61,8 @@ class Router:
         mitama.app.methodの関数で生成したRouteインスタンスを与えてください。
         :param route: Routeインスタンス
         """
+        if self._frozen:
+            raise RoutingError("Can't add a route to a frozen Router.")
         if isinstance(route, Router):
             route._parent = self
         self.routes.append(route)
@@ -55,6 +82,8 @@ class Router:
         Middlewareクラスを与えると、このルーターのインスタンス内でマッチした場合にミドルウェアが順番に起動します。
         :param middleware: Middlewareのインスタンス
         """
+        if self._frozen:
+            raise RoutingError("Can't add a middleware to a frozen Router.")
         self.middlewares.append(middleware)
 
     def add_middlewares(self, middlewares):
@@ -69,7 +98,44 @@ class Router:
     def clone(self):
         return Router(routes=copy.copy(self.routes))
 
+    def compile(self):
+        """ルーティングテーブルをコンパイルします
+
+        ネストしたRouterやgroupを平坦化したmitama.app.dispatcher.Dispatcherを生成します。
+        Dispatcherはパスの深さに比例した時間でマッチするので、ルートが多い場合はこちらを使ってください。
+        :return: Dispatcherインスタンス
+        """
+        from .dispatcher import Dispatcher
+
+        return Dispatcher(self)
+
+    def freeze(self):
+        """ルーティングテーブルを凍結します
+
+        凍結したRouterとその中のRouterにはルートやミドルウェアを追加できなくなり、
+        matchは凍結した時点でコンパイルしたDispatcherで行われます。
+        :return: 凍結したRouterインスタンス
+        """
+        if self._frozen:
+            return self
+        for route in self.routes:
+            if isinstance(route, Router):
+                route.freeze()
+            elif isinstance(getattr(route, "router", None), Router):
+                route.router.freeze()
+        self.routes = tuple(self.routes)
+        self.middlewares = tuple(self.middlewares)
+        self._frozen = True
+        self._dispatcher = self.compile()
+        return self
+
+    @property
+    def frozen(self):
+        return self._frozen
+
     def match(self, request):
+        if self._frozen:
+            return self._dispatcher.match(request)
         method = request.method
         path = request.subpath if hasattr(request, "subpath") else request.path
         paths_to_check = [path]
@@ -95,10 +161,12 @@ class Router:
                             nonlocal i
                             nonlocal result
                             if inspect.isclass(result):
-                                if hasattr(request, "app"):
-                                    result = result(request.app)
-                                else:
-                                    result = result()
+                                result = _instantiate(
+                                    result,
+                                    request,
+                                    self._instances,
+                                    result
+                                )
                                 if method is not None:
                                     inst = result
 
@@ -116,12 +184,12 @@ class Router:
                                         "Unsupported interface object. Only callables and Controller instances are supported."
                                     )
                             else:
-                                if hasattr(request, "app"):
-                                    middleware = self.middlewares[i](
-                                        request.app
-                                    )
-                                else:
-                                    middleware = self.middlewares[i]()
+                                middleware = _instantiate(
+                                    self.middlewares[i],
+                                    request,
+                                    self._instances,
+                                    i
+                                )
                                 i += 1
                                 return middleware.process(request, handle)
 
@@ -13,7 +13,6 @@ import argparse
 import os
 import shutil
 import glob
-import pkg_resources
 from pathlib import Path
 
 
@@ -50,6 +49,7 @@ def new(args):
     init_project_dir(project_dir)
 
 def version(args):
+    import pkg_resources
     v = pkg_resources.get_distribution("mitama").version
     print(v)
 
@@ -6,8 +6,10 @@ Databaseはシングルトンの接続のインスタンスを生成するクラ
 各アプリにはDatabaseを継承したクラスを定義してもらい、そいつのModelプロパティのベースクラスからモデルを作ってもらいます。
 """
 
+import contextvars
 import inspect as _inspect
 
+import gevent
 import sqlalchemy
 from sqlalchemy import *
 from sqlalchemy.engine import *
@@ -20,10 +22,12 @@ from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 from sqlalchemy.orm.exc import UnmappedClassError
 from sqlalchemy.sql import func
 
-from mitama._extra import _Singleton
+from mitama._extra import _Singleton, _classproperty
 
 from .driver.sqlite3 import get_test_engine
+from .migration import registry as migration_registry
 from .model import Model
+from .pool import PoolMetrics, engine_options, install_statement_timeout
 
 
 class _QueryProperty:
@@ -39,10 +43,36 @@ class _QueryProperty:
             return None
 
 
+_scopes = contextvars.ContextVar("mitama_db_scopes", default=())
+
+SCOPES = ("request", "thread", "global")
+
+
 class DatabaseManager(_Singleton):
+    """データベースの接続を管理するクラス
+
+    sessionはスコープごとに別のSessionを返します。スコープはscopeで切り替えられます。
+
+    * "request": start_sessionからclose_sessionまでを1つのスコープとします。それ以外ではgreenletごとのスコープになります
+    * "thread": greenletごとのスコープです（geventでmonkey patchしていなくても、同じスレッドのgreenlet同士でSessionを共有しません）
+    * "global": 全体で1つのSessionを共有します（以前の挙動です）
+
+    設定の辞書には、typeや接続先の他に次のキーを指定できます。
+    :param pool_size: プールに保持する接続数
+    :param max_overflow: pool_sizeを超えて一時的に作れる接続数
+    :param pool_recycle: 接続を作り直すまでの秒数
+    :param pool_pre_ping: 取り出す前に接続が生きているか確認するかどうか
+    :param pool_timeout: 接続が空くのを待つ秒数
+    :param statement_timeout: 1つのクエリの実行時間の上限（秒、mysqlとpostgresqlのみ）
+    :param echo: 実行したSQLを出力するかどうか
+    :param session_scope: sessionのスコープ（"request"、"thread"、"global"）
+    """
+
     engine = None
     metadata = None
-    session = None
+    metrics = None
+    scope = "request"
+    _registry = None
 
     @classmethod
     def test(cls):
@@ -51,6 +81,9 @@ class DatabaseManager(_Singleton):
     @classmethod
     def set_engine(cls, engine):
         cls.engine = engine
+        cls.metrics = PoolMetrics()
+        cls.metrics.attach(engine.pool)
+        cls._configure_sessions()
         cls.metadata = MetaData(cls.engine)
         cls.Model = declarative_base(
             cls=Model,
@@ -58,13 +91,78 @@ class DatabaseManager(_Singleton):
             metadata=cls.metadata
         )
 
+    @classmethod
+    def create_all(cls):
+        """importされている全てのモデルのテーブルのうち、まだないものを作ります
+
+        モデルをimportしただけではテーブルは作られません。
+        Projectの起動時か、project.pyのmigrateコマンドで呼ばれます。
+        """
+        cls.metadata.create_all(cls.engine)
+
+    @classmethod
+    def pool_status(cls):
+        """コネクションプールの状態と計測値を返します
+
+        :return: 計測値の辞書
+        """
+        status = cls.metrics.to_dict()
+        pool = cls.engine.pool
+        if hasattr(pool, "checkedout"):
+            status.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            })
+        return status
+
+    @classmethod
+    def reinitialize(cls):
+        """fork()した子プロセスで、親プロセスから引き継いだ接続を破棄します"""
+        if cls.engine is not None:
+            cls.engine.dispose()
+            cls._configure_sessions()
+
+    @classmethod
+    def _configure_sessions(cls):
+        cls._registry = scoped_session(
+            sessionmaker(autocommit=False, autoflush=False, bind=cls.engine),
+            scopefunc=cls._scope_key,
+        )
+
+    @classmethod
+    def _scope_key(cls):
+        if cls.scope == "global":
+            return None
+        if cls.scope == "request":
+            scopes = _scopes.get()
+            if scopes:
+                return scopes[-1]
+        return gevent.getcurrent()
+
+    @_classproperty
+    def session(cls):
+        """現在のスコープのSession"""
+        if cls._registry is None:
+            return None
+        return cls._registry()
+
     @classmethod
     def start_session(cls):
-        cls.session = Session(autocommit=False, autoflush=False, bind=cls.engine)
+        """新しいスコープを開始します
+
+        scopeが"request"の場合、close_sessionを呼ぶまでの間、sessionはこのスコープ専用のSessionを返します。
+        """
+        if cls.scope == "request":
+            _scopes.set(_scopes.get() + (object(),))
+        cls._registry()
 
     @classmethod
     def close_session(cls):
-        cls.session.close()
+        """現在のスコープのSessionを閉じて、外側のスコープに戻ります"""
+        cls._registry.remove()
+        if cls.scope == "request":
+            _scopes.set(_scopes.get()[:-1])
 
     @classmethod
     def rollback_session(cls):
@@ -72,6 +170,9 @@ class DatabaseManager(_Singleton):
 
     def __init__(self, database=None):
         if database is not None:
+            if database.get("session_scope", self.scope) not in SCOPES:
+                raise ValueError("Unknown session_scope: %s" % database["session_scope"])
+            options = engine_options(database)
             if database["type"] == "mysql":
                 engine = create_engine(
                     "mysql://{}:{}@{}/{}?charset=utf8mb4".format(
@@ -79,7 +180,8 @@ class DatabaseManager(_Singleton):
                         database["password"],
                         database["host"],
                         database["name"]
-                    )
+                    ),
+                    **options
                 )
             elif database["type"] == "postgresql":
                 engine = create_engine(
@@ -89,10 +191,13 @@ class DatabaseManager(_Singleton):
                         database["host"],
                         database["name"]
                     ),
-                    echo=True
+                    **options
                 )
             else:
-                engine = create_engine("sqlite:///" + str(database["path"]))
+                engine = create_engine("sqlite:///" + str(database["path"]), **options)
+            install_statement_timeout(engine, database)
+            if "session_scope" in database:
+                DatabaseManager.scope = database["session_scope"]
             self.set_engine(engine)
 
 
@@ -149,3 +254,13 @@ class BaseDatabase(_Database):
         if prefix is None:
             prefix = _inspect.getmodule(self.__class__).__package__
         self.Model.prefix = prefix
+
+    def migration(self, version):
+        """このデータベースのマイグレーションを登録するデコレータ
+
+        登録したマイグレーションはproject.pyのmigrateコマンドで適用されます。
+        :param version: バージョン（文字列として昇順に適用されます）
+        """
+        def decorator(func):
+            return migration_registry.register(self.Model.prefix, version, func)
+        return decorator
@@ -6,6 +6,7 @@
 """
 
 from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
 
 
 def get_engine():
@@ -16,5 +17,10 @@ def get_engine():
 
 
 def get_test_engine():
-    return create_engine("sqlite://")
+    # インメモリのDBは接続ごとに別物になるので、全てのスレッドとgreenletで1つの接続を共有する
+    return create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
 
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+"""スキーマのマイグレーション
+
+    * マイグレーションはデータベース（BaseDatabaseのprefix）ごとにバージョンを付けて登録します
+    * 適用済みのバージョンはmitama_migrationテーブルに記録されます
+    * マイグレーションの関数はOperationsを受け取り、索引の作成やデータの書き換えを行います
+    * 操作は1つずつコミットされるので、マイグレーションの関数は途中で失敗しても再実行できるように書きます
+
+    .. code-block:: python
+
+        db = Database(prefix="blog")
+
+        @db.migration("0001")
+        def add_published_at(op):
+            \"\"\"公開日時のカラムと索引を追加します\"\"\"
+            op.add_column("blog_article", Column("published_at", DateTime))
+            op.backfill(Article.__table__, {"published_at": Article.__table__.c.created_at})
+            op.create_index(Index("ix_blog_article_published_at", Article.__table__.c.published_at))
+"""
+
+import datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    and_,
+    inspect,
+    select,
+)
+from sqlalchemy.schema import CreateColumn, CreateIndex, DropIndex
+
+metadata = MetaData()
+
+migration_table = Table(
+    "mitama_migration",
+    metadata,
+    Column("prefix", String(255), primary_key=True),
+    Column("version", String(64), primary_key=True),
+    Column("applied_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+
+class Migration:
+    """1つのマイグレーション
+
+    :param prefix: 対象のデータベースのprefix
+    :param version: バージョン（文字列として昇順に適用されます）
+    :param func: Operationsを受け取る関数
+    """
+
+    def __init__(self, prefix, version, func):
+        self.prefix = prefix
+        self.version = version
+        self.func = func
+
+    @property
+    def description(self):
+        doc = self.func.__doc__ or self.func.__name__
+        return doc.strip().splitlines()[0]
+
+    def __repr__(self):
+        return "<Migration %s:%s>" % (self.prefix, self.version)
+
+
+class MigrationRegistry:
+    """登録されたマイグレーションの一覧"""
+
+    def __init__(self):
+        self.migrations = dict()
+
+    def register(self, prefix, version, func):
+        migrations = self.migrations.setdefault(prefix, dict())
+        if version in migrations and migrations[version].func is not func:
+            raise ValueError("Migration %s:%s is already registered" % (prefix, version))
+        migrations[version] = Migration(prefix, version, func)
+        return func
+
+    def prefixes(self):
+        return sorted(self.migrations)
+
+    def get(self, prefix):
+        return [
+            migration for version, migration in
+            sorted(self.migrations.get(prefix, dict()).items())
+        ]
+
+
+registry = MigrationRegistry()
+
+
+class Operations:
+    """マイグレーションの中で使う操作
+
+    索引の作成・削除は、PostgreSQLではCONCURRENTLY、MySQLではALGORITHM=INPLACE, LOCK=NONEを付けて、
+    テーブルへの書き込みを止めずに実行します。
+    :param engine: 操作するEngine
+    :param batch_size: backfillで1回に書き換える行数
+    """
+
+    def __init__(self, engine, batch_size=1000):
+        self.engine = engine
+        self.batch_size = batch_size
+
+    @property
+    def dialect(self):
+        return self.engine.dialect.name
+
+    def _table_name(self, table):
+        return table if isinstance(table, str) else table.name
+
+    def has_table(self, table):
+        return self._table_name(table) in inspect(self.engine).get_table_names()
+
+    def has_column(self, table, name):
+        table = self._table_name(table)
+        return name in set(column["name"] for column in inspect(self.engine).get_columns(table))
+
+    def has_index(self, table, name):
+        inspector = inspect(self.engine)
+        table = self._table_name(table)
+        names = set(index["name"] for index in inspector.get_indexes(table))
+        names |= set(constraint["name"] for constraint in inspector.get_unique_constraints(table))
+        return name in names
+
+    def run(self, func):
+        """1つのトランザクションの中でfunc(conn)を実行します"""
+        with self.engine.begin() as conn:
+            return func(conn)
+
+    def execute(self, statement, *multiparams, **params):
+        with self.engine.begin() as conn:
+            return conn.execute(statement, *multiparams, **params)
+
+    def create_table(self, table):
+        """テーブルがなければ作ります"""
+        table.create(bind=self.engine, checkfirst=True)
+
+    def add_column(self, table, column):
+        """カラムがなければ追加します
+
+        既存の行を書き換えずに済むよう、NULLを許すカラムかサーバー側のデフォルト値を持つカラムにしてください。
+        """
+        table = self._table_name(table)
+        if self.has_column(table, column.name):
+            return
+        ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+        self.execute("ALTER TABLE %s ADD COLUMN %s" % (
+            self.engine.dialect.identifier_preparer.quote(table), ddl
+        ))
+
+    def _online(self, ddl):
+        if self.dialect == "postgresql":
+            with self.engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                conn.execute(ddl)
+        else:
+            self.execute(ddl)
+
+    def create_index(self, index):
+        """索引がなければ、書き込みを止めずに作ります"""
+        if self.has_index(index.table, index.name):
+            return
+        ddl = str(CreateIndex(index).compile(dialect=self.engine.dialect))
+        if self.dialect == "postgresql":
+            ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+        elif self.dialect == "mysql":
+            ddl += " ALGORITHM=INPLACE LOCK=NONE"
+        self._online(ddl)
+
+    def drop_index(self, index):
+        """索引があれば、書き込みを止めずに削除します"""
+        if not self.has_table(index.table) or not self.has_index(index.table, index.name):
+            return
+        ddl = str(DropIndex(index).compile(dialect=self.engine.dialect))
+        if self.dialect == "postgresql":
+            ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+        elif self.dialect == "mysql":
+            ddl += " ALGORITHM=INPLACE LOCK=NONE"
+        self._online(ddl)
+
+    def backfill(self, table, values, where=None, batch_size=None, columns=None):
+        """条件に合う行を、主キーの順にbatch_size行ずつ書き換えます
+
+        バッチごとにコミットするので、長いロックを取らずに大きなテーブルを書き換えられます。
+        :param table: 書き換えるTable（単一カラムの主キーが必要です）
+        :param values: updateに渡す値の辞書、または行を受け取って値の辞書を返す関数
+        :param where: 書き換える行の条件
+        :param columns: valuesが関数の場合に、行として読み込むカラムの名前のリスト
+        :return: 書き換えた行の数
+        """
+        batch_size = batch_size or self.batch_size
+        pk = list(table.primary_key.columns)
+        if len(pk) != 1:
+            raise ValueError("backfill requires a single-column primary key: %s" % table.name)
+        pk = pk[0]
+        updated = 0
+        last = None
+        while True:
+            cond = [where] if where is not None else []
+            if last is not None:
+                cond.append(pk > last)
+            query = select([pk]).order_by(pk).limit(batch_size)
+            if cond:
+                query = query.where(and_(*cond))
+            with self.engine.begin() as conn:
+                ids = [row[0] for row in conn.execute(query)]
+                if not ids:
+                    break
+                if callable(values):
+                    rows = conn.execute(
+                        select([pk] + [table.c[column] for column in columns or []])
+                        .where(pk.in_(ids))
+                    ).fetchall()
+                    for row in rows:
+                        conn.execute(table.update().where(pk == row[0]).values(values(row)))
+                else:
+                    conn.execute(table.update().where(pk.in_(ids)).values(values))
+            updated += len(ids)
+            last = ids[-1]
+        return updated
+
+
+class Migrator:
+    """マイグレーションを適用します
+
+    :param engine: 対象のEngine（省略した場合はDatabaseManagerのEngine）
+    :param registry: マイグレーションの一覧
+    :param batch_size: Operations.backfillの1回の行数
+    """
+
+    def __init__(self, engine=None, registry=registry, batch_size=1000):
+        if engine is None:
+            from mitama.db import DatabaseManager
+            engine = DatabaseManager.engine
+        self.engine = engine
+        self.registry = registry
+        self.batch_size = batch_size
+
+    def applied(self, prefix):
+        """適用済みのバージョンの集合"""
+        migration_table.create(bind=self.engine, checkfirst=True)
+        with self.engine.connect() as conn:
+            return set(
+                row[0] for row in conn.execute(
+                    select([migration_table.c.version])
+                    .where(migration_table.c.prefix == prefix)
+                )
+            )
+
+    def status(self, prefix=None):
+        """(Migration, 適用済みかどうか)のリストを返します"""
+        prefixes = [prefix] if prefix is not None else self.registry.prefixes()
+        result = list()
+        for prefix_ in prefixes:
+            applied = self.applied(prefix_)
+            for migration in self.registry.get(prefix_):
+                result.append((migration, migration.version in applied))
+        return result
+
+    def pending(self, prefix=None, target=None):
+        return [
+            migration for migration, applied in self.status(prefix)
+            if not applied and (target is None or migration.version <= target)
+        ]
+
+    def upgrade(self, prefix=None, target=None, fake=False, log=None):
+        """未適用のマイグレーションを順に適用します
+
+        :param prefix: 対象のprefix（省略した場合は全て）
+        :param target: このバージョンまで適用します
+        :param fake: 実際には実行せず、適用済みとして記録だけします
+        :param log: 適用するマイグレーションを受け取る関数
+        :return: 適用したMigrationのリスト
+        """
+        done = list()
+        op = Operations(self.engine, batch_size=self.batch_size)
+        for migration in self.pending(prefix, target):
+            if log is not None:
+                log(migration)
+            if not fake:
+                migration.func(op)
+            with self.engine.begin() as conn:
+                conn.execute(migration_table.insert().values(
+                    prefix=migration.prefix,
+                    version=migration.version,
+                ))
+            done.append(migration)
+        return done
+
+    def forget(self, prefix):
+        """prefixの適用記録を削除します（アプリのアンインストール時に使います）"""
+        if not Operations(self.engine).has_table(migration_table):
+            return
+        with self.engine.begin() as conn:
+            conn.execute(migration_table.delete().where(migration_table.c.prefix == prefix))
@@ -0,0 +1,167 @@
+"""コネクションプール
+
+    * DatabaseManagerに渡す設定から、create_engineのプール関連の引数を組み立てる
+    * プールからの接続の取り出しにかかった時間や、使用中の接続数などを計測する
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_recycle", "pool_pre_ping", "pool_timeout")
+
+
+class PoolMetrics:
+    """コネクションプールの計測値
+
+    :param checkouts: 接続を取り出した回数
+    :param checkins: 接続を返却した回数
+    :param connects: 新しく接続を確立した回数
+    :param in_use: 現在使用中の接続数
+    :param max_in_use: 使用中の接続数の最大値
+    :param overflows: pool_sizeを超えて接続を作った回数
+    :param timeouts: 接続を待ってタイムアウトした回数
+    :param wait_time: 接続の取り出しを待った時間の合計（秒）
+    :param max_wait_time: 接続の取り出しを待った時間の最大値（秒）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.overflows = 0
+            self.timeouts = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+
+    def on_connect(self, *args):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            if self.in_use > self.max_in_use:
+                self.max_in_use = self.in_use
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checkins += 1
+            if self.in_use > 0:
+                self.in_use -= 1
+
+    def on_wait(self, elapsed, overflow=False, timeout=False):
+        with self._lock:
+            self.wait_time += elapsed
+            if elapsed > self.max_wait_time:
+                self.max_wait_time = elapsed
+            if overflow:
+                self.overflows += 1
+            if timeout:
+                self.timeouts += 1
+
+    def attach(self, pool):
+        event.listen(pool, "connect", self.on_connect)
+        event.listen(pool, "checkout", self.on_checkout)
+        event.listen(pool, "checkin", self.on_checkin)
+        if isinstance(pool, MeteredQueuePool):
+            pool.metrics = self
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "overflows": self.overflows,
+                "timeouts": self.timeouts,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+                "average_wait_time": self.wait_time / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """接続の取り出しにかかった時間を計測するQueuePool"""
+
+    metrics = None
+
+    def _do_get(self):
+        if self.metrics is None:
+            return super()._do_get()
+        overflow = self._overflow
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.on_wait(time.perf_counter() - start, timeout=True)
+            raise
+        self.metrics.on_wait(
+            time.perf_counter() - start,
+            overflow=self._overflow > overflow and self._overflow > 0,
+        )
+        return conn
+
+    def recreate(self):
+        # イベントリスナーは新しいプールに引き継がれるので、計測値の参照だけを渡す
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _set_statement_timeout(dialect, timeout):
+    milliseconds = int(timeout * 1000)
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if dialect == "mysql":
+            cursor.execute("SET SESSION max_execution_time = %d" % milliseconds)
+        elif dialect == "postgresql":
+            cursor.execute("SET statement_timeout = %d" % milliseconds)
+        cursor.close()
+
+    return on_connect
+
+
+def engine_options(database):
+    """DatabaseManagerの設定から、create_engineのキーワード引数を作ります
+
+    :param database: DatabaseManagerに渡された設定の辞書
+    :return: create_engineのキーワード引数の辞書
+    """
+    options = {"echo": database.get("echo", False)}
+    pooled = database["type"] in ("mysql", "postgresql")
+    for key in POOL_OPTIONS:
+        if key in database:
+            options[key] = database[key]
+            pooled = True
+    if pooled:
+        options["poolclass"] = MeteredQueuePool
+    return options
+
+
+def install_statement_timeout(engine, database):
+    """statement_timeout（秒）が設定されていれば、接続ごとにDBのタイムアウトを設定します
+
+    mysqlとpostgresqlのみ対応しています。
+    """
+    timeout = database.get("statement_timeout")
+    if timeout is None or database["type"] not in ("mysql", "postgresql"):
+        return
+    event.listen(
+        engine.pool,
+        "connect",
+        _set_statement_timeout(database["type"], timeout)
+    )
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+"""既存のデータベースのスキーマを更新するための関数
+
+    * create_allは既に存在するテーブルには手を付けないので、後から定義に追加した索引はここで作ります
+    * 一意な索引を作る前に、重複した行を取り除きます
+"""
+
+from sqlalchemy import and_, func, inspect, select
+
+
+class SchemaError(Exception):
+    """スキーマを自動で更新できない時の例外"""
+    pass
+
+
+def missing_indexes(conn, tables):
+    """定義されていて、データベースにまだ存在しない索引を返します
+
+    :param conn: Connection
+    :param tables: 調べるTableのリスト（データベースに存在しないテーブルは無視します）
+    :return: Indexのリスト
+    """
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    missing = list()
+    for table in tables:
+        if table.name not in existing_tables:
+            continue
+        existing = set(index["name"] for index in inspector.get_indexes(table.name))
+        existing |= set(
+            constraint["name"]
+            for constraint in inspector.get_unique_constraints(table.name)
+        )
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                missing.append(index)
+    return missing
+
+
+def duplicates(conn, table, columns):
+    """columnsの値が重複している組を返します"""
+    columns = [table.c[column] for column in columns]
+    query = select(columns).where(
+        and_(*[column.isnot(None) for column in columns])
+    ).group_by(*columns).having(func.count() > 1)
+    return [tuple(row) for row in conn.execute(query)]
+
+
+def deduplicate(conn, table, columns, on_merge=None):
+    """columnsの値が重複している行を1行にまとめます
+
+    主キー_idを持つテーブルでは、_idが最も小さい行を残します。
+    それ以外のテーブルでは、重複している行を削除してから1行を挿入し直します。
+    :param on_merge: _idを持つテーブルで、(残す_id, 削除する_idのリスト)を受け取る関数
+    :return: 削除した行の数
+    """
+    removed = 0
+    for values in duplicates(conn, table, columns):
+        cond = and_(*[table.c[column] == value for column, value in zip(columns, values)])
+        if "_id" in table.c:
+            ids = [
+                row[0] for row in
+                conn.execute(select([table.c._id]).where(cond).order_by(table.c._id))
+            ]
+            if on_merge is not None:
+                on_merge(ids[0], ids[1:])
+            conn.execute(table.delete().where(table.c._id.in_(ids[1:])))
+            removed += len(ids) - 1
+        else:
+            result = conn.execute(table.delete().where(cond))
+            conn.execute(table.insert().values(dict(zip(columns, values))))
+            removed += result.rowcount - 1
+    return removed
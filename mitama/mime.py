@@ -0,0 +1,81 @@
+#!/usr/bin/python
+"""MIMEタイプの判定
+
+    * libmagicのハンドルは作るのに時間がかかるので、作ったものをプールして使い回します
+    * 判定にはデータの先頭prefix_sizeバイトだけを使い、先頭部分のハッシュごとに結果をLRUに保持します
+    * 同じ画像を何度判定しても、libmagicを呼ぶのは最初の1回だけです
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import magic
+
+
+class MimeDetector:
+    """MIMEタイプの判定
+
+    :param maxsize: 判定結果を保持する最大数
+    :param prefix_size: 判定に使う先頭のバイト数
+    """
+
+    def __init__(self, maxsize=1024, prefix_size=4096):
+        self.maxsize = maxsize
+        self.prefix_size = prefix_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._handles = list()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        # libmagicのハンドルは同時に使えないので、使っている間はプールから取り出します
+        with self._lock:
+            if self._handles:
+                return self._handles.pop()
+        return magic.Magic(mime=True, uncompress=True)
+
+    def _release(self, handle):
+        with self._lock:
+            self._handles.append(handle)
+
+    def from_buffer(self, blob):
+        """データのMIMEタイプを返します
+
+        :param blob: bytes
+        :return: MIMEタイプ
+        """
+        prefix = bytes(blob[:self.prefix_size])
+        key = hashlib.blake2b(prefix, digest_size=16).digest()
+        with self._lock:
+            mime = self._results.get(key)
+            if mime is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return mime
+            self.misses += 1
+        handle = self._acquire()
+        try:
+            mime = handle.from_buffer(prefix)
+        finally:
+            self._release(handle)
+        with self._lock:
+            self._results[key] = mime
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return mime
+
+    def clear(self):
+        with self._lock:
+            self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+detector = MimeDetector()
+
+
+def guess_mime(blob):
+    """データのMIMEタイプを返します（結果はdetectorに保持されます）"""
+    return detector.from_buffer(blob)
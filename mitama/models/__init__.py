@@ -4,6 +4,7 @@
     * UserとGroupのモデル定義を書きます。
     * 関係テーブルのモデル実装は別モジュールにしようかと思ってる
     * sqlalchemyのベースクラスを拡張したNodeクラスに共通のプロパティを載せて、そいつらをUserとGroupに継承させてます。
+    * importしてもテーブルは作りません。DatabaseManager.create_all()かproject.pyのmigrateコマンドで作ります。
 
 Todo:
     * sqlalchemy用にUser型とGroup型を作って、↓のクラスをそのまま使ってDB呼び出しできるようにしたい
@@ -22,6 +23,7 @@ from .nodes import (
     PushSubscription
 )
 from .permissions import permission, inner_permission
+from . import identity, migrations, renditions
 
 
 Permission = permission(db, [
@@ -83,9 +85,6 @@ def is_admin(node):
     return Permission.is_accepted('admin', node)
 
 
-db.create_all()
-
-
 __all__ = [
     User,
     Group,
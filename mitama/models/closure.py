@@ -0,0 +1,177 @@
+#!/usr/bin/python
+"""グループの所属関係のインデックス
+
+    * グループの親子関係とユーザーの所属を一度に読み込み、祖先・子孫の集合をメモリ上に保持します
+    * User.is_ancestorやGroup.is_descendantなどは、このインデックスを引くだけで判定できます
+    * UserやGroupを変更したセッションがコミットされると、インデックスは破棄され、次に使う時に作り直されます
+    * 作っている間に破棄された場合、作ったインデックスはそのリクエストでだけ使い、保持しません
+    * 他のプロセスでの変更は、ttl秒（既定では2秒）が経過した時点で反映されます。
+      それまでの間は、他のプロセスで外された所属関係も権限の判定に使われるので、ttlを長くする場合は注意してください
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+
+class _Snapshot:
+    """ある時点の所属関係"""
+
+    def __init__(self, parents, memberships):
+        self.parents = parents
+        self.children = dict()
+        for group, parent in parents.items():
+            if parent is not None:
+                self.children.setdefault(parent, set()).add(group)
+        self.memberships = memberships
+        self.created_at = time.monotonic()
+        self._ancestors = dict()
+        self._descendants = dict()
+        self._scopes = dict()
+
+    def ancestors(self, group):
+        result = self._ancestors.get(group)
+        if result is None:
+            found = list()
+            parent = self.parents.get(group)
+            while parent is not None and parent not in found and parent != group:
+                found.append(parent)
+                parent = self.parents.get(parent)
+            result = frozenset(found)
+            self._ancestors[group] = result
+        return result
+
+    def descendants(self, group):
+        result = self._descendants.get(group)
+        if result is None:
+            found = set()
+            layer = list(self.children.get(group, ()))
+            while layer:
+                layer_ = list()
+                for child in layer:
+                    if child not in found:
+                        found.add(child)
+                        layer_.extend(self.children.get(child, ()))
+                layer = layer_
+            result = frozenset(found)
+            self._descendants[group] = result
+        return result
+
+    def groups_of(self, user):
+        return self.memberships.get(user, frozenset())
+
+    def scope_of(self, user):
+        """ユーザーが所属するグループと、その全ての子孫グループの集合"""
+        result = self._scopes.get(user)
+        if result is None:
+            found = set()
+            for group in self.groups_of(user):
+                found.add(group)
+                found |= self.descendants(group)
+            result = frozenset(found)
+            self._scopes[user] = result
+        return result
+
+
+class GroupClosure:
+    """グループの所属関係のインデックス
+
+    :param ttl: インデックスを作り直すまでの秒数。他のプロセスでの変更が反映されるまでの最大の秒数です
+        （Noneの場合は、このプロセスでの変更があるまで使い続けます）
+    """
+
+    def __init__(self, ttl=2):
+        self.ttl = ttl
+        self.generation = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self._snapshot = None
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and (
+            self.ttl is None or time.monotonic() - snapshot.created_at < self.ttl
+        ):
+            return snapshot
+        with self._lock:
+            current = self._snapshot
+            if current is not None and current is not snapshot:
+                # 待っている間に他のスレッドが作り直した
+                return current
+            generation = self.generation
+            built = self.build()
+            if generation == self.generation:
+                self._snapshot = built
+            return built
+
+    def build(self):
+        from .nodes import Group, user_group
+
+        session = Group.query.session
+        parents = dict(
+            (row[0], row[1])
+            for row in session.execute(
+                select([Group.__table__.c._id, Group.__table__.c.parent_id])
+            )
+        )
+        memberships = dict()
+        for group, user in session.execute(
+            select([user_group.c.group_id, user_group.c.user_id])
+        ):
+            memberships.setdefault(user, set()).add(group)
+        return _Snapshot(
+            parents,
+            dict((user, frozenset(groups)) for user, groups in memberships.items())
+        )
+
+
+closure = GroupClosure()
+
+
+def _changed(obj, keys):
+    attrs = inspect(obj).attrs
+    return any(attrs[key].history.has_changes() for key in keys)
+
+
+def _touches_closure(session):
+    from .nodes import Group, User, UserGroup
+
+    for obj in session.deleted:
+        if isinstance(obj, (Group, User, UserGroup)):
+            return True
+    for obj in session.new:
+        if isinstance(obj, (Group, UserGroup)):
+            return True
+        if isinstance(obj, User) and _changed(obj, ("groups",)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, Group) and _changed(obj, ("parent_id", "parent", "groups", "users")):
+            return True
+        if isinstance(obj, User) and _changed(obj, ("groups",)):
+            return True
+        if isinstance(obj, UserGroup):
+            return True
+    return False
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    if _touches_closure(session):
+        session.info["mitama_closure_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("mitama_closure_dirty", False):
+        closure.invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    if session.info.pop("mitama_closure_dirty", False):
+        closure.invalidate()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""権限の判定結果のキャッシュ
+
+    * Permission.is_acceptedやInnerPermission.is_acceptedの結果を、リクエストの間（Sessionが閉じられるまで）保持します
+    * ttlを設定すると、判定結果をプロセス全体でttl秒の間共有します
+    * RoleやPermission、グループの所属を変更したセッションがフラッシュ・コミットされると、全ての判定結果を破棄します
+    * 他のプロセスでの変更は、リクエストが終わるか、ttl秒が経過した時点で反映されます
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_INFO_KEY = "mitama_permission_decisions"
+
+
+class DecisionCache:
+    """権限の判定結果のキャッシュ
+
+    :param ttl: 判定結果をプロセス全体で共有する秒数（Noneの場合は、リクエストの間だけ保持します）
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self.models = set()
+        self._shared = dict()
+        self._lock = threading.Lock()
+
+    def register(self, model):
+        """変更された時にキャッシュを破棄するモデルを登録します"""
+        self.models.add(model)
+        return model
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._shared = dict()
+
+    def _local(self):
+        from mitama.db import DatabaseManager
+
+        session = DatabaseManager.session
+        if session is None:
+            return dict()
+        local = session.info.get(_INFO_KEY)
+        if local is None or local[0] != self.generation:
+            local = (self.generation, dict())
+            session.info[_INFO_KEY] = local
+        return local[1]
+
+    def lookup(self, key):
+        """キャッシュされた判定結果を返します
+
+        :return: (見つかったかどうか, 判定結果)
+        """
+        local = self._local()
+        if key in local:
+            self.hits += 1
+            return True, local[key]
+        if self.ttl is not None:
+            entry = self._shared.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                local[key] = entry[0]
+                return True, entry[0]
+        self.misses += 1
+        return False, None
+
+    def store(self, key, value, generation=None):
+        """判定結果を保存します
+
+        :param generation: 判定を始めた時点のgeneration（判定中にキャッシュが破棄された場合は保存しません）
+        """
+        if generation is not None and generation != self.generation:
+            return
+        self._local()[key] = value
+        if self.ttl is not None:
+            self._shared[key] = (value, time.monotonic())
+
+    def get(self, key, compute):
+        """判定結果をキャッシュから返し、なければcomputeを呼んで保存します"""
+        found, value = self.lookup(key)
+        if found:
+            return value
+        generation = self.generation
+        value = compute()
+        self.store(key, value, generation)
+        return value
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "shared": len(self._shared),
+            "generation": self.generation,
+        }
+
+
+decisions = DecisionCache()
+
+
+def _changed(obj, keys):
+    attrs = inspect(obj).attrs
+    return any(key in attrs and attrs[key].history.has_changes() for key in keys)
+
+
+def _touches_decisions(session):
+    from .nodes import Group, InnerRole, Role, RoleRelation, User, UserGroup
+
+    models = (Role, InnerRole, RoleRelation, UserGroup) + tuple(decisions.models)
+    for obj in session.deleted:
+        if isinstance(obj, models + (Group, User)):
+            return True
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, models):
+            return True
+        if isinstance(obj, Group) and _changed(obj, ("users", "roles")):
+            return True
+        if isinstance(obj, User) and _changed(obj, ("groups", "roles")):
+            return True
+    return False
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    if _touches_decisions(session):
+        session.info["mitama_decisions_dirty"] = True
+        decisions.invalidate()
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("mitama_decisions_dirty", False):
+        decisions.invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    if session.info.pop("mitama_decisions_dirty", False):
+        decisions.invalidate()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+"""ログイン中のユーザーの認証結果のキャッシュ
+
+    * SessionMiddlewareは、JWTごとに検証結果とUserのカラムの値（アイコンを除く）をttl秒の間キャッシュします
+    * キャッシュに見つかったリクエストでは、JWTのデコードもデータベースへの問い合わせも行いません
+    * request.userには、キャッシュした値をsession.merge(load=False)で現在のSessionに入れた本物のUserが入ります
+    * Userが更新・削除されたセッションがフラッシュされると、そのユーザーのキャッシュを破棄します
+    * 他のプロセスでの更新・削除は、ttl秒（既定では30秒）が経過した時点で反映されます
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+def _columns():
+    """キャッシュするUserのカラム（アイコンなど、遅延読み込みのカラムは除きます）"""
+    from .nodes import User
+
+    return [
+        prop.key for prop in User.__mapper__.column_attrs
+        if not prop.deferred
+    ]
+
+
+def _detached(values):
+    """カラムの値から、どのSessionにも属さないUserを作ります"""
+    from .nodes import User
+
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return user
+
+
+class IdentityCache:
+    """JWTごとの認証結果のキャッシュ
+
+    :param ttl: 認証結果を保持する秒数（他のプロセスでの更新・削除が反映されるまでの最大の秒数です）
+    :param maxsize: 保持するJWTの最大数（超えたら最も長く使われていないものから捨てます）
+    """
+
+    def __init__(self, ttl=30, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._tokens = OrderedDict()
+        self._users = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _load(self, token):
+        from .core_db import db
+        from .nodes import AuthorizationError, User
+
+        user_id = User.decode_jwt(token)
+        keys = _columns()
+        row = db.session.query(
+            *[getattr(User, key) for key in keys]
+        ).filter(User._id == user_id).first()
+        if row is None:
+            raise AuthorizationError(AuthorizationError.USER_NOT_FOUND)
+        return _detached(dict(zip(keys, row)))
+
+    def _discard(self, token):
+        user, _ = self._tokens.pop(token)
+        tokens = self._users.get(user._id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._users[user._id]
+
+    def lookup(self, token):
+        """キャッシュされた認証結果（どのSessionにも属さないUser）を返します。なければNoneを返します"""
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._tokens.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._discard(token)
+            self.misses += 1
+            return None
+
+    def store(self, token, user, generation=None):
+        """認証結果を保存します
+
+        :param user: どのSessionにも属さないUser
+        :param generation: 認証を始めた時点のgeneration（認証中にキャッシュが破棄された場合は保存しません）
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if token in self._tokens:
+                self._discard(token)
+            self._tokens[token] = (user, time.monotonic())
+            self._users.setdefault(user._id, set()).add(token)
+            while len(self._tokens) > self.maxsize:
+                self._discard(next(iter(self._tokens)))
+
+    def authenticate(self, token):
+        """JWTを検証し、ログイン中のユーザーを返します
+
+        :param token: JWT
+        :return: 現在のSessionに属するUserインスタンス
+        """
+        from .core_db import db
+
+        user = self.lookup(token)
+        if user is None:
+            generation = self.generation
+            user = self._load(token)
+            self.store(token, user, generation)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id=None):
+        """ユーザーのキャッシュを破棄します
+
+        :param user_id: ユーザーのID（省略した場合は全て）
+        """
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._tokens = OrderedDict()
+                self._users = dict()
+                return
+            for token in list(self._users.get(user_id, ())):
+                self._discard(token)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._tokens),
+            "generation": self.generation,
+        }
+
+
+identities = IdentityCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    from .nodes import User
+
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            identities.invalidate(obj._id)
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+"""mitamaのモデルのマイグレーション
+
+    * project.pyのmigrateコマンドで適用されます
+    * 新しく作ったデータベースには、create_allで既に同じ索引やカラムがあるので、各操作は何もしません
+"""
+
+from sqlalchemy import Column, String, and_
+
+from mitama.db.schema import missing_indexes
+
+from . import schema
+from .core_db import db
+
+
+@db.migration("0001")
+def add_membership_indexes(op):
+    """所属関係とログイン名の索引と一意制約を追加します"""
+    with op.engine.connect() as conn:
+        indexes = missing_indexes(conn, schema.tables())
+    if not indexes:
+        return
+    op.run(schema.prepare)
+    for index in indexes:
+        op.create_index(index)
+
+
+@db.migration("0002")
+def add_icon_hash(op):
+    """アイコンのハッシュのカラムを追加し、既存のアイコンのハッシュを計算します"""
+    from .nodes import Group, User, icon_digest
+
+    for model in (User, Group):
+        table = model.__table__
+        op.add_column(table, Column("icon_hash", String(64)))
+        op.backfill(
+            table,
+            lambda row: {"icon_hash": icon_digest(row["_icon"])},
+            where=and_(table.c._icon.isnot(None), table.c.icon_hash.is_(None)),
+            batch_size=100,
+            columns=["_icon"],
+        )
+
+
+@db.migration("0003")
+def add_icon_mime(op):
+    """アイコンのMIMEタイプのカラムを追加し、既存のアイコンのMIMEタイプを判定します"""
+    from mitama.mime import guess_mime
+
+    from .nodes import Group, User
+
+    for model in (User, Group):
+        table = model.__table__
+        op.add_column(table, Column("icon_mime", String(255)))
+        op.backfill(
+            table,
+            lambda row: {"icon_mime": guess_mime(row["_icon"])},
+            where=and_(table.c._icon.isnot(None), table.c.icon_mime.is_(None)),
+            batch_size=100,
+            columns=["_icon"],
+        )
+
+
+@db.migration("0004")
+def add_icon_renditions(op):
+    """アイコンの縮小画像のテーブルを作ります（縮小画像は最初に配信する時に作られます）"""
+    from .renditions import rendition_table
+
+    op.create_table(rendition_table)
+
+
+@db.migration("0005")
+def add_inner_role_permission_index(op):
+    """InnerPermissionとInnerRoleの関連の索引を追加します"""
+    from . import InnerPermission
+
+    table = InnerPermission.roles.property.secondary
+    if not op.has_table(table):
+        return
+    for index in table.indexes:
+        op.create_index(index)
@@ -2,25 +2,36 @@ import base64
 import hashlib
 import random
 import secrets
-from pywebpush import webpush
 
 import bcrypt
 import jwt
-import magic
 import json
 from Crypto.Random import get_random_bytes
 from Crypto.Hash import SHA256
 
-from mitama.db import ForeignKey, relationship, Table, backref
+from mitama.db import (
+    ForeignKey,
+    Index,
+    Table,
+    backref,
+    deferred,
+    relationship,
+    selectinload,
+    undefer_group,
+    validates,
+)
 from mitama.db.types import Column, LargeBinary
 from mitama.db.types import String
 from mitama.db.model import UUID
-from mitama.noimage import load_noimage_group, load_noimage_user
+from mitama.mime import guess_mime
+from mitama.noimage import assets, load_noimage_group, load_noimage_user
 
 from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.declarative import declared_attr
 
 from mitama._extra import _classproperty
 
+from .closure import closure
 from .core_db import db
 
 secret = secrets.token_hex(32)
@@ -60,6 +71,8 @@ user_group = Table(
         String(64),
         ForeignKey("mitama_user._id", ondelete="CASCADE")
     ),
+    Index("ix_mitama_user_group_user_id_group_id", "user_id", "group_id"),
+    Index("uq_mitama_user_group_group_id_user_id", "group_id", "user_id", unique=True),
 )
 
 
@@ -72,14 +85,31 @@ class UserGroup(db.Model):
     group = relationship("Group")
 
 
+def icon_digest(blob):
+    """アイコンの内容のハッシュを返します"""
+    if not blob:
+        return None
+    return hashlib.sha256(blob).hexdigest()[:32]
+
+
 class AbstractNode(object):
-    _icon = Column(
-        LargeBinary().with_variant(
-            mysql.MEDIUMBLOB, "mysql"
+    @declared_attr
+    def _icon(cls):
+        # アイコンは一覧や権限の判定では使わないので、触れた時に初めて読み込みます
+        return deferred(
+            Column(
+                "_icon",
+                LargeBinary().with_variant(
+                    mysql.MEDIUMBLOB, "mysql"
+                )
+            ),
+            group="icon"
         )
-    )
+
+    _icon_hash = Column("icon_hash", String(64))
+    _icon_mime = Column("icon_mime", String(255))
     _name = Column("name", String(255))
-    _screen_name = Column("screen_name", String(255))
+    _screen_name = Column("screen_name", String(255), index=True, unique=True)
     _name_proxy = list()
     _screen_name_proxy = list()
     _icon_proxy = list()
@@ -127,12 +157,33 @@ class AbstractNode(object):
     def icon(self, value):
         self._icon = value
 
+    @validates("_icon")
+    def _validate_icon(self, key, value):
+        self._icon_hash = icon_digest(value)
+        self._icon_mime = guess_mime(value) if value else None
+        return value
+
+    @property
+    def icon_hash(self):
+        """アイコンの内容のハッシュ（アイコンがない場合はNone）"""
+        return self._icon_hash
+
+    @property
+    def icon_mime(self):
+        """アイコンのMIMEタイプ（アイコンを保存した時に判定したものを使います）"""
+        if self._icon_mime is not None and not self._icon_proxy:
+            return self._icon_mime
+        icon = self.icon
+        asset = assets.find(icon)
+        return asset.mime if asset is not None else guess_mime(icon)
+
     def icon_to_dataurl(self):
-        f = magic.Magic(mime=True, uncompress=True)
-        mime = f.from_buffer(self.icon)
+        asset = assets.find(self.icon)
+        if asset is not None:
+            return asset.dataurl
         return "".join([
             "data:",
-            mime,
+            self.icon_mime,
             ";base64,",
             base64.b64encode(self.icon).decode()
         ])
@@ -150,13 +201,43 @@ class AbstractNode(object):
         cls._icon_proxy.append(fn)
 
     @classmethod
-    def retrieve(cls, _id=None, screen_name=None, **kwargs):
+    def with_icon(cls, *relations):
+        """アイコンも一緒に読み込むクエリを返します
+
+        :param relations: 一緒に読み込むリレーションの名前（その先のノードのアイコンもまとめて読み込みます）
+        """
+        options = [undefer_group("icon")]
+        for relation in relations:
+            options.append(selectinload(getattr(cls, relation)).undefer_group("icon"))
+        return cls.query.options(*options)
+
+    @classmethod
+    def list(cls, with_icon=False, **kwargs):
+        """一覧を取得します
+
+        :param with_icon: アイコンも一緒に読み込むかどうか（一覧でアイコンを表示する場合に指定します）
+        """
+        if not with_icon:
+            return super().list(**kwargs)
+        q = cls.with_icon()
+        for attr, value in kwargs.items():
+            q = q.filter(getattr(cls, attr) == value)
+        return q.all()
+
+    @classmethod
+    def retrieve(cls, _id=None, screen_name=None, with_icon=False, **kwargs):
         if _id is not None:
-            return super().retrieve(_id=_id)
+            kwargs = {"_id": _id}
         elif screen_name is not None:
-            return super().retrieve(_screen_name=screen_name)
-        else:
+            kwargs = {"_screen_name": screen_name}
+        if not with_icon:
             return super().retrieve(**kwargs)
+        if len(kwargs) == 0:
+            raise Exception("Identity not given")
+        q = cls.with_icon()
+        for attr, value in kwargs.items():
+            q = q.filter(getattr(cls, attr) == value)
+        return q.one()
 
     def __eq__(self, other):
         return self._id == other._id
@@ -298,28 +379,30 @@ class User(AbstractNode, db.Model):
         :param token: JWT
         :return: Userインスタンス
         """
+        return cls.retrieve(cls.decode_jwt(token))
+
+    @classmethod
+    def decode_jwt(cls, token):
+        """JWTを検証し、ユーザーのIDを返します
+
+        :param token: JWT
+        :return: ユーザーのID
+        """
         try:
             result = jwt.decode(token, secret, algorithms="HS256")
         except jwt.exceptions.InvalidTokenError:
             raise AuthorizationError(AuthorizationError.INVALID_TOKEN)
-        return cls.retrieve(result["id"])
+        return result["id"]
 
     def is_ancestor(self, node):
+        """ユーザーが所属するグループ、またはその子孫のグループにnodeが含まれるか確認します"""
         if not isinstance(node, Group) and not isinstance(node, User):
             raise TypeError("Checking object must be Group or User instance")
-        layer = self.groups
-        while len(layer) > 0:
-            if isinstance(node, Group) and node in layer:
-                return True
-            else:
-                for node_ in layer:
-                    if isinstance(node, User) and node_.is_in(node):
-                        return True
-            layer_ = list()
-            for node_ in layer:
-                layer_.extend(node_.groups)
-            layer = layer_
-        return False
+        snapshot = closure.snapshot()
+        scope = snapshot.scope_of(self._id)
+        if isinstance(node, Group):
+            return node._id in scope
+        return not scope.isdisjoint(snapshot.groups_of(node._id))
 
     def push(self, data):
         for subscription in self.subscriptions:
@@ -385,8 +468,9 @@ class Group(AbstractNode, db.Model):
         return Column(String, ForeignKey("mitama_group._id"), nullable=True)
 
     @classmethod
-    def tree(cls):
-        return Group.query.filter(Group.parent == None).all()
+    def tree(cls, with_icon=False):
+        query = cls.with_icon() if with_icon else cls.query
+        return query.filter(Group.parent == None).all()
 
     def append(self, node):
         if isinstance(node, User):
@@ -431,43 +515,30 @@ class Group(AbstractNode, db.Model):
         self.query.session.commit()
 
     def is_ancestor(self, node):
+        """nodeがこのグループの祖先のグループか、祖先のグループに直接所属するユーザーか確認します"""
         if not isinstance(node, Group) and not isinstance(node, User):
             raise TypeError("Checking object must be Group or User instance")
-        if self.parent is None:
-            return False
-        layer = [self.parent]
-        while len(layer) > 0:
-            if isinstance(node, Group) and node in layer:
-                return True
-            else:
-                for node_ in layer:
-                    if isinstance(node, User) and node_.is_in(node):
-                        return True
-            layer_ = list()
-            for node_ in layer:
-                if node_.parent is not None:
-                    layer_.extend([node_.parent])
-            layer = layer_
-        return False
+        snapshot = closure.snapshot()
+        ancestors = snapshot.ancestors(self._id)
+        if isinstance(node, Group):
+            return node._id in ancestors
+        return not ancestors.isdisjoint(snapshot.groups_of(node._id))
 
     def is_descendant(self, node):
+        """nodeがこのグループの子孫のグループか確認します"""
         if not isinstance(node, Group) and not isinstance(node, User):
             raise TypeError("Checking object must be Group or User instance")
-        layer = self.groups
-        while len(layer) > 0:
-            if node in layer:
-                return True
-            layer_ = list()
-            for node_ in layer:
-                layer_.extend(node_.groups)
-            layer = layer_
-        return False
+        if isinstance(node, User):
+            return False
+        return node._id in closure.snapshot().descendants(self._id)
 
     def is_in(self, node):
+        """nodeがこのグループに直接所属しているか確認します"""
+        snapshot = closure.snapshot()
         if isinstance(node, User):
-            return node in self.users
+            return self._id in snapshot.groups_of(node._id)
         elif isinstance(node, Group):
-            return node in self.groups
+            return snapshot.parents.get(node._id) == self._id
         else:
             raise TypeError("Checking object must be Group or User instance")
 
@@ -527,8 +598,10 @@ class UserInvite(db.Model):
         return self._icon or self.load_noimage()
 
     def icon_to_dataurl(self):
-        f = magic.Magic(mime=True, uncompress=True)
-        mime = f.from_buffer(self.icon)
+        asset = assets.find(self.icon)
+        if asset is not None:
+            return asset.dataurl
+        mime = guess_mime(self.icon)
         return ''.join([
             "data:",
             mime,
@@ -552,7 +625,9 @@ role_user = Table(
         "user_id",
         String(64),
         ForeignKey("mitama_user._id", ondelete="CASCADE")
-    )
+    ),
+    Index("uq_mitama_role_user_role_id_user_id", "role_id", "user_id", unique=True),
+    Index("ix_mitama_role_user_user_id", "user_id"),
 )
 
 role_group = Table(
@@ -567,7 +642,9 @@ role_group = Table(
         "group_id",
         String(64),
         ForeignKey("mitama_group._id", ondelete="CASCADE")
-    )
+    ),
+    Index("uq_mitama_role_group_role_id_group_id", "role_id", "group_id", unique=True),
+    Index("ix_mitama_role_group_group_id", "group_id"),
 )
 
 
@@ -615,7 +692,8 @@ role_relation = Table(
         "relation_id",
         String(64),
         ForeignKey("mitama_user_group._id", ondelete="CASCADE")
-    )
+    ),
+    Index("uq_mitama_role_relation_relation_id_role_id", "relation_id", "role_id", unique=True),
 )
 
 
@@ -730,6 +808,9 @@ class PushSubscription(db.Model):
     subscription = Column(String(1024))
 
     def push(self, data):
+        # pywebpushはaiohttpやrequestsを読み込むので、import時ではなく使う時に読み込む
+        from pywebpush import webpush
+
         try:
             webpush(
                 subscription_info=json.loads(self.subscription),
@@ -1,11 +1,14 @@
-from mitama.db import DatabaseManager, ForeignKey, relationship, Table
+from mitama.db import DatabaseManager, ForeignKey, Index, relationship, Table
 from mitama.db.types import Column
 from mitama.db.types import String
-from sqlalchemy import event
+from sqlalchemy import and_, event, exists, literal, or_
+
+from .decisions import decisions
 
 
 def permission(db_, permissions):
     from .nodes import User, Group, UserGroup, Role, InnerRole
+    from .nodes import role_group, role_user, user_group
     role_permission = Table(
         db_.Model.prefix + "_role_permission",
         db_.metadata,
@@ -50,22 +53,121 @@ def permission(db_, permissions):
             permission.roles.remove(role)
             permission.update()
 
+        @classmethod
+        def _decision_key(cls, screen_name, node):
+            return (cls.__tablename__, screen_name, node.__class__.__name__, node._id)
+
         @classmethod
         def is_accepted(cls, screen_name, node):
             """UserまたはGroupが許可されているか確認します
+
+            Userの場合は、Roleに直接含まれているか、Roleに含まれるグループに直接所属していれば許可されます。
+            Groupの場合は、Roleに直接含まれていれば許可されます。
+            判定は1回のクエリで行い、結果はmitama.models.decisionsにキャッシュされます。
+            """
+            if not isinstance(node, (User, Group)):
+                return False
+            return decisions.get(
+                cls._decision_key(screen_name, node),
+                lambda: cls._is_accepted(screen_name, node)
+            )
+
+        @classmethod
+        def _is_accepted(cls, screen_name, node):
+            perm = cls.__table__
+            if isinstance(node, User):
+                accepted = or_(
+                    exists().where(and_(
+                        role_user.c.role_id == role_permission.c.role_id,
+                        role_user.c.user_id == node._id,
+                    )),
+                    exists().where(and_(
+                        role_group.c.role_id == role_permission.c.role_id,
+                        user_group.c.group_id == role_group.c.group_id,
+                        user_group.c.user_id == node._id,
+                    )),
+                )
+            elif isinstance(node, Group):
+                accepted = exists().where(and_(
+                    role_group.c.role_id == role_permission.c.role_id,
+                    role_group.c.group_id == node._id,
+                ))
+            else:
+                return False
+            query = db_.session.query(literal(1)).filter(
+                perm.c.screen_name == screen_name,
+                role_permission.c.permission_id == perm.c._id,
+                accepted,
+            ).limit(1)
+            return query.first() is not None
+
+        @classmethod
+        def are_accepted(cls, pairs):
+            """複数の(screen_name, node)の組について、許可されているかをまとめて確認します
+
+            判定の内容はis_acceptedと同じですが、キャッシュにない組を1回のクエリで判定します。
+            :param pairs: (権限のscreen_name, UserまたはGroup)のタプルのリスト
+            :return: 各組が許可されているかどうかのリスト
             """
-            perm = cls.retrieve(screen_name=screen_name)
-            for role in perm.roles:
-                if isinstance(node, User):
-                    if node in role.users:
-                        return True
-                    for group in role.groups:
-                        if group.is_in(node):
-                            return True
+            pairs = list(pairs)
+            results = dict()
+            missing = list()
+            for screen_name, node in pairs:
+                if not isinstance(node, (User, Group)):
+                    continue
+                key = cls._decision_key(screen_name, node)
+                if key in results:
+                    continue
+                found, value = decisions.lookup(key)
+                if found:
+                    results[key] = value
                 else:
-                    if node in role.groups:
-                        return True
-            return False
+                    results[key] = False
+                    missing.append((screen_name, node))
+            if missing:
+                generation = decisions.generation
+                for (screen_name, node), value in zip(missing, cls._are_accepted(missing)):
+                    key = cls._decision_key(screen_name, node)
+                    results[key] = value
+                    decisions.store(key, value, generation)
+            return [
+                isinstance(node, (User, Group)) and results[cls._decision_key(screen_name, node)]
+                for screen_name, node in pairs
+            ]
+
+        @classmethod
+        def _are_accepted(cls, pairs):
+            screen_names = set(screen_name for screen_name, node in pairs)
+            user_ids = set(node._id for _, node in pairs if isinstance(node, User))
+            group_ids = set(node._id for _, node in pairs if isinstance(node, Group))
+            perm = cls.__table__
+            granted = and_(
+                perm.c.screen_name.in_(screen_names),
+                role_permission.c.permission_id == perm.c._id,
+            )
+            session = db_.session
+            queries = list()
+            if user_ids:
+                queries.append(session.query(perm.c.screen_name, role_user.c.user_id).filter(
+                    granted,
+                    role_user.c.role_id == role_permission.c.role_id,
+                    role_user.c.user_id.in_(user_ids),
+                ))
+                queries.append(session.query(perm.c.screen_name, user_group.c.user_id).filter(
+                    granted,
+                    role_group.c.role_id == role_permission.c.role_id,
+                    user_group.c.group_id == role_group.c.group_id,
+                    user_group.c.user_id.in_(user_ids),
+                ))
+            if group_ids:
+                queries.append(session.query(perm.c.screen_name, role_group.c.group_id).filter(
+                    granted,
+                    role_group.c.role_id == role_permission.c.role_id,
+                    role_group.c.group_id.in_(group_ids),
+                ))
+            query = queries[0].union(*queries[1:]) if len(queries) > 1 else queries[0]
+            accepted = set((row[0], row[1]) for row in query)
+            return [(screen_name, node._id) in accepted for screen_name, node in pairs]
 
         @classmethod
         def is_forbidden(cls, screen_name, node):
@@ -89,12 +191,14 @@ def permission(db_, permissions):
             DatabaseManager.close_session()
 
     event.listen(Permission.__table__, "after_create", after_create)
+    decisions.register(Permission)
 
     return Permission
 
 
 def inner_permission(db_, permissions):
-    from .nodes import User, Group, Node, UserGroup, Role, InnerRole
+    from .nodes import User, Group, Node, Role, InnerRole
+    from .nodes import role_relation, user_group
 
     inner_role_permission = Table(
         db_.Model.prefix + "_inner_role_permission",
@@ -112,6 +216,11 @@ def inner_permission(db_, permissions):
                 ondelete="CASCADE"
             )
         ),
+        Index(
+            "ix_" + db_.Model.prefix + "_inner_role_permission_permission_id_role_id",
+            "permission_id",
+            "role_id"
+        ),
         extend_existing=True
     )
 
@@ -141,23 +250,38 @@ def inner_permission(db_, permissions):
         @classmethod
         def is_accepted(cls, screen_name, group, user):
             """UserまたはGroupが許可されているか確認します
+
+            グループとユーザーの所属関係がInnerRoleに含まれていれば許可されます。
+            ユーザーがグループに所属していない場合は許可されません。
+            判定はmitama_role_relationの索引を使う1回のクエリで行い、結果はmitama.models.decisionsにキャッシュされます。
             """
             if isinstance(group, Node):
                 group = group.object
                 if isinstance(group, User):
                     return False
-            rel = UserGroup.retrieve(user=user, group=group)
-            permission = cls.retrieve(screen_name=screen_name)
-            for role in permission.roles:
-                if rel in role.relations:
-                    return True
-            return False
+            return decisions.get(
+                (cls.__tablename__, screen_name, group._id, user._id),
+                lambda: cls._is_accepted(screen_name, group, user)
+            )
+
+        @classmethod
+        def _is_accepted(cls, screen_name, group, user):
+            perm = cls.__table__
+            query = db_.session.query(literal(1)).filter(
+                perm.c.screen_name == screen_name,
+                inner_role_permission.c.permission_id == perm.c._id,
+                role_relation.c.role_id == inner_role_permission.c.role_id,
+                user_group.c._id == role_relation.c.relation_id,
+                user_group.c.user_id == user._id,
+                user_group.c.group_id == group._id,
+            ).limit(1)
+            return query.first() is not None
 
         @classmethod
         def is_forbidden(cls, screen_name, group, node):
             """UserまたはGroupが許可されていないか確認します
             """
-            return not cls.is_accepted(screen_name, node)
+            return not cls.is_accepted(screen_name, group, node)
 
     def after_create(target, conn, **kw):
         try:
@@ -175,5 +299,6 @@ def inner_permission(db_, permissions):
             DatabaseManager.close_session()
 
     event.listen(InnerPermission.__table__, "after_create", after_create)
+    decisions.register(InnerPermission)
 
     return InnerPermission
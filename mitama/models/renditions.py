@@ -0,0 +1,280 @@
+#!/usr/bin/python
+"""アイコンの縮小画像の生成
+
+    * アイコンが保存されると、SIZESとFORMATSの全ての組み合わせの縮小画像を一度だけ作り、mitama_icon_renditionテーブルに保存します
+    * 縮小画像はアイコンの内容のハッシュごとに保存するので、同じ画像を使うノードの間で共有されます
+    * 同じアイコンからは常に同じ縮小画像ができます（中央を正方形に切り抜き、LANCZOSで縮小します）
+    * アップロードされたアイコンは、normalizeで最大の縮小画像と同じ大きさのPNGにしてから保存してください
+    * PillowがWebPに対応していない環境では、PNGだけを作ります
+    * pipeline.executorにExecutorを設定すると、縮小画像はバックグラウンドで作られ、アップロードはすぐに返ります
+
+    .. code-block:: python
+
+        from concurrent.futures import ThreadPoolExecutor
+        from mitama.models.renditions import pipeline
+
+        pipeline.executor = ThreadPoolExecutor(max_workers=2)
+"""
+
+import io
+import threading
+import traceback
+from collections import OrderedDict
+
+from sqlalchemy import Column, Integer, LargeBinary, String, Table, and_, event, inspect, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .core_db import db
+
+SIZES = (40, 80, 200)
+FORMATS = ("webp", "png")
+MIMES = {"webp": "image/webp", "png": "image/png"}
+
+rendition_table = Table(
+    "mitama_icon_rendition",
+    db.metadata,
+    Column("digest", String(64), primary_key=True),
+    Column("size", Integer, primary_key=True, autoincrement=False),
+    Column("format", String(8), primary_key=True),
+    Column("data", LargeBinary().with_variant(mysql.MEDIUMBLOB, "mysql")),
+)
+
+
+def _open(blob):
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(blob))
+    img.load()
+    return img.convert("RGBA")
+
+
+def _decode(blob):
+    """画像をデコードします。画像として読めない場合はNoneを返します"""
+    from PIL import Image
+
+    try:
+        return _open(blob)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def supported_formats(formats=FORMATS):
+    """Pillowが書き出せる形式だけを返します（WebPに対応していない環境ではPNGだけになります）"""
+    from PIL import features
+
+    return tuple(
+        format for format in formats
+        if format != "webp" or features.check("webp")
+    )
+
+
+def _fit(img, size):
+    from PIL import Image, ImageOps
+
+    return ImageOps.fit(img, (size, size), method=Image.LANCZOS)
+
+
+def _save(img, format):
+    output = io.BytesIO()
+    if format == "webp":
+        img.save(output, format="WEBP", quality=85, method=4)
+    else:
+        img.save(output, format="PNG")
+    return output.getvalue()
+
+
+def render(blob, size, format):
+    """アイコンの縮小画像を作ります
+
+    :param blob: 元の画像
+    :param size: 縮小後の一辺の長さ
+    :param format: "webp"または"png"
+    :return: 縮小画像
+    """
+    return _save(_fit(_open(blob), size), format)
+
+
+def normalize(blob, size=max(SIZES)):
+    """アップロードされたアイコンを、保存する形（size四方のPNG）に変換します
+
+    元の画像の大きさによらず、保存されるアイコンは最大の縮小画像と同じ大きさになります。
+    :param blob: アップロードされた画像
+    :param size: 一辺の長さ
+    :return: 変換した画像
+    :raises ValueError: 画像として読めない場合
+    """
+    img = _decode(blob)
+    if img is None:
+        raise ValueError("Unreadable image")
+    return _save(_fit(img, size), "png")
+
+
+class RenditionPipeline:
+    """アイコンの縮小画像を作って保存します
+
+    :param sizes: 作る大きさのリスト
+    :param formats: 作る形式のリスト
+    :param executor: 縮小画像を作るExecutor（Noneの場合は、保存したスレッドでそのまま作ります）
+    :param invalid_maxsize: 画像として読めなかったハッシュを覚えておく最大数
+    """
+
+    def __init__(self, sizes=SIZES, formats=FORMATS, executor=None, invalid_maxsize=1024):
+        self.sizes = sizes
+        self.formats = supported_formats(formats)
+        self.executor = executor
+        self.invalid_maxsize = invalid_maxsize
+        self._pending = dict()
+        self._invalid = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_invalid(self, digest):
+        """画像として読めなかったハッシュかどうかを返します"""
+        return digest in self._invalid
+
+    def _mark_invalid(self, digest):
+        with self._lock:
+            self._invalid[digest] = True
+            self._invalid.move_to_end(digest)
+            while len(self._invalid) > self.invalid_maxsize:
+                self._invalid.popitem(last=False)
+
+    def clear(self):
+        """画像として読めなかったハッシュを忘れます"""
+        with self._lock:
+            self._invalid = OrderedDict()
+
+    @property
+    def engine(self):
+        from mitama.db import DatabaseManager
+        return DatabaseManager.engine
+
+    def render_all(self, blob):
+        """全ての縮小画像を作ります。画像として読めない場合は空の辞書を返します
+
+        :return: {(大きさ, 形式): 縮小画像}
+        """
+        # 元の画像のデコードは1回、縮小は大きさごとに1回だけ行います
+        img = _decode(blob)
+        if img is None:
+            return dict()
+        renditions = dict()
+        for size in self.sizes:
+            fitted = _fit(img, size)
+            for format in self.formats:
+                renditions[(size, format)] = _save(fitted, format)
+        return renditions
+
+    def _exists(self, conn, digest):
+        return conn.execute(
+            select([rendition_table.c.digest])
+            .where(rendition_table.c.digest == digest)
+            .limit(1)
+        ).first() is not None
+
+    def exists(self, digest):
+        """縮小画像が作られているか確認します"""
+        with self.engine.connect() as conn:
+            return self._exists(conn, digest)
+
+    def process(self, digest, blob):
+        """まだ作っていなければ、全ての縮小画像を作って保存します"""
+        if self.is_invalid(digest) or self.exists(digest):
+            return
+        renditions = self.render_all(blob)
+        if not renditions:
+            self._mark_invalid(digest)
+            return
+        try:
+            with self.engine.begin() as conn:
+                if self._exists(conn, digest):
+                    return
+                conn.execute(rendition_table.insert(), [
+                    {"digest": digest, "size": size, "format": format, "data": data}
+                    for (size, format), data in renditions.items()
+                ])
+        except IntegrityError:
+            # 他のワーカーが同時に作った場合は、先に保存されたものを使います
+            if not self.exists(digest):
+                raise
+
+    def _done(self, digest):
+        with self._lock:
+            self._pending.pop(digest, None)
+
+    def submit(self, digest, blob):
+        """縮小画像の生成を依頼します
+
+        executorが設定されていればバックグラウンドで、なければその場で作ります。
+        :return: Future（その場で作った場合はNone）
+        """
+        if self.executor is None:
+            self.process(digest, blob)
+            return None
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            future = self.executor.submit(self.process, digest, blob)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._done(digest))
+        return future
+
+    def lookup(self, digest, size, format):
+        """保存された縮小画像を返します。なければNoneを返します"""
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select([rendition_table.c.data]).where(and_(
+                    rendition_table.c.digest == digest,
+                    rendition_table.c.size == size,
+                    rendition_table.c.format == format,
+                ))
+            ).first()
+        return bytes(row[0]) if row is not None else None
+
+    def get(self, digest, size, format, load):
+        """縮小画像を返します
+
+        まだ作られていなければ、load()で元の画像を読み込んでその場で作ります。
+        :param load: 元の画像を返す関数
+        :return: 縮小画像（画像として読めない場合や、対応していない大きさ・形式の場合はNone）
+        """
+        if size not in self.sizes or format not in self.formats or self.is_invalid(digest):
+            return None
+        data = self.lookup(digest, size, format)
+        if data is None:
+            self.process(digest, load())
+            data = self.lookup(digest, size, format)
+        return data
+
+
+pipeline = RenditionPipeline()
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    from .nodes import AbstractNode
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, AbstractNode) or obj._icon_hash is None:
+            continue
+        if not inspect(obj).attrs["_icon"].history.has_changes():
+            continue
+        pending = session.info.setdefault("mitama_icon_renditions", dict())
+        pending[obj._icon_hash] = obj._icon
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # アイコンは既に保存されているので、縮小画像を作れなくてもcommitは失敗させません（配信時に作り直します）
+    for digest, blob in session.info.pop("mitama_icon_renditions", dict()).items():
+        try:
+            pipeline.submit(digest, blob)
+        except Exception:
+            print(traceback.format_exc())
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    session.info.pop("mitama_icon_renditions", None)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""mitamaのモデルのスキーマの更新
+
+    * 索引や一意制約がなかった頃に作られたデータベースに、現在の定義の索引を追加するための関数です
+    * 索引はマイグレーション（mitama.models.migrationsの0001）が、書き込みを止めずに作ります
+    * 所属関係やRoleの重複した行はまとめ、ログイン名の重複は自動で解決せずにSchemaErrorを投げます
+"""
+
+from mitama.db import DatabaseManager
+from mitama.db.schema import SchemaError, deduplicate, duplicates, missing_indexes
+
+
+def tables():
+    """mitamaのモデルが使うテーブル"""
+    from . import InnerPermission
+    from .nodes import Group, User, role_group, role_relation, role_user, user_group
+
+    return [
+        User.__table__,
+        Group.__table__,
+        user_group,
+        role_user,
+        role_group,
+        role_relation,
+        InnerPermission.roles.property.secondary,
+    ]
+
+
+def pending(engine=None):
+    """まだ作られていない索引の名前のリストを返します"""
+    engine = engine or DatabaseManager.engine
+    with engine.connect() as conn:
+        return [index.name for index in missing_indexes(conn, tables())]
+
+
+def prepare(conn):
+    """一意な索引を作れるように、重複した行をまとめます
+
+    ログイン名が重複している場合は、自動では解決せずにSchemaErrorを投げます。
+    :param conn: Connection
+    """
+    from .nodes import Group, User, role_group, role_relation, role_user, user_group
+
+    for table in (User.__table__, Group.__table__):
+        found = duplicates(conn, table, ["screen_name"])
+        if found:
+            raise SchemaError(
+                "%s.screen_name has duplicated values: %s" % (
+                    table.name, ", ".join(row[0] for row in found)
+                )
+            )
+
+    def merge_relations(keep, removed):
+        conn.execute(
+            role_relation.update()
+            .where(role_relation.c.relation_id.in_(removed))
+            .values(relation_id=keep)
+        )
+
+    deduplicate(conn, user_group, ["group_id", "user_id"], merge_relations)
+    deduplicate(conn, role_relation, ["relation_id", "role_id"])
+    deduplicate(conn, role_user, ["role_id", "user_id"])
+    deduplicate(conn, role_group, ["role_id", "group_id"])
@@ -1,37 +1,112 @@
+"""NoImage画像などの組み込みの画像
+
+    * 画像はインポート時に一度だけ読み込み、MIMEタイプ・ETag・data URLと一緒にassetsに保持します
+    * load_noimage_user()などは、毎回ファイルを開かずに保持しているbytesを返します
+    * アプリも自分の画像をassetsに登録できます。同じ名前で登録すると、組み込みの画像を置き換えられます
+
+    .. code-block:: python
+
+        from mitama.noimage import assets
+
+        assets.register("noimage_user", path="static/my_noimage.png")
+        assets["noimage_user"].dataurl
+"""
+
+import hashlib
 import os
+import threading
 from base64 import b64encode
 from pathlib import Path
 
-import magic
+from mitama.mime import guess_mime
+
+STATIC = Path(os.path.dirname(__file__)) / "app/static"
+
+
+class Asset:
+    """読み込み済みの画像
+
+    :param name: 名前
+    :param data: 画像のbytes
+    :param mime: MIMEタイプ（省略した場合はdataから判定します）
+    """
+
+    def __init__(self, name, data, mime=None):
+        self.name = name
+        self.data = data
+        self.mime = mime or guess_mime(data)
+        self.digest = hashlib.sha256(data).hexdigest()[:32]
+        self.etag = '"%s"' % self.digest
+        self.dataurl = "data:" + self.mime + ";base64," + b64encode(data).decode()
+
+    def __repr__(self):
+        return "<Asset %s %s>" % (self.name, self.mime)
+
+
+class AssetRegistry:
+    """名前ごとにAssetを保持するレジストリ"""
+
+    def __init__(self):
+        self._assets = dict()
+        self._by_data = dict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._assets
+
+    def __getitem__(self, name):
+        return self._assets[name]
+
+    def __iter__(self):
+        return iter(list(self._assets.values()))
+
+    def register(self, name, data=None, path=None, mime=None):
+        """画像を登録します
+
+        :param name: 名前（既にある場合は置き換えます）
+        :param data: 画像のbytes
+        :param path: 画像のパス（dataを省略した場合に読み込みます）
+        :param mime: MIMEタイプ（省略した場合は判定します）
+        :return: Assetインスタンス
+        """
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        asset = Asset(name, data, mime)
+        with self._lock:
+            old = self._assets.get(name)
+            if old is not None:
+                self._by_data.pop(id(old.data), None)
+            self._assets[name] = asset
+            self._by_data[id(data)] = asset
+        return asset
+
+    def get(self, name, default=None):
+        return self._assets.get(name, default)
+
+    def find(self, data):
+        """登録されているbytesそのもの（同じオブジェクト）であれば、そのAssetを返します"""
+        asset = self._by_data.get(id(data))
+        if asset is not None and asset.data is data:
+            return asset
+        return None
+
+
+assets = AssetRegistry()
+for _name in ("noimage_app", "noimage_user", "noimage_group"):
+    assets.register(_name, path=STATIC / (_name + ".png"))
 
 
 def load_noimage_app():
     """アプリのNoImage画像を取得します"""
-    noimage_app_path = (
-        Path(os.path.dirname(__file__)) / "app/static/noimage_app.png"
-    )
-    with open(noimage_app_path, "rb") as f:
-        noimage_app = f.read()
-    return noimage_app
+    return assets["noimage_app"].data
 
 
 def load_noimage_user():
     """ユーザーのNoImage画像を取得します"""
-    noimage_user_path = (
-        Path(os.path.dirname(__file__)) / "app/static/noimage_user.png"
-    )
-
-    with open(noimage_user_path, "rb") as f:
-        noimage_user = f.read()
-    return noimage_user
+    return assets["noimage_user"].data
 
 
 def load_noimage_group():
     """グループのNoImage画像を取得します"""
-    noimage_group_path = (
-        Path(os.path.dirname(__file__)) / "app/static/noimage_group.png"
-    )
-
-    with open(noimage_group_path, "rb") as f:
-        noimage_group = f.read()
-    return noimage_group
+    return assets["noimage_group"].data
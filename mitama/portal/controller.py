@@ -1,5 +1,3 @@
-import io
-
 from mitama.app import AppRegistry, Controller
 from mitama.app.http import Response
 from mitama.models import (
@@ -14,6 +12,7 @@ from mitama.models import (
     PushSubscription
 )
 from mitama.app.forms import ValidationError
+from mitama.models.renditions import normalize
 from mitama.noimage import load_noimage_group, load_noimage_user
 
 from .forms import (
@@ -29,38 +28,31 @@ from .forms import (
     SettingsForm
 )
 
-from PIL import Image
-
 
 def resize_icon(icon):
+    """アップロードされたアイコンを、保存する大きさの正方形のPNGに変換します
+
+    画像として読めない場合はValidationErrorを送出します
+    """
     if icon is None:
         return None
     try:
-        img = Image.open(io.BytesIO(icon))
-    except Exception:
-        return icon
-    width, height = img.size
-    if width > height:
-        scale = 200 / height
-    else:
-        scale = 200 / width
-    width *= scale
-    height *= scale
-    resize = img.resize((int(width), int(height)), resample=Image.NEAREST)
-    if width > height:
-        cropped = resize.crop(
-            (int((width-height)/2), 0, width - int((width-height)/2), height)
-        )
-    else:
-        cropped = resize.crop(
-            (0, int((height-width)/2), width, height - int((height-width)/2))
-        )
-    export = io.BytesIO()
-    cropped.save(export, format="PNG")
-    return export.getvalue()
+        return normalize(icon)
+    except ValueError:
+        raise ValidationError("プロフィール画像")
+
+
+def preview_icon(icon, default):
+    """フォームを再表示する時に、アップロードされたアイコンを縮小して返します"""
+    try:
+        return resize_icon(icon) or default
+    except ValidationError:
+        return default
 
 
 class SessionController(Controller):
+    lifecycle = "singleton"
+
     def login(self, request):
         template = self.view.get_template("login.html")
         if request.method == "POST":
@@ -70,7 +62,7 @@ class SessionController(Controller):
                     form["screen_name"],
                     form["password"]
                 )
-                sess = request.session()
+                sess = request.regenerate_session()
                 sess["jwt_token"] = result.get_jwt()
                 redirect_to = request.query.get("redirect_to", ["/"])[0]
                 return Response.redirect(redirect_to)
@@ -79,15 +71,16 @@ class SessionController(Controller):
         return Response.render(template, status=401)
 
     def logout(self, request):
-        sess = request.session()
+        sess = request.regenerate_session()
         sess["jwt_token"] = None
         redirect_to = request.query.get("redirect_to", ["/"])[0]
         return Response.redirect(redirect_to)
 
 
 class RegisterController(Controller):
+    lifecycle = "singleton"
+
     def signup(self, request):
-        sess = request.session()
         template = self.view.get_template("signup.html")
         invite = UserInvite.retrieve(token=request.query["token"][0])
         if request.method == "POST":
@@ -98,12 +91,10 @@ class RegisterController(Controller):
                 user.set_password(form["password"])
                 user.screen_name = form["screen_name"]
                 user.name = form["name"]
-                user.icon = (
-                    resize_icon(form["icon"])
-                    if form["icon"] is not None
-                    else user.icon
-                )
+                if form["icon"] is not None:
+                    user.icon = resize_icon(form["icon"])
                 user.create()
+                sess = request.regenerate_session()
                 sess["jwt_token"] = user.get_jwt()
                 roles = invite.roles
                 if len(roles) > 0:
@@ -113,11 +104,11 @@ class RegisterController(Controller):
                 invite.delete()
                 return Response.redirect(self.app.convert_url("/"))
             except (ValidationError, ValueError) as err:
-                icon = form["icon"]
+                icon = preview_icon(form["icon"], b"")
                 return Response.render(
                     template,
                     {
-                        "error": err.messsage,
+                        "error": str(err),
                         "name": form["name"] or invite.name,
                         "screen_name": (
                             form["screen_name"] or invite.screen_name
@@ -209,6 +200,8 @@ class RegisterController(Controller):
 
 
 class HomeController(Controller):
+    lifecycle = "singleton"
+
     def handle(self, request):
         template = self.view.get_template('home.html')
         try:
@@ -285,6 +278,8 @@ class HomeController(Controller):
 
 
 class UsersController(Controller):
+    lifecycle = "singleton"
+
     def create(self, req):
         template = self.view.get_template("user/create.html")
         invites = User.query.filter(User.password==None).all()
@@ -319,7 +314,7 @@ class UsersController(Controller):
                         "roles": Role.list(),
                         "name": form["name"],
                         "screen_name": form["screen_name"],
-                        "icon": resize_icon(form["icon"]),
+                        "icon": preview_icon(form["icon"], load_noimage_user()),
                         "error": error,
                     },
                 )
@@ -357,11 +352,8 @@ class UsersController(Controller):
                 form = UserUpdateForm(req.post())
                 user.screen_name = form["screen_name"]
                 user.name = form["name"]
-                user.icon = (
-                    resize_icon(form["icon"])
-                    if form["icon"] is not None
-                    else user.icon
-                )
+                if form["icon"] is not None:
+                    user.icon = resize_icon(form["icon"])
                 roles_ = []
                 for role in form["roles"]:
                     roles_.append(Role.retrieve(role))
@@ -457,6 +449,8 @@ class UsersController(Controller):
 
 
 class GroupsController(Controller):
+    lifecycle = "singleton"
+
     def create(self, req):
         template = self.view.get_template("group/create.html")
         groups = Group.list()
@@ -510,13 +504,13 @@ class GroupsController(Controller):
         if req.method == "POST":
             try:
                 form = GroupUpdateForm(req.post())
-                icon = resize_icon(form["icon"]) if form["icon"] is not None else group.icon
                 group.screen_name = form["screen_name"]
                 group.name = form["name"]
                 group.parent = Group.retrieve(form["parent"]) if form["parent"] is not None else None
                 for role in form["roles"]:
                     group.roles.append(Role.retrieve(screen_name=role))
-                group.icon = icon
+                if form["icon"] is not None:
+                    group.icon = resize_icon(form["icon"])
                 group.users = [User.retrieve(user) for user in form['users']]
                 if form['new_user'] is not None:
                     group.users.append(User.retrieve(form['new_user']))
@@ -615,6 +609,8 @@ class GroupsController(Controller):
 
 
 class AppsController(Controller):
+    lifecycle = "singleton"
+
     def list(self, req):
         template = self.view.get_template("apps/list.html")
         apps = AppRegistry()
@@ -627,6 +623,8 @@ class AppsController(Controller):
 
 
 class ACSController(Controller):
+    lifecycle = "singleton"
+
     def redirect(request):
         pass
 
@@ -635,6 +633,8 @@ class ACSController(Controller):
 
 
 class SLOController(Controller):
+    lifecycle = "singleton"
+
     def redirect(request):
         pass
 
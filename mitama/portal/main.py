@@ -29,17 +29,15 @@ class App(BaseApp):
     description = "Mitamaのアプリポータルです。他のアプリを確認できる他、配信の設定やグループの編集、ユーザーの招待ができます。"
     icon = icon
 
-    @property
-    def view(self):
-        view = super().view
+    def create_view(self):
+        view = super().create_view()
         view.globals.update(
             permission=Permission.is_accepted,
             inner_permission=InnerPermission.is_accepted,
         )
         return view
 
-    @property
-    def router(self):
+    def create_router(self):
         return Router(
             [
                 view("/static/<path:path>", static_files()),
@@ -4,6 +4,8 @@ from mitama.models import User
 
 
 class InitializeMiddleware(Middleware):
+    lifecycle = "singleton"
+
     def process(self, request, handler):
         if User.query.filter(User.password != None).count() == 0:
             return Response.redirect(self.app.convert_url("/setup"))
@@ -9,7 +9,15 @@ from getpass import getpass
 def run(project, args):
     port = args.port
     project.port = port
-    run_app(project, project.port)
+    run_app(
+        project,
+        project.port,
+        bind=args.bind,
+        workers=args.workers,
+        max_requests=args.max_requests,
+        graceful_timeout=args.graceful_timeout,
+    )
+
 
 def auth(project, args):
     from mitama.models import User
@@ -25,5 +33,36 @@ def auth(project, args):
         print("Authentication failed")
         sys.exit(1)
 
+
 def uninstall(project, args):
     project.uninstall(args.app)
+
+
+def migrate(project, args):
+    from mitama.db import DatabaseManager
+    from mitama.db.migration import Migrator
+    migrator = Migrator(batch_size=args.batch_size)
+    if args.list:
+        for migration, applied in migrator.status(args.prefix):
+            print("[%s] %s:%s %s" % (
+                "x" if applied else " ",
+                migration.prefix,
+                migration.version,
+                migration.description
+            ))
+        return
+    try:
+        DatabaseManager.create_all()
+        done = migrator.upgrade(
+            prefix=args.prefix,
+            target=args.target,
+            fake=args.fake,
+            log=lambda migration: print("Applying %s:%s %s" % (
+                migration.prefix, migration.version, migration.description
+            ))
+        )
+    except Exception as err:
+        print("Migration failed: %s" % err)
+        sys.exit(1)
+    if not done:
+        print("No migrations to apply")
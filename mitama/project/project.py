@@ -34,6 +34,8 @@ class Project(App):
         database={
             "type": "sqlite"
         },
+        create_tables=True,
+        session_storage=None,
         **kwargs
     ):
         if not isinstance(project_dir, PosixPath):
@@ -51,6 +53,7 @@ class Project(App):
         self.vapid = vapid
         self.password_validation = password_validation
         self.login_page = login_page
+        self.session_storage = session_storage
         self.apps = AppRegistry()
         self.apps.project = self
         for builder in app_builders:
@@ -60,8 +63,10 @@ class Project(App):
             app = builder.build()
             self.apps[app.screen_name] = app
         self.config = kwargs
+        if create_tables:
+            DatabaseManager.create_all()
 
-        self.router = self.apps.router()
+        self._router = self.apps.router().freeze()
 
     def send_mail(self, to, subject, body, type="html"):
         mail = self.mail
@@ -91,6 +96,32 @@ class Project(App):
                 type=int,
                 default=8080
             )
+            cmd_run.add_argument(
+                "-b",
+                "--bind",
+                help="serving address (host or host:port)",
+                type=str,
+                default="localhost"
+            )
+            cmd_run.add_argument(
+                "-w",
+                "--workers",
+                help="number of worker processes",
+                type=int,
+                default=1
+            )
+            cmd_run.add_argument(
+                "--max-requests",
+                help="restart each worker after serving this many requests (0 means unlimited)",
+                type=int,
+                default=0
+            )
+            cmd_run.add_argument(
+                "--graceful-timeout",
+                help="seconds to wait for in-flight requests when stopping workers",
+                type=int,
+                default=30
+            )
             cmd_run.set_defaults(handler=commands.run)
             cmd_auth = subparser.add_parser(
                 "auth",
@@ -118,6 +149,39 @@ class Project(App):
             )
             cmd_uninstall.add_argument("app", help="app's screen name")
             cmd_uninstall.set_defaults(handler=commands.uninstall)
+            cmd_migrate = subparser.add_parser(
+                "migrate",
+                help="Create missing tables and apply pending schema migrations"
+            )
+            cmd_migrate.add_argument(
+                "--list",
+                help="show migrations and whether they are applied",
+                action="store_true"
+            )
+            cmd_migrate.add_argument(
+                "--prefix",
+                help="only migrate the database with this prefix",
+                type=str,
+                default=None
+            )
+            cmd_migrate.add_argument(
+                "--target",
+                help="apply migrations up to this version",
+                type=str,
+                default=None
+            )
+            cmd_migrate.add_argument(
+                "--fake",
+                help="record migrations as applied without running them",
+                action="store_true"
+            )
+            cmd_migrate.add_argument(
+                "--batch-size",
+                help="rows updated per transaction by data backfills",
+                type=int,
+                default=1000
+            )
+            cmd_migrate.set_defaults(handler=commands.migrate)
         return self._arg_parser
 
     def command(self):
@@ -152,6 +216,19 @@ class Project(App):
             DatabaseManager.close_session()
         return body
 
+    async def handle_asgi(self, env, start_response):
+        try:
+            DatabaseManager.start_session()
+            body = await super().handle_asgi(env, start_response)
+        except Exception:
+            print(traceback.format_exc())
+            DatabaseManager.rollback_session()
+            request = Request(env)
+            body = self.error(request, 500).start(request, start_response)
+        finally:
+            DatabaseManager.close_session()
+        return body
+
 
 def include(
     package,
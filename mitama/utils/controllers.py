@@ -1,17 +1,32 @@
 import os
-from mimetypes import add_type, guess_type
+from mimetypes import add_type
 from pathlib import Path
 
-import magic
 from jinja2 import *
 
 from mitama.app import Controller
 from mitama.app.http import Request, Response
-from mitama.models import Group, User
+from mitama.app.http.static import StaticFiles
 
 add_type("application/json", ".map")
 
 
+class _Model:
+    """mitama.modelsのモデルを、最初に参照された時にimportして返します
+
+    mitama.utilsをimportしただけではmitama.modelsを読み込みません。
+    :param name: モデルの名前
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        from mitama import models
+
+        return getattr(models, self.name)
+
+
 def static_files(*paths):
     paths_ = list(paths)
 
@@ -21,6 +36,8 @@ def static_files(*paths):
         デフォルトではアプリのパッケージ内の :file:`static/` の中身を配信する。
         """
 
+        lifecycle = "singleton"
+
         def __init__(self, app=None):
             super().__init__(app)
             app_mod_dir = Path(os.path.dirname(__file__))
@@ -31,23 +48,12 @@ def static_files(*paths):
             )
             if len(self.paths) == 0:
                 self.paths.append(self.app.install_dir / "static")
+            self.files = StaticFiles(self.paths)
 
         def handle(self, req: Request):
-            for path in self.paths:
-                path_ = req.params["path"]
-                if path_ == "/":
-                    path_ = "./"
-                elif path_[0] == "/":
-                    path_ = path_[1:]
-                filename = path / path_
-                if filename.is_file():
-                    mime = guess_type(str(filename)) or ("application/octet-stream",)
-                    with open(filename, "rb") as f:
-                        return Response(body=f.read(), content_type=mime[0])
-                elif (filename / 'index.html').is_file():
-                    mime = guess_type(str(filename / 'index.html'))
-                    with open(filename / 'index.html', "rb") as f:
-                        return Response(body=f.read(), content_type=mime[0])
+            response = self.files.response(req, req.params["path"])
+            if response is not None:
+                return response
             for path in self.paths:
                 filename = path / "404.html"
                 if filename.is_file():
@@ -74,6 +80,8 @@ def mitama_favicon(*paths):
         デフォルトではアプリのパッケージ内の :file:`static/` の中身を配信する。
         """
 
+        lifecycle = "singleton"
+
         paths = paths_
 
         def __init__(self, app):
@@ -86,14 +94,12 @@ def mitama_favicon(*paths):
             )
             if len(self.paths) == 0:
                 self.paths.append(app_mod_dir / "../app/static")
+            self.files = StaticFiles(self.paths)
 
         def handle(self, req: Request):
-            for path in self.paths:
-                filename = path / "favicon.ico"
-                if filename.is_file():
-                    mime = guess_type(str(filename)) or ("application/octet-stream",)
-                    with open(filename, "rb") as f:
-                        return Response(body=f.read(), content_type=mime[0])
+            response = self.files.response(req, "favicon.ico")
+            if response is not None:
+                return response
             for path in self.paths:
                 filename = path / "404.html"
                 if filename.is_file():
@@ -117,6 +123,8 @@ def mitama_service_worker(*paths):
         デフォルトではアプリのパッケージ内の :file:`static/` の中身を配信する。
         """
 
+        lifecycle = "singleton"
+
         paths = paths_
 
         def __init__(self, app):
@@ -129,14 +137,12 @@ def mitama_service_worker(*paths):
             )
             if len(self.paths) == 0:
                 self.paths.append(app_mod_dir / "../app/static")
+            self.files = StaticFiles(self.paths)
 
         def handle(self, req: Request):
-            for path in self.paths:
-                filename = path / "sw.js"
-                if filename.is_file():
-                    mime = guess_type(str(filename)) or ("application/octet-stream",)
-                    with open(filename, "rb") as f:
-                        return Response(body=f.read(), content_type=mime[0])
+            response = self.files.response(req, "sw.js")
+            if response is not None:
+                return response
             for path in self.paths:
                 filename = path / "404.html"
                 if filename.is_file():
@@ -153,6 +159,8 @@ def mitama_service_worker(*paths):
 
 def mitama_manifest():
     class ManifestController(Controller):
+        lifecycle = "singleton"
+
         def handle(self, req: Request):
             manifest = {
                 "name": "Mitama",
@@ -171,10 +179,13 @@ def mitama_manifest():
 
 
 class UserCRUDController(Controller):
+    lifecycle = "singleton"
+    model = _Model("User")
+
     def create(self, request):
         post = request.post()
         try:
-            user = User()
+            user = self.model()
             user.screen_name = post["screen_name"]
             user.name = post["name"]
             user.set_password(post["password"])
@@ -194,9 +205,9 @@ class UserCRUDController(Controller):
         try:
             id = request.params["id"]
             if id.isdigit():
-                user = User.retrieve(int(id))
+                user = self.model.retrieve(int(id))
             else:
-                user = User.retrieve(screen_name=id)
+                user = self.model.retrieve(screen_name=id)
             return Response.json(user.to_dict())
         except KeyError as err:
             error = err
@@ -209,32 +220,24 @@ class UserCRUDController(Controller):
             )
 
     def icon(self, request):
-        try:
-            id = request.params["id"]
-            if id.isdigit():
-                user = User.retrieve(int(id))
-            else:
-                user = User.retrieve(screen_name=id)
-            f = magic.Magic(mime=True, uncompress=True)
-            mime = f.from_buffer(group.icon)
-            return Response(body=user.icon, content_type=mime)
-        except KeyError as err:
-            return Response.error(
-                {
-                    "error": err.__class__.__name__,
-                    "message": err.message,
-                    "args": err.args,
-                }
-            )
+        from mitama.utils.icons import icon_response
+
+        id = request.params["id"]
+        node = self.model.query.with_entities(self.model._id).filter(
+            (self.model._id == id) | (self.model._screen_name == id)
+        ).first()
+        if node is None:
+            return Response(status=404)
+        return icon_response(request, "user", node[0])
 
     def update(self, request):
         try:
             post = request.post()
             id = request.params["id"]
             if id.isdigit():
-                user = User.retrieve(int(id))
+                user = self.model.retrieve(int(id))
             else:
-                user = User.retrieve(screen_name=id)
+                user = self.model.retrieve(screen_name=id)
             if "screen_name" in post:
                 user.screen_name = post["screen_name"]
             if "name" in post:
@@ -257,9 +260,9 @@ class UserCRUDController(Controller):
         try:
             id = request.params["id"]
             if id.isdigit():
-                user = User.retrieve(int(id))
+                user = self.model.retrieve(int(id))
             else:
-                user = User.retrieve(screen_name=id)
+                user = self.model.retrieve(screen_name=id)
             user.delete()
             return Response.json({"_id": user._id})
         except Exception as err:
@@ -273,15 +276,18 @@ class UserCRUDController(Controller):
             )
 
     def list(self, request):
-        users = User.list()
+        users = self.model.list()
         return Response.json([user.to_dict for user in users])
 
 
 class GroupCRUDController(Controller):
+    lifecycle = "singleton"
+    model = _Model("Group")
+
     def create(self, request):
         post = request.post()
         try:
-            group = Group()
+            group = self.model()
             group.screen_name = post["screen_name"]
             group.name = post["name"]
             group.create()
@@ -300,9 +306,9 @@ class GroupCRUDController(Controller):
         try:
             id = request.params["id"]
             if id.isdigit():
-                group = Group.retrieve(int(id))
+                group = self.model.retrieve(int(id))
             else:
-                group = Group.retrieve(screen_name=id)
+                group = self.model.retrieve(screen_name=id)
             return Response.json(group.to_dict())
         except KeyError as err:
             error = err
@@ -315,32 +321,24 @@ class GroupCRUDController(Controller):
             )
 
     def icon(self, request):
-        try:
-            id = request.params["id"]
-            if id.isdigit():
-                group = Group.retrieve(int(id))
-            else:
-                group = Group.retrieve(screen_name=id)
-            f = magic.Magic(mime=True, uncompress=True)
-            mime = f.from_buffer(group.icon)
-            return Response(body=group.icon, content_type=mime)
-        except KeyError as err:
-            return Response.error(
-                {
-                    "error": err.__class__.__name__,
-                    "message": err.message,
-                    "args": err.args,
-                }
-            )
+        from mitama.utils.icons import icon_response
+
+        id = request.params["id"]
+        node = self.model.query.with_entities(self.model._id).filter(
+            (self.model._id == id) | (self.model._screen_name == id)
+        ).first()
+        if node is None:
+            return Response(status=404)
+        return icon_response(request, "group", node[0])
 
     def update(self, request):
         try:
             post = request.post()
             id = request.params["id"]
             if id.isdigit():
-                group = Group.retrieve(int(id))
+                group = self.model.retrieve(int(id))
             else:
-                group = Group.retrieve(screen_name=id)
+                group = self.model.retrieve(screen_name=id)
             if "screen_name" in post:
                 group.screen_name = post["screen_name"]
             if "name" in post:
@@ -361,9 +359,9 @@ class GroupCRUDController(Controller):
         try:
             id = request.params["id"]
             if id.isdigit():
-                group = Group.retrieve(int(id))
+                group = self.model.retrieve(int(id))
             else:
-                group = Group.retrieve(screen_name=id)
+                group = self.model.retrieve(screen_name=id)
             group.delete()
             return Response.json({"_id": group._id})
         except Exception as err:
@@ -377,5 +375,5 @@ class GroupCRUDController(Controller):
             )
 
     def list(self, request):
-        groups = Group.list()
+        groups = self.model.list()
         return Response.json([group.to_dict() for group in groups])
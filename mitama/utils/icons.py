@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""ユーザーとグループのアイコンの配信
+
+    * アイコンは /_mitama/icons/<user|group>/<_id> で配信し、テンプレートからはicon_urlでURLを取得します
+    * ログインしていないリクエストには401を返します
+    * URLにはアイコンのハッシュが入るので、ブラウザはアイコンが変わるまでキャッシュを使い続けます（共有キャッシュには保存させません）
+    * ETagはアイコンのハッシュとサイズから作るので、If-None-Matchが一致すればアイコンを読み込まずに304を返します
+    * sizeを指定すると、mitama.models.renditionsで作った縮小画像を返します（Acceptがimage/webpを含めばWebP、それ以外はPNG）
+    * 縮小画像はメモリにもキャッシュします
+
+    .. code-block:: html
+
+        <img src="{{ icon_url(user, 80) }}" />
+"""
+
+import threading
+from collections import OrderedDict
+
+from mitama.app import Controller
+from mitama.app.http import Response
+from mitama.noimage import assets
+
+PREFIX = "/_mitama/icons"
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def _models():
+    from mitama.models import Group, User
+
+    return {"user": User, "group": Group}
+
+
+def _kind(node):
+    for kind, model in _models().items():
+        if isinstance(node, model):
+            return kind
+    return None
+
+
+def icon_url(node, size=None):
+    """アイコンのURLを返します
+
+    UserとGroup以外（アプリなど）には、data URLを返します。
+    :param node: UserまたはGroupのインスタンス
+    :param size: mitama.models.renditions.pipeline.sizesのいずれかの大きさ（省略した場合は元の画像）
+    """
+    kind = _kind(node)
+    if kind is None:
+        from mitama.app.app import dataurl
+        return dataurl(node.icon)
+    version = node.icon_hash or assets["noimage_" + kind].digest
+    url = "%s/%s/%s?v=%s" % (PREFIX, kind, node._id, version)
+    if size is not None:
+        url += "&size=%d" % size
+    return url
+
+
+class IconCache:
+    """縮小したアイコンのキャッシュ
+
+    (アイコンのハッシュ, 大きさ, 形式)ごとに、(画像, MIMEタイプ)を保持します。
+    :param maxsize: 保持する画像の最大数
+    :param maxbytes: 保持する画像の合計バイト数の上限（これより大きい画像はキャッシュしません）
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=32 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, compute):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                return entry
+        entry = compute()
+        size = len(entry[0])
+        if size > self.maxbytes:
+            return entry
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old[0])
+            self._data[key] = entry
+            self.nbytes += size
+            while len(self._data) > self.maxsize or self.nbytes > self.maxbytes:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= len(evicted[0])
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._data = OrderedDict()
+            self.nbytes = 0
+
+
+icons = IconCache()
+
+
+def _source(model, _id, noimage):
+    """(元の画像, MIMEタイプ)を返す関数を返します"""
+    if noimage is not None and not model._icon_proxy:
+        # アイコンのないノードは、データベースを読まずに組み込みのNoImage画像を返します
+        return lambda: (noimage.data, noimage.mime)
+
+    def load():
+        node = model.retrieve(_id, with_icon=True)
+        return node.icon, node.icon_mime
+    return load
+
+
+def _render(model, _id, noimage, digest, size, format):
+    from mitama.models.renditions import MIMES, pipeline
+
+    load = _source(model, _id, noimage)
+    if size is not None:
+        data = pipeline.get(digest, size, format, lambda: load()[0])
+        if data is not None:
+            return data, MIMES[format]
+    return load()
+
+
+def _format(request, formats):
+    accept = request.headers.get("HTTP_ACCEPT", "")
+    if "webp" in formats and "image/webp" in accept:
+        return "webp"
+    return "png"
+
+
+def _not_modified(request, etag):
+    header = request.headers.get("HTTP_IF_NONE_MATCH")
+    if header is None:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def icon_response(request, kind, _id):
+    """アイコンを返すResponseを作ります
+
+    :param request: Requestインスタンス（クエリのvとsize、AcceptとIf-None-Matchを使います）
+    :param kind: "user"または"group"
+    :param _id: ノードのID
+    """
+    from mitama.models.renditions import pipeline
+
+    model = _models().get(kind)
+    if model is None:
+        return Response(status=404)
+    size = request.query.get("size", [None])[0]
+    format = None
+    if size is not None:
+        if not size.isdigit() or int(size) not in pipeline.sizes:
+            return Response(status=400)
+        size = int(size)
+        format = _format(request, pipeline.formats)
+    row = model.query.with_entities(model._icon_hash).filter(model._id == _id).first()
+    if row is None:
+        return Response(status=404)
+    # アイコンのないノードは、NoImage画像のハッシュを使います
+    noimage = assets["noimage_" + kind] if row[0] is None else None
+    digest = row[0] or noimage.digest
+    etag = '"%s-%s"' % (digest, "%d.%s" % (size, format) if size else "orig")
+    # URLのハッシュが現在のアイコンと一致する時だけ、変更されないものとしてキャッシュさせます
+    version = request.query.get("v", [None])[0]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE if version == digest else "no-cache",
+        "Vary": "Accept",
+    }
+    if _not_modified(request, etag):
+        return Response(status=304, headers=headers)
+    body, mime = icons.get(
+        (digest, size, format),
+        lambda: _render(model, _id, noimage, digest, size, format)
+    )
+    return Response(body=body, content_type=mime, headers=headers)
+
+
+def _authenticate(request):
+    """セッションのjwt_tokenからログイン中のUserをrequest.userに入れます
+
+    :return: ログインしていればTrue
+    """
+    from mitama.models.identity import identities
+
+    try:
+        sess = request.session()
+        if "jwt_token" not in sess:
+            return False
+        request.user = identities.authenticate(sess["jwt_token"])
+    except Exception:
+        return False
+    return True
+
+
+class IconController(Controller):
+    """アイコンを配信するController
+
+    アプリの外（プロジェクトのルーター）で動くので、ログイン判定はここで行います。
+    """
+
+    lifecycle = "singleton"
+
+    def handle(self, request):
+        if not _authenticate(request):
+            return Response(status=401, headers={"Cache-Control": "no-store"})
+        return icon_response(request, request.params["kind"], request.params["id"])
@@ -4,20 +4,24 @@ from secrets import token_hex
 
 from mitama.app import Middleware
 from mitama.app.http import Response
-from mitama.models import User
 
 
 class SessionMiddleware(Middleware):
     """ログイン判定ミドルウェア
 
     ログインしていないユーザーがアクセスした場合、/login?redirect_to=<URL>にリダイレクトします。
+    request.userにはログイン中のUserが入ります。認証結果はmitama.models.identityにキャッシュされます。
     """
 
+    lifecycle = "singleton"
+
     def process(self, request, handler):
+        from mitama.models.identity import identities
+
         sess = request.session()
         try:
             if "jwt_token" in sess:
-                request.user = User.check_jwt(sess["jwt_token"])
+                request.user = identities.authenticate(sess["jwt_token"])
             else:
                 return Response.redirect(
                     request.app.project.login_page
@@ -36,7 +40,11 @@ class SessionMiddleware(Middleware):
 class BasicMiddleware(Middleware):
     """BASIC認証ミドルウェア"""
 
+    lifecycle = "singleton"
+
     def process(self, request, handler):
+        from mitama.models import User
+
         try:
             if "HTTP_AUTHORIZATION" in request.headers:
                 name, token = request.headers["HTTP_AUTHORIZATION"].split(" ")
@@ -63,6 +71,8 @@ class BasicMiddleware(Middleware):
 
 
 class CsrfMiddleware(Middleware):
+    lifecycle = "singleton"
+
     def process(self, request, handler):
         sess = request.session()
         if request.method == "POST":
@@ -0,0 +1,79 @@
+"""テスト用のデータベース
+
+    * mitama.modelsをimportする前にこのモジュールをimportしてください（DatabaseManagerが未初期化なら初期化します）
+    * DatabaseTestCaseを継承したテストクラスは、setUpClassでmitama.modelsのテーブルを持つ新しいインメモリのDBに切り替え、
+      tearDownClassで元のエンジン・メタデータ・Sessionに戻します
+    * 他のテストモジュールがDatabaseManagerを作り直していても、モデル自身のメタデータからテーブルを作ります
+"""
+
+import unittest
+
+from mitama.db import DatabaseManager
+from mitama.db.driver.sqlite3 import get_test_engine
+from mitama.db.pool import PoolMetrics
+
+if DatabaseManager.engine is None:
+    DatabaseManager.test()
+
+_saved = list()
+
+
+def _reset_caches():
+    from mitama.models.closure import closure
+    from mitama.models.decisions import decisions
+    from mitama.models.identity import identities
+    from mitama.models.renditions import pipeline
+    from mitama.utils.icons import icons
+
+    closure.invalidate()
+    decisions.invalidate()
+    identities.invalidate()
+    pipeline.clear()
+    icons.clear()
+
+
+def setup_database():
+    """mitama.modelsのテーブルを持つ新しいインメモリのDBに切り替えます"""
+    from mitama.models.core_db import db
+
+    _saved.append((
+        DatabaseManager.engine,
+        DatabaseManager.metadata,
+        DatabaseManager.metrics,
+        DatabaseManager._registry,
+    ))
+    engine = get_test_engine()
+    DatabaseManager.engine = engine
+    DatabaseManager.metrics = PoolMetrics()
+    DatabaseManager.metrics.attach(engine.pool)
+    DatabaseManager.metadata = db.Model.metadata
+    DatabaseManager._configure_sessions()
+    db.Model.metadata.create_all(engine)
+    _reset_caches()
+
+
+def teardown_database():
+    """setup_databaseの前の状態に戻します"""
+    DatabaseManager._registry.remove()
+    DatabaseManager.engine.dispose()
+    (
+        DatabaseManager.engine,
+        DatabaseManager.metadata,
+        DatabaseManager.metrics,
+        DatabaseManager._registry,
+    ) = _saved.pop()
+    _reset_caches()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """クラスごとに新しいデータベースを使うTestCase"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        setup_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        teardown_database()
+        super().tearDownClass()
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from mitama.app import App, Controller, Middleware, Router
+from mitama.app.http import Response
+from mitama.app.http.static import FileResponse
+from mitama.app.method import *
+
+
+class ASGIClient:
+    """テスト用のプロセス内ASGIクライアント"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body=b"", headers=None):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [
+                (k.lower().encode(), v.encode()) for k, v in (headers or {}).items()
+            ],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 12345),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = list()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        return self.response(sent)
+
+    def response(self, sent):
+        start = sent[0]
+        return (
+            start["status"],
+            dict((k.decode(), v.decode()) for k, v in start["headers"]),
+            b"".join(m.get("body", b"") for m in sent[1:]),
+        )
+
+    async def send_all(self, scope, count):
+        """同じscopeのリクエストをcount個同時に送り、それぞれに送られたメッセージのリストを返します"""
+
+        async def one():
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+            sent = list()
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            await self.app(dict(scope), receive, send)
+            return sent
+
+        return await asyncio.gather(*[one() for i in range(count)])
+
+    def websocket(self, path, incoming):
+        scope = {"type": "websocket", "path": path, "headers": [], "query_string": b""}
+        messages = [{"type": "websocket.connect"}]
+        messages += [{"type": "websocket.receive", "text": text} for text in incoming]
+        messages.append({"type": "websocket.disconnect"})
+        sent = list()
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        return sent
+
+
+def thread_info(request, kind):
+    return Response.json({
+        "kind": kind,
+        "thread": threading.get_ident(),
+        "tags": getattr(request, "tags", []),
+    })
+
+
+class SyncController(Controller):
+    def handle(self, request):
+        return thread_info(request, "sync")
+
+
+class AsyncController(Controller):
+    async def handle(self, request):
+        await asyncio.sleep(0)
+        return thread_info(request, "async")
+
+    async def echo(self, request):
+        body = await asyncio.sleep(0, request.body.decode())
+        return Response(text=body)
+
+
+class FileController(Controller):
+    def handle(self, request):
+        size = os.path.getsize(request.app.filename)
+        return FileResponse(request.app.filename, size, 0, size, block_size=4)
+
+
+class SocketController(Controller):
+    def handle(self, request):
+        ws = request.websocket
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            ws.send(message.upper())
+        return Response()
+
+
+async def async_view(request):
+    return Response(text="function")
+
+
+class AsyncMiddleware(Middleware):
+    async def process(self, request, handler):
+        request.tags = getattr(request, "tags", []) + ["async"]
+        response = await handler(request)
+        response.headers = dict(response.headers, **{"X-Async": "1"})
+        return response
+
+
+class SyncMiddleware(Middleware):
+    def process(self, request, handler):
+        request.tags = getattr(request, "tags", []) + ["sync"]
+        return handler(request)
+
+
+class ASGIApp(App):
+    router = Router(
+        [
+            view("/sync", SyncController),
+            view("/async", AsyncController),
+            post("/echo", AsyncController, "echo"),
+            view("/function", async_view),
+            view("/ws", SocketController),
+            view("/file", FileController),
+        ],
+        middlewares=[AsyncMiddleware, SyncMiddleware],
+    )
+
+
+class LongPollController(Controller):
+    async def handle(self, request):
+        await request.app.event.wait()
+        return thread_info(request, "poll")
+
+
+class AsyncSocketController(Controller):
+    async def handle(self, request):
+        ws = request.websocket
+        while True:
+            message = await ws.areceive()
+            if message is None:
+                break
+            await ws.asend(message[::-1])
+        return Response()
+
+
+class DualMiddleware(Middleware):
+    def process(self, request, handler):
+        request.tags = getattr(request, "tags", []) + ["dual-sync"]
+        return handler(request)
+
+    async def process_async(self, request, handler):
+        request.tags = getattr(request, "tags", []) + ["dual-async"]
+        return await handler(request)
+
+
+class LoopApp(App):
+    router = Router(
+        [
+            view("/poll", LongPollController),
+            view("/sync", SyncController),
+            view("/ws", AsyncSocketController),
+        ],
+        middlewares=[DualMiddleware, AsyncMiddleware],
+    )
+
+
+class TestASGI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = ASGIClient(ASGIApp("asgi", "/", "asgi", project_dir=".").asgi)
+
+    def test_sync_handler(self):
+        status, headers, body = self.client.request("GET", "/sync")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["X-Async"], "1")
+        data = json.loads(body)
+        self.assertEqual(data["kind"], "sync")
+        self.assertEqual(data["tags"], ["async", "sync"])
+        self.assertNotEqual(data["thread"], threading.get_ident())
+
+    def test_async_handler(self):
+        status, headers, body = self.client.request("GET", "/async")
+        self.assertEqual(status, 200)
+        data = json.loads(body)
+        self.assertEqual(data["kind"], "async")
+        self.assertEqual(data["tags"], ["async", "sync"])
+        self.assertEqual(data["thread"], threading.get_ident())
+
+    def test_body_and_function(self):
+        status, headers, body = self.client.request("POST", "/echo", b"hello")
+        self.assertEqual((status, body), (200, b"hello"))
+        status, headers, body = self.client.request("GET", "/function")
+        self.assertEqual((status, body), (200, b"function"))
+
+    def test_not_found(self):
+        status, headers, body = self.client.request("GET", "/nowhere")
+        self.assertEqual(status, 404)
+
+    def test_lifespan(self):
+        sent = list()
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(self.client.app({"type": "lifespan"}, receive, send))
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+
+    def test_websocket(self):
+        sent = self.client.websocket("/ws", ["a", "b"])
+        self.assertEqual(
+            [m["type"] for m in sent],
+            ["websocket.accept", "websocket.send", "websocket.send"],
+        )
+        self.assertEqual([m.get("text") for m in sent[1:3]], ["A", "B"])
+
+    def test_wsgi_runs_async_handler(self):
+        app = ASGIApp("asgi", "/", "asgi", project_dir=".")
+        environ = {"PATH_INFO": "/async"}
+        setup_testing_defaults(environ)
+        result = dict()
+
+        def start_response(status, headers, exc_info=None):
+            result["status"] = status
+
+        body = b"".join(app.wsgi(environ, start_response))
+        self.assertEqual(result["status"], "200 OK")
+        self.assertEqual(json.loads(body)["kind"], "async")
+
+
+class TestASGIExecutor(unittest.TestCase):
+    def setUp(self):
+        self.app = ASGIApp("asgi", "/", "asgi", project_dir=".")
+        self.client = ASGIClient(self.app.asgi)
+
+    def scope(self, path):
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [],
+            "server": ("testserver", 80),
+        }
+
+    def test_more_requests_than_workers(self):
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+
+        async def run():
+            asyncio.get_running_loop().set_default_executor(executor)
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    self.client.send_all(self.scope("/sync"), 4),
+                    self.client.send_all(self.scope("/async"), 4),
+                ),
+                timeout=10,
+            )
+
+        for kind, results in zip(["sync", "async"], asyncio.run(run())):
+            for sent in results:
+                status, headers, body = self.client.response(sent)
+                self.assertEqual(status, 200)
+                self.assertEqual(json.loads(body)["kind"], kind)
+                self.assertEqual(json.loads(body)["tags"], ["async", "sync"])
+
+    def test_streaming(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b"0123456789")
+        self.addCleanup(os.unlink, f.name)
+        self.app.filename = f.name
+        sent = asyncio.run(self.client.send_all(self.scope("/file"), 1))[0]
+        bodies = [m for m in sent if m["type"] == "http.response.body"]
+        self.assertEqual([m["body"] for m in bodies], [b"0123", b"4567", b"89", b""])
+        self.assertEqual([m.get("more_body", False) for m in bodies], [True, True, True, False])
+
+
+class TestASGIEventLoop(unittest.TestCase):
+    def setUp(self):
+        self.app = LoopApp("loop", "/", "loop", project_dir=".")
+        self.client = ASGIClient(self.app.asgi)
+
+    def scope(self, path):
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [],
+            "server": ("testserver", 80),
+        }
+
+    def test_long_polls_do_not_hold_workers(self):
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        self.app.asgi_executor = executor
+
+        async def run():
+            self.app.event = asyncio.Event()
+            with mock.patch.object(executor, "submit", wraps=executor.submit) as submit:
+                polls = asyncio.ensure_future(self.client.send_all(self.scope("/poll"), 8))
+                await asyncio.sleep(0.05)
+                self.assertEqual(submit.call_count, 0)
+                sync = await asyncio.wait_for(self.client.send_all(self.scope("/sync"), 1), 5)
+                self.assertFalse(polls.done())
+                self.app.event.set()
+                return sync, await asyncio.wait_for(polls, 5)
+
+        sync, polls = asyncio.run(run())
+        data = json.loads(self.client.response(sync[0])[2])
+        self.assertEqual(data["tags"], ["dual-async", "async"])
+        self.assertNotEqual(data["thread"], threading.get_ident())
+        for sent in polls:
+            status, headers, body = self.client.response(sent)
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)["tags"], ["dual-async", "async"])
+            self.assertEqual(json.loads(body)["thread"], threading.get_ident())
+
+    def test_async_websocket(self):
+        sent = self.client.websocket("/ws", ["abc", "de"])
+        self.assertEqual(
+            [m["type"] for m in sent],
+            ["websocket.accept", "websocket.send", "websocket.send"],
+        )
+        self.assertEqual([m.get("text") for m in sent[1:3]], ["cba", "ed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import random
+import unittest
+from unittest import mock
+
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+from tests.helpers import DatabaseTestCase
+
+from mitama.models import Group, User
+from mitama.models.closure import GroupClosure
+
+
+def legacy_user_is_ancestor(user, node):
+    layer = user.groups
+    while len(layer) > 0:
+        if isinstance(node, Group) and node in layer:
+            return True
+        for node_ in layer:
+            if isinstance(node, User) and node in node_.users:
+                return True
+        layer_ = list()
+        for node_ in layer:
+            layer_.extend(node_.groups)
+        layer = layer_
+    return False
+
+
+def legacy_group_is_ancestor(group, node):
+    layer = [group.parent] if group.parent is not None else []
+    while len(layer) > 0:
+        if isinstance(node, Group) and node in layer:
+            return True
+        for node_ in layer:
+            if isinstance(node, User) and node in node_.users:
+                return True
+        layer = [node_.parent for node_ in layer if node_.parent is not None]
+    return False
+
+
+def legacy_group_is_descendant(group, node):
+    layer = group.groups
+    while len(layer) > 0:
+        if node in layer:
+            return True
+        layer_ = list()
+        for node_ in layer:
+            layer_.extend(node_.groups)
+        layer = layer_
+    return False
+
+
+def make_user(name):
+    user = User()
+    user.name = name
+    user.screen_name = name
+    user.email = name + "@example.com"
+    user.create()
+    return user
+
+
+def make_group(name, parent=None):
+    group = Group()
+    group.name = name
+    group.screen_name = name
+    group.create()
+    if parent is not None:
+        parent.append(group)
+    return group
+
+
+class TestClosure(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rand = random.Random(0)
+        cls.groups = list()
+        for i in range(30):
+            parent = rand.choice(cls.groups) if cls.groups and rand.random() < 0.8 else None
+            cls.groups.append(make_group("closure_g%d" % i, parent))
+        cls.users = [make_user("closure_u%d" % i) for i in range(20)]
+        for user in cls.users:
+            for group in rand.sample(cls.groups, 3):
+                group.append(user)
+
+    def test_same_as_legacy(self):
+        nodes = self.groups + self.users
+        for user in self.users:
+            for node in nodes:
+                self.assertEqual(user.is_ancestor(node), legacy_user_is_ancestor(user, node))
+        for group in self.groups:
+            for node in nodes:
+                self.assertEqual(group.is_ancestor(node), legacy_group_is_ancestor(group, node))
+                self.assertEqual(group.is_descendant(node), legacy_group_is_descendant(group, node))
+                if isinstance(node, User):
+                    self.assertEqual(group.is_in(node), node in group.users)
+                else:
+                    self.assertEqual(group.is_in(node), node in group.groups)
+
+    def test_lookup_without_queries(self):
+        group = self.groups[-1]
+        user = self.users[0]
+        statements = list()
+
+        def count(*args):
+            statements.append(args)
+
+        def check():
+            group.is_ancestor(user)
+            group.is_descendant(self.groups[0])
+            user.is_ancestor(group)
+            group.is_in(user)
+
+        check()
+        engine = DatabaseManager.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            for _ in range(10):
+                check()
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
+
+    def test_invalidation(self):
+        root = make_group("closure_root")
+        child = make_group("closure_child", root)
+        grandchild = make_group("closure_grandchild", child)
+        user = make_user("closure_member")
+        self.assertTrue(root.is_descendant(grandchild))
+        self.assertFalse(child.is_in(user))
+
+        child.append(user)
+        self.assertTrue(child.is_in(user))
+        self.assertTrue(grandchild.is_ancestor(user))
+        self.assertTrue(user.is_ancestor(grandchild))
+
+        child.remove(user)
+        self.assertFalse(child.is_in(user))
+        self.assertFalse(user.is_ancestor(grandchild))
+
+        grandchild.parent = root
+        grandchild.update()
+        self.assertFalse(child.is_descendant(grandchild))
+        self.assertTrue(root.is_in(grandchild))
+
+        child.users.append(user)
+        child.update()
+        self.assertTrue(child.is_in(user))
+
+        child.delete()
+        self.assertFalse(root.is_descendant(child))
+        self.assertFalse(user.is_ancestor(child))
+
+    def test_invalidate_during_build(self):
+        cache = GroupClosure()
+        build = cache.build
+
+        def racing_build():
+            snapshot = build()
+            cache.invalidate()
+            return snapshot
+
+        with mock.patch.object(cache, "build", side_effect=racing_build):
+            self.assertIsNotNone(cache.snapshot())
+        self.assertIsNone(cache._snapshot)
+        self.assertIsNotNone(cache.snapshot())
+        self.assertIsNotNone(cache._snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,7 @@ import unittest
 from mitama.db import DatabaseManager, BaseDatabase
 from mitama.db.types import Column, Integer, String
 
-DatabaseManager.test()
+from tests.helpers import DatabaseTestCase
 
 class Database(BaseDatabase):
     pass
@@ -20,10 +20,13 @@ class ModelB(db.Model):
 
 from mitama.models import User, Group
 
-db.create_all()
 
+class TestBaseDatabase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        ModelA.metadata.create_all(DatabaseManager.engine)
 
-class TestBaseDatabase(unittest.TestCase):
     def test_create_db(self):
         self.assertTrue(db.engine.dialect.has_table(db.engine, "test_model_a"))
         self.assertTrue(db.engine.dialect.has_table(db.engine, "test_model_b"))
@@ -0,0 +1,206 @@
+import cProfile
+import pstats
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from mitama.app import App, Controller, Middleware, Router
+from mitama.app.dispatcher import Dispatcher
+from mitama.app.http import Request
+from mitama.app.method import *
+
+
+def make_request(path, method="GET"):
+    environ = {"PATH_INFO": path, "REQUEST_METHOD": method}
+    setup_testing_defaults(environ)
+    return Request(environ)
+
+
+class NameController(Controller):
+    def handle(self, request):
+        return ("handle", dict(request.params))
+
+    def __getattr__(self, name):
+        return lambda request: (name, dict(request.params))
+
+
+def tagging_middleware(tag):
+    class TaggingMiddleware(Middleware):
+        def process(self, request, handler):
+            request.tags = getattr(request, "tags", []) + [tag]
+            return handler(request)
+
+    return TaggingMiddleware
+
+
+class InnerApp(App):
+    router = Router(
+        [
+            view("/", NameController, "index"),
+            view("/items/<id:int>", NameController, "item"),
+        ],
+        middlewares=[tagging_middleware("inner")],
+    )
+
+
+def build_router():
+    inner = InnerApp("inner", "/inner", "inner", project_dir=".")
+    return Router(
+        [
+            view("/static/<path:path>", NameController, "static"),
+            view("/favicon.ico", NameController, "favicon"),
+            Router(
+                [
+                    view("/login", NameController, "login"),
+                    Router(
+                        [
+                            view("/", NameController),
+                            view("/users", NameController, "users"),
+                            view("/users/invite", NameController, "invite"),
+                            view("/users/<id>", NameController, "user"),
+                            view("/users/<id>/settings", NameController, "settings"),
+                            post("/groups/<id>/append", NameController, "append"),
+                            view("/groups/<id>/users/<uid>/remove", NameController, "remove"),
+                            view("/acs/post<hoge:re:.*>", NameController, "acs"),
+                        ],
+                        middlewares=[tagging_middleware("session")],
+                    ),
+                ],
+                middlewares=[tagging_middleware("csrf")],
+            ),
+            group("/inner", inner),
+            view("<path:path>", NameController, "fallback"),
+        ]
+    )
+
+
+def build_overlapping_router():
+    return Router(
+        [
+            view("/y/<name:re:[a-z]+>", NameController, "name"),
+            view("/<id>/z", NameController, "id_z"),
+            view("/z/<id>", NameController, "z_id"),
+            view("/a", NameController, "a"),
+            view("/a/", NameController, "a_slash"),
+            view("/files/<path:path>", NameController, "files"),
+            view("/files/readme", NameController, "readme"),
+            Router([view("/b/<id>", NameController, "nested")]),
+            view("/b/c", NameController, "b_c"),
+        ]
+    )
+
+
+OVERLAPPING_PATHS = [
+    "/y/a",
+    "/y/a/",
+    "/y/z",
+    "/y/z/",
+    "/y/Z/",
+    "/z/z",
+    "/z/z/",
+    "/q/z",
+    "/a",
+    "/a/",
+    "/files/readme",
+    "/files/readme/",
+    "/files/a/b/",
+    "/b/c",
+    "/b/c/",
+]
+
+
+PATHS = [
+    "/",
+    "/login",
+    "/login/",
+    "//login",
+    "/users",
+    "/users/",
+    "/users//invite",
+    "/users/invite",
+    "/users/alice",
+    "/users/alice/settings/",
+    "/groups/team/append",
+    "/groups/team/users/bob/remove",
+    "/acs/post",
+    "/acs/post/redirect",
+    "/static/css/style.css",
+    "/favicon.ico",
+    "/inner",
+    "/inner/",
+    "/inner/items/42",
+    "/inner/items/abc",
+    "/unknown/path",
+]
+
+
+class TestDispatcher(unittest.TestCase):
+    def run_handler(self, matcher, path, method="GET"):
+        request = make_request(path, method)
+        result = matcher.match(request)
+        if result is False:
+            return None
+        request, handle, _ = result
+        response = handle(request)
+        return response, getattr(request, "tags", [])
+
+    def test_same_as_router(self):
+        router = build_router()
+        dispatcher = router.compile()
+        self.assertIsInstance(dispatcher, Dispatcher)
+        for path in PATHS:
+            for method in ["GET", "POST", "DELETE"]:
+                self.assertEqual(
+                    self.run_handler(dispatcher, path, method),
+                    self.run_handler(router, path, method),
+                    "%s %s" % (method, path),
+                )
+
+    def test_overlapping_routes_same_as_router(self):
+        router = build_overlapping_router()
+        dispatcher = router.compile()
+        for path in OVERLAPPING_PATHS:
+            self.assertEqual(
+                self.run_handler(dispatcher, path),
+                self.run_handler(router, path),
+                path,
+            )
+        self.assertEqual(self.run_handler(dispatcher, "/y/a/")[0], ("name", {"name": "a"}))
+        self.assertEqual(self.run_handler(dispatcher, "/z/z")[0], ("id_z", {"id": "z"}))
+        self.assertEqual(self.run_handler(dispatcher, "/a/")[0], ("a_slash", {}))
+
+    def test_typed_capture(self):
+        dispatcher = build_router().compile()
+        response, tags = self.run_handler(dispatcher, "/inner/items/42")
+        self.assertEqual(response, ("item", {"id": 42}))
+        self.assertEqual(tags, ["inner"])
+        response, tags = self.run_handler(dispatcher, "/static/a/b.js")
+        self.assertEqual(response, ("static", {"path": "a/b.js"}))
+
+    def test_middleware_order(self):
+        dispatcher = build_router().compile()
+        response, tags = self.run_handler(dispatcher, "//users/alice//")
+        self.assertEqual(response, ("user", {"id": "alice"}))
+        self.assertEqual(tags, ["csrf", "session"])
+
+    def test_app_is_set(self):
+        dispatcher = build_router().compile()
+        request = make_request("/inner/")
+        request, handle, _ = dispatcher.match(request)
+        handle(request)
+        self.assertIsInstance(request.app, InnerApp)
+
+    def test_precomposed_handler(self):
+        dispatcher = build_router().compile()
+        request1, handle1, _ = dispatcher.match(make_request("/users/alice"))
+        request2, handle2, _ = dispatcher.match(make_request("/users/bob"))
+        self.assertIs(handle1, handle2)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        response = handle1(request1)
+        profiler.disable()
+        self.assertEqual(response, ("user", {"id": "alice"}))
+        self.assertEqual(request1.tags, ["csrf", "session"])
+        called = [func[2] for func in pstats.Stats(profiler).stats]
+        self.assertNotIn("isclass", called)
+        self.assertNotIn("<built-in method builtins.isinstance>", called)
@@ -11,6 +11,8 @@ db = Database()
 
 from mitama.models import Group, User
 
+DatabaseManager.create_all()
+
 class TestGroup(unittest.TestCase):
 
     def test_group(self):
@@ -0,0 +1,251 @@
+import io
+import unittest
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from PIL import Image
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+from tests.helpers import DatabaseTestCase
+
+from mitama.app.http import Request
+from mitama.models import Group, User
+from mitama.noimage import assets, load_noimage_user
+from mitama.utils.controllers import UserCRUDController
+from mitama.utils.icons import IconCache, IconController, icon_response, icon_url, icons
+
+
+def count_statements(test):
+    statements = list()
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = DatabaseManager.engine
+    event.listen(engine, "before_cursor_execute", count)
+    test.addCleanup(event.remove, engine, "before_cursor_execute", count)
+    return statements
+
+
+class TestDeferredIcon(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.group = Group()
+        cls.group.name = cls.group.screen_name = "icon_group"
+        cls.group.icon = b"group icon"
+        cls.group.create()
+        for i in range(3):
+            user = User()
+            user.name = user.screen_name = "icon_user_%d" % i
+            user.email = "icon_user_%d@example.com" % i
+            user.icon = b"user icon %d" % i
+            user.create()
+            cls.group.append(user)
+        cls.group.update()
+        plain = User()
+        plain.name = plain.screen_name = "icon_plain"
+        plain.email = "icon_plain@example.com"
+        plain.create()
+
+    def setUp(self):
+        DatabaseManager.session.expire_all()
+
+    def test_list_does_not_load_icons(self):
+        statements = count_statements(self)
+        users = User.list()
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("._icon AS", statements[0])
+        user = [user for user in users if user.screen_name == "icon_user_0"][0]
+        self.assertEqual(user.icon, b"user icon 0")
+        self.assertEqual(len(statements), 2)
+
+    def test_list_with_icon(self):
+        statements = count_statements(self)
+        users = User.list(with_icon=True, _screen_name="icon_user_1")
+        self.assertEqual(users[0].icon, b"user icon 1")
+        self.assertEqual(len(statements), 1)
+
+    def test_retrieve_with_icon(self):
+        statements = count_statements(self)
+        user = User.retrieve(screen_name="icon_user_2", with_icon=True)
+        self.assertEqual(user.icon, b"user icon 2")
+        self.assertEqual(len(statements), 1)
+
+    def test_noimage(self):
+        user = User.retrieve(screen_name="icon_plain")
+        self.assertEqual(user.icon, load_noimage_user())
+
+    def test_with_icon_relations(self):
+        statements = count_statements(self)
+        group = Group.with_icon("users").filter(Group._screen_name == "icon_group").one()
+        icons = sorted(user.icon for user in group.users)
+        self.assertEqual(group.icon, b"group icon")
+        self.assertEqual(icons, [b"user icon %d" % i for i in range(3)])
+        self.assertEqual(len(statements), 2)
+
+    def test_membership_does_not_load_icons(self):
+        statements = count_statements(self)
+        group = Group.retrieve(screen_name="icon_group")
+        self.assertEqual(len(group.users), 3)
+        self.assertFalse(any("._icon AS" in statement for statement in statements))
+
+
+def make_request(path, query="", **headers):
+    env = {"PATH_INFO": path, "QUERY_STRING": query, "REQUEST_METHOD": "GET"}
+    env.update(headers)
+    setup_testing_defaults(env)
+    return Request(env)
+
+
+def png(size):
+    output = io.BytesIO()
+    Image.new("RGB", (size, size), (0, 128, 255)).save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestIconCache(unittest.TestCase):
+    def test_maxbytes(self):
+        cache = IconCache(maxsize=10, maxbytes=10)
+        cache.get("a", lambda: (b"aaaa", "image/png"))
+        cache.get("b", lambda: (b"bbbb", "image/png"))
+        cache.get("c", lambda: (b"cccc", "image/png"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 8)
+        self.assertEqual(cache.get("a", lambda: (b"new", "image/png"))[0], b"new")
+        cache.get("big", lambda: (b"x" * 11, "image/png"))
+        self.assertEqual(cache.nbytes, 7)
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+
+class TestIconEndpoint(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User()
+        cls.user.name = cls.user.screen_name = "endpoint_user"
+        cls.user.email = "endpoint_user@example.com"
+        cls.user.icon = png(300)
+        cls.user.create()
+        cls.plain = Group()
+        cls.plain.name = cls.plain.screen_name = "endpoint_plain"
+        cls.plain.create()
+
+    def setUp(self):
+        icons.clear()
+        DatabaseManager.session.expire_all()
+
+    def respond(self, node, query="", **headers):
+        kind = "user" if isinstance(node, User) else "group"
+        return icon_response(make_request("/", query, **headers), kind, node._id)
+
+    def test_icon_url(self):
+        url = icon_url(self.user, 80)
+        self.assertEqual(
+            url,
+            "/_mitama/icons/user/%s?v=%s&size=80" % (self.user._id, self.user.icon_hash)
+        )
+        self.assertIn("v=" + assets["noimage_group"].digest, icon_url(self.plain))
+
+    def test_icon_url_does_not_load_icon(self):
+        user = User.retrieve(screen_name="endpoint_user")
+        statements = count_statements(self)
+        icon_url(user)
+        self.assertFalse(any("._icon AS" in statement for statement in statements))
+
+    def test_original(self):
+        response = self.respond(self.user, "v=" + self.user.icon_hash)
+        self.assertEqual(response.body, self.user.icon)
+        self.assertEqual(response.content_type, "image/png")
+        self.assertEqual(response.headers["ETag"], '"%s-orig"' % self.user.icon_hash)
+        self.assertEqual(response.headers["Cache-Control"], "private, max-age=31536000, immutable")
+
+    def test_stale_version_is_not_immutable(self):
+        response = self.respond(self.user, "v=old")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+    def test_size(self):
+        response = self.respond(self.user, "size=80")
+        self.assertEqual(Image.open(io.BytesIO(response.body)).size, (80, 80))
+        self.assertEqual(self.respond(self.user, "size=81")._status, 400)
+
+    def test_webp(self):
+        response = self.respond(self.user, "size=80", HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(response.content_type, "image/webp")
+        self.assertEqual(Image.open(io.BytesIO(response.body)).format, "WEBP")
+        self.assertEqual(response.headers["ETag"], '"%s-80.webp"' % self.user.icon_hash)
+        self.assertEqual(response.headers["Vary"], "Accept")
+        response = self.respond(self.user, "size=80")
+        self.assertEqual(response.content_type, "image/png")
+
+    def test_resized_icons_are_cached(self):
+        self.respond(self.user, "size=40")
+        statements = count_statements(self)
+        self.respond(self.user, "size=40")
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("._icon AS", statements[0])
+
+    def test_not_modified(self):
+        etag = self.respond(self.user, "size=40").headers["ETag"]
+        statements = count_statements(self)
+        response = self.respond(self.user, "size=40", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response._status, 304)
+        self.assertIsNone(response.body)
+        self.assertEqual(len(statements), 1)
+        response = self.respond(self.user, "size=80", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response._status, 200)
+
+    def test_noimage(self):
+        noimage = assets["noimage_group"]
+        request = make_request("/", "v=" + noimage.digest)
+        _id = self.plain._id
+        statements = count_statements(self)
+        response = icon_response(request, "group", _id)
+        self.assertEqual(response.body, noimage.data)
+        self.assertEqual(response.content_type, "image/png")
+        self.assertEqual(response.headers["ETag"], '"%s-orig"' % noimage.digest)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("._icon AS", statements[0])
+
+    def test_mime_is_stored(self):
+        self.assertEqual(self.user._icon_mime, "image/png")
+        user = User.retrieve(screen_name="endpoint_user")
+        with mock.patch("mitama.models.nodes.guess_mime") as guess_mime:
+            response = self.respond(user)
+        guess_mime.assert_not_called()
+        self.assertEqual(response.content_type, "image/png")
+
+    def test_not_found(self):
+        response = icon_response(make_request("/"), "user", "nobody")
+        self.assertEqual(response._status, 404)
+        response = icon_response(make_request("/"), "app", self.user._id)
+        self.assertEqual(response._status, 404)
+
+    def test_requires_login(self):
+        def handle(session):
+            request = make_request("/_mitama/icons/user/" + self.user._id)
+            request.params = {"kind": "user", "id": self.user._id}
+            request["mitama_session"] = session
+            return IconController().handle(request)
+
+        self.assertEqual(handle({"mitama_csrf_token": "csrf"})._status, 401)
+        self.assertEqual(handle({"jwt_token": None})._status, 401)
+        response = handle({"jwt_token": self.user.get_jwt()})
+        self.assertEqual(response._status, 200)
+        self.assertEqual(response.body, self.user.icon)
+
+    def test_crud_controller(self):
+        request = make_request("/users/endpoint_user/icon")
+        request.params = {"id": "endpoint_user"}
+        response = UserCRUDController().icon(request)
+        self.assertEqual(response.body, self.user.icon)
+        request.params = {"id": "nobody"}
+        self.assertEqual(UserCRUDController().icon(request)._status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+from tests.helpers import DatabaseTestCase
+
+from mitama.models import AuthorizationError, Permission, Role, User
+from mitama.models.identity import IdentityCache, identities
+from mitama.utils.middlewares import SessionMiddleware
+
+
+def make_user(name):
+    user = User()
+    user.name = name
+    user.screen_name = name
+    user.email = name + "@example.com"
+    user.create()
+    return user
+
+
+def count_statements(test):
+    statements = list()
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = DatabaseManager.engine
+    event.listen(engine, "before_cursor_execute", count)
+    test.addCleanup(event.remove, engine, "before_cursor_execute", count)
+    return statements
+
+
+class FakeRequest(dict):
+    def __init__(self, token):
+        super().__init__()
+        self._session = {"jwt_token": token}
+
+    def session(self):
+        return self._session
+
+
+class TestIdentityCache(DatabaseTestCase):
+    def setUp(self):
+        self.user = make_user("identity_" + self.id().rsplit(".", 1)[1])
+        self.token = self.user.get_jwt()
+        self.cache = IdentityCache(ttl=60)
+
+    def test_user(self):
+        icon = self.user.icon
+        user = self.cache.authenticate(self.token)
+        self.assertIs(type(user), User)
+        self.assertIs(user, self.user)
+        DatabaseManager.session.expunge_all()
+        user = self.cache.authenticate(self.token)
+        self.assertIs(type(user), User)
+        self.assertIn(user, DatabaseManager.session)
+        self.assertEqual(user._id, self.user._id)
+        self.assertEqual(user.screen_name, self.user.screen_name)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(user.icon, icon)
+
+    def test_cached_request_has_no_queries(self):
+        self.cache.authenticate(self.token)
+        statements = count_statements(self)
+        DatabaseManager.session.expunge_all()
+        with mock.patch.object(User, "decode_jwt") as decode:
+            user = self.cache.authenticate(self.token)
+            user.screen_name
+            user.email
+        decode.assert_not_called()
+        self.assertEqual(statements, [])
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_icon_is_not_loaded(self):
+        statements = count_statements(self)
+        self.cache.authenticate(self.token)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("mitama_user._icon", statements[0])
+
+    def test_permission(self):
+        role = Role()
+        role.name = role.screen_name = "identity_role"
+        role.create()
+        Permission.accept("admin", role)
+        role.users.append(self.user)
+        role.update()
+        user = self.cache.authenticate(self.token)
+        self.assertTrue(Permission.is_accepted("admin", user))
+
+    def test_ttl(self):
+        self.cache.authenticate(self.token)
+        with mock.patch("time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(self.cache.lookup(self.token))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_default_ttl(self):
+        self.assertLessEqual(identities.ttl, 30)
+
+    def test_invalid_token(self):
+        with self.assertRaises(AuthorizationError):
+            self.cache.authenticate(self.token + "x")
+
+    def test_update_invalidates(self):
+        identities.authenticate(self.token)
+        self.assertIsNotNone(identities.lookup(self.token))
+        self.user.name = "renamed"
+        self.user.update()
+        self.assertIsNone(identities.lookup(self.token))
+        self.assertEqual(identities.authenticate(self.token).name, "renamed")
+
+    def test_delete_invalidates(self):
+        identities.authenticate(self.token)
+        self.user.delete()
+        self.assertIsNone(identities.lookup(self.token))
+        with self.assertRaises(AuthorizationError):
+            identities.authenticate(self.token)
+
+    def test_invalidate_during_load(self):
+        cache = self.cache
+        load = cache._load
+
+        def racing_load(token):
+            identity = load(token)
+            cache.invalidate(self.user._id)
+            return identity
+
+        with mock.patch.object(cache, "_load", side_effect=racing_load):
+            cache.authenticate(self.token)
+        self.assertIsNone(cache.lookup(self.token))
+
+    def test_maxsize(self):
+        cache = IdentityCache(maxsize=2)
+        tokens = [self.user.get_jwt() for _ in range(3)]
+        for token in tokens:
+            cache.authenticate(token)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.lookup(tokens[0]))
+        cache.invalidate(self.user._id)
+        self.assertEqual(len(cache), 0)
+
+    def test_middleware(self):
+        request = FakeRequest(self.token)
+        response = SessionMiddleware().process(request, lambda request: "ok")
+        self.assertEqual(response, "ok")
+        self.assertEqual(request.user, self.user)
+        self.assertEqual(request.user.screen_name, self.user.screen_name)
+
+
+if __name__ == "__main__":
+    unittest.main()
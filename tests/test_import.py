@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout.split()
+
+
+class TestImport(unittest.TestCase):
+    def test_utils_do_not_load_models(self):
+        loaded = run(
+            "import sys\n"
+            "import mitama.utils.controllers, mitama.utils.middlewares\n"
+            "print('mitama.models' in sys.modules, 'pywebpush' in sys.modules)\n"
+        )
+        self.assertEqual(loaded, ["False", "False"])
+
+    def test_models_do_not_touch_database(self):
+        output = run(
+            "import os, sys, tempfile\n"
+            "from sqlalchemy import event, inspect\n"
+            "from mitama.db import DatabaseManager\n"
+            "DatabaseManager({'type': 'sqlite', 'path': os.path.join(tempfile.mkdtemp(), 'db.sqlite3')})\n"
+            "statements = []\n"
+            "event.listen(DatabaseManager.engine, 'before_cursor_execute', lambda *args: statements.append(args))\n"
+            "import mitama.models\n"
+            "print(len(statements), 'pywebpush' in sys.modules)\n"
+            "DatabaseManager.create_all()\n"
+            "print('mitama_user' in inspect(DatabaseManager.engine).get_table_names())\n"
+        )
+        self.assertEqual(output, ["0", "False", "True"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import threading
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from mitama.app import Controller, Middleware, Router
+from mitama.app.http import Request
+from mitama.app.method import view
+
+
+def make_request(path):
+    environ = {"PATH_INFO": path}
+    setup_testing_defaults(environ)
+    return Request(environ)
+
+
+class SingletonController(Controller):
+    lifecycle = "singleton"
+    instances = 0
+
+    def __init__(self, app=None):
+        super().__init__(app)
+        SingletonController.instances += 1
+
+    def handle(self, request):
+        return (request.params["id"], request["tag"])
+
+
+class SingletonMiddleware(Middleware):
+    lifecycle = "singleton"
+    instances = 0
+
+    def __init__(self, app=None):
+        super().__init__(app)
+        SingletonMiddleware.instances += 1
+
+    def process(self, request, handler):
+        request["tag"] = "tag-" + request.params["id"]
+        return handler(request)
+
+
+class RequestController(Controller):
+    instances = 0
+
+    def __init__(self, app=None):
+        super().__init__(app)
+        RequestController.instances += 1
+
+    def handle(self, request):
+        return request.params["id"]
+
+
+class Mount:
+    """Dispatcherが平坦化せず、リクエストごとに内側でルーティングするもの"""
+
+    def __init__(self, route):
+        self.route = route
+
+    def match(self, request):
+        return self.route.match(request)
+
+
+class Wrap(Mount):
+    """Appのように、マッチするたびに新しいハンドラを返すもの"""
+
+    def match(self, request):
+        request, handle, method = self.route.match(request)
+
+        def _handle(request):
+            return handle(request)
+
+        return request, _handle, method
+
+
+class TestLifecycle(unittest.TestCase):
+    def setUp(self):
+        SingletonController.instances = 0
+        SingletonMiddleware.instances = 0
+        RequestController.instances = 0
+
+    def dispatch(self, router, path):
+        request, handle, method = router.match(make_request(path))
+        return handle(request)
+
+    def test_singleton(self):
+        for router in [
+            Router([view("/<id>", SingletonController)], [SingletonMiddleware]),
+            Router([view("/<id>", SingletonController)], [SingletonMiddleware]).freeze(),
+        ]:
+            self.setUp()
+            for i in range(5):
+                self.assertEqual(self.dispatch(router, "/%d" % i), (str(i), "tag-%d" % i))
+            self.assertEqual(SingletonController.instances, 1)
+            self.assertEqual(SingletonMiddleware.instances, 1)
+
+    def test_singleton_behind_opaque_route(self):
+        router = Router(
+            [Mount(view("/<id>", SingletonController))], [SingletonMiddleware]
+        ).freeze()
+        handlers = set()
+        for i in range(5):
+            request, handle, method = router.match(make_request("/%d" % i))
+            handlers.add(handle)
+            self.assertEqual(handle(request), (str(i), "tag-%d" % i))
+        self.assertEqual(len(handlers), 1)
+        self.assertEqual(SingletonController.instances, 1)
+        self.assertEqual(SingletonMiddleware.instances, 1)
+
+    def test_fresh_handlers_are_not_cached(self):
+        router = Router(
+            [Wrap(view("/<id>", lambda request: request.params["id"]))], [SingletonMiddleware]
+        ).freeze()
+        for i in range(5):
+            self.assertEqual(self.dispatch(router, "/%d" % i), str(i))
+        entry = router._dispatcher.root.dynamic[0][1]
+        self.assertEqual(entry.handlers, {})
+        self.assertEqual(SingletonMiddleware.instances, 1)
+
+    def test_request(self):
+        router = Router([view("/<id>", RequestController)]).freeze()
+        for i in range(5):
+            self.assertEqual(self.dispatch(router, "/%d" % i), str(i))
+        self.assertEqual(RequestController.instances, 5)
+
+    def test_thread_safety(self):
+        router = Router(
+            [view("/<id>", SingletonController)],
+            [SingletonMiddleware]
+        ).freeze()
+        barrier = threading.Barrier(16)
+        results = dict()
+
+        def worker(n):
+            barrier.wait()
+            for i in range(50):
+                id = "%d-%d" % (n, i)
+                results[id] = self.dispatch(router, "/" + id)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 16 * 50)
+        for id, result in results.items():
+            self.assertEqual(result, (id, "tag-" + id))
+        self.assertLessEqual(SingletonController.instances, 16)
+        self.assertEqual(self.dispatch(router, "/last"), ("last", "tag-last"))
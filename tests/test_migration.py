@@ -0,0 +1,235 @@
+import unittest
+
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, create_engine, event, inspect, select
+
+from mitama.db import BaseDatabase, DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.db.migration import MigrationRegistry, Migrator, Operations, registry
+from mitama.models import InnerPermission, schema
+from mitama.models.nodes import User, icon_digest
+
+metadata = MetaData()
+articles = Table(
+    "mig_article",
+    metadata,
+    Column("_id", Integer, primary_key=True),
+    Column("title", String(64)),
+)
+
+
+def make_engine(rows=10):
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(articles.insert(), [
+            {"_id": i, "title": "article%d" % i} for i in range(rows)
+        ])
+    return engine
+
+
+class TestOperations(unittest.TestCase):
+    def test_add_column(self):
+        engine = make_engine()
+        op = Operations(engine)
+        op.add_column(articles, Column("slug", String(64)))
+        op.add_column("mig_article", Column("slug", String(64)))
+        columns = [column["name"] for column in inspect(engine).get_columns("mig_article")]
+        self.assertEqual(columns, ["_id", "title", "slug"])
+
+    def test_create_and_drop_index(self):
+        engine = make_engine()
+        op = Operations(engine)
+        index = Index("ix_mig_article_title", articles.c.title)
+        self.addCleanup(articles.indexes.discard, index)
+        op.create_index(index)
+        op.create_index(index)
+        self.assertTrue(op.has_index(articles, "ix_mig_article_title"))
+        op.drop_index(index)
+        op.drop_index(index)
+        self.assertFalse(op.has_index(articles, "ix_mig_article_title"))
+
+    def test_backfill_in_batches(self):
+        engine = make_engine(rows=25)
+        op = Operations(engine, batch_size=10)
+        updates = list()
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith("UPDATE"):
+                updates.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        updated = op.backfill(
+            articles,
+            {"title": articles.c.title + "!"},
+            where=articles.c._id >= 3
+        )
+        event.remove(engine, "before_cursor_execute", count)
+        self.assertEqual(updated, 22)
+        self.assertEqual(len(updates), 3)
+        with engine.connect() as conn:
+            titles = dict(
+                (row[0], row[1])
+                for row in conn.execute(select([articles.c._id, articles.c.title]))
+            )
+        self.assertEqual(titles[2], "article2")
+        self.assertEqual(titles[3], "article3!")
+        self.assertEqual(titles[24], "article24!")
+
+    def test_backfill_with_function(self):
+        engine = make_engine(rows=5)
+        op = Operations(engine, batch_size=2)
+        updated = op.backfill(
+            articles,
+            lambda row: {"title": row["title"].upper()},
+            columns=["title"],
+        )
+        self.assertEqual(updated, 5)
+        with engine.connect() as conn:
+            titles = [row[0] for row in conn.execute(select([articles.c.title]))]
+        self.assertEqual(titles, ["ARTICLE%d" % i for i in range(5)])
+
+
+class TestMigrator(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_engine()
+        self.registry = MigrationRegistry()
+        self.calls = list()
+
+    def migration(self, prefix, version, fail=False):
+        def func(op):
+            """テスト用のマイグレーション"""
+            if fail:
+                raise RuntimeError("failed")
+            self.calls.append((prefix, version))
+        self.registry.register(prefix, version, func)
+
+    def test_upgrade_in_order(self):
+        self.migration("blog", "0002")
+        self.migration("blog", "0001")
+        self.migration("wiki", "0001")
+        migrator = Migrator(self.engine, self.registry)
+        self.assertEqual(len(migrator.pending()), 3)
+        done = migrator.upgrade()
+        self.assertEqual(self.calls, [("blog", "0001"), ("blog", "0002"), ("wiki", "0001")])
+        self.assertEqual(len(done), 3)
+        self.assertEqual(migrator.upgrade(), [])
+        self.assertTrue(all(applied for _, applied in migrator.status()))
+        self.assertEqual(migrator.status("blog")[0][0].description, "テスト用のマイグレーション")
+
+    def test_target_and_fake(self):
+        self.migration("blog", "0001")
+        self.migration("blog", "0002")
+        migrator = Migrator(self.engine, self.registry)
+        migrator.upgrade(prefix="blog", target="0001", fake=True)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(migrator.applied("blog"), {"0001"})
+        migrator.upgrade(prefix="blog")
+        self.assertEqual(self.calls, [("blog", "0002")])
+
+    def test_failure_is_not_recorded(self):
+        self.migration("blog", "0001")
+        self.migration("blog", "0002", fail=True)
+        migrator = Migrator(self.engine, self.registry)
+        with self.assertRaises(RuntimeError):
+            migrator.upgrade()
+        self.assertEqual(migrator.applied("blog"), {"0001"})
+        self.assertEqual([m.version for m in migrator.pending()], ["0002"])
+
+    def test_forget(self):
+        self.migration("blog", "0001")
+        migrator = Migrator(self.engine, self.registry)
+        migrator.forget("blog")
+        migrator.upgrade()
+        migrator.forget("blog")
+        self.assertEqual(migrator.applied("blog"), set())
+
+    def test_duplicated_version(self):
+        self.migration("blog", "0001")
+        with self.assertRaises(ValueError):
+            self.migration("blog", "0001")
+
+    def test_database_decorator(self):
+        class Database(BaseDatabase):
+            pass
+
+        db = Database(prefix="migtest")
+
+        @db.migration("0001")
+        def first(op):
+            pass
+
+        self.addCleanup(registry.migrations.pop, "migtest")
+        self.assertEqual([m.func for m in registry.get("migtest")], [first])
+
+
+class TestCoreMigrations(unittest.TestCase):
+    def test_membership_indexes(self):
+        engine = create_engine("sqlite://")
+        tables = schema.tables()
+        DatabaseManager.metadata.create_all(engine, tables=tables)
+        for table in tables:
+            for index in table.indexes:
+                index.drop(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert(), [
+                {"_id": "u1", "screen_name": "alice", "email": "a@example.com"},
+            ])
+        migrator = Migrator(engine)
+        self.assertIn("0001", [m.version for m in migrator.pending("mitama")])
+        migrator.upgrade(prefix="mitama")
+        self.assertEqual(schema.pending(engine), [])
+        self.assertEqual(migrator.pending("mitama"), [])
+
+    def test_icon_hash_and_mime(self):
+        engine = create_engine("sqlite://")
+        DatabaseManager.metadata.create_all(engine, tables=schema.tables())
+        with engine.begin() as conn:
+            conn.execute("ALTER TABLE mitama_user DROP COLUMN icon_hash")
+            conn.execute("ALTER TABLE mitama_group DROP COLUMN icon_hash")
+            conn.execute("ALTER TABLE mitama_user DROP COLUMN icon_mime")
+            conn.execute("ALTER TABLE mitama_group DROP COLUMN icon_mime")
+            conn.execute(
+                "INSERT INTO mitama_user (_id, screen_name, email, _icon) VALUES (?, ?, ?, ?)",
+                [("u1", "alice", "a@example.com", b"GIF89a"), ("u2", "bob", "b@example.com", None)]
+            )
+        Migrator(engine).upgrade(prefix="mitama")
+        table = User.__table__
+        with engine.connect() as conn:
+            rows = dict(
+                (row[0], tuple(row[1:])) for row in
+                conn.execute(select([table.c._id, table.c.icon_hash, table.c.icon_mime]))
+            )
+        self.assertEqual(rows, {
+            "u1": (icon_digest(b"GIF89a"), "image/gif"),
+            "u2": (None, None),
+        })
+
+    def test_fresh_database(self):
+        engine = create_engine("sqlite://")
+        DatabaseManager.metadata.create_all(engine, tables=schema.tables())
+        Migrator(engine).upgrade(prefix="mitama")
+        self.assertEqual(schema.pending(engine), [])
+
+    def test_inner_role_permission_index(self):
+        engine = create_engine("sqlite://")
+        DatabaseManager.metadata.create_all(engine, tables=schema.tables())
+        Migrator(engine).upgrade(prefix="mitama", target="0004")
+        table = InnerPermission.roles.property.secondary
+        for index in table.indexes:
+            index.drop(bind=engine)
+        self.assertEqual(
+            schema.pending(engine),
+            ["ix_mitama_inner_role_permission_permission_id_role_id"],
+        )
+        migrator = Migrator(engine)
+        self.assertEqual(
+            [m.version for m in migrator.pending("mitama")], ["0005"]
+        )
+        migrator.upgrade(prefix="mitama")
+        self.assertEqual(schema.pending(engine), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import io
+import unittest
+from unittest import mock
+
+import magic
+from PIL import Image
+
+from mitama.mime import MimeDetector
+
+
+def png(size=16):
+    output = io.BytesIO()
+    Image.new("RGB", (size, size), (0, 128, 255)).save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestMimeDetector(unittest.TestCase):
+    def test_detect(self):
+        detector = MimeDetector()
+        self.assertEqual(detector.from_buffer(png()), "image/png")
+        self.assertEqual(detector.from_buffer(b"GIF89a" + b"\0" * 10), "image/gif")
+        self.assertEqual(detector.from_buffer(b"<svg xmlns='http://www.w3.org/2000/svg'></svg>"), "image/svg+xml")
+
+    def test_memoized(self):
+        detector = MimeDetector()
+        blob = png()
+        with mock.patch.object(magic, "Magic", wraps=magic.Magic) as Magic:
+            for _ in range(3):
+                self.assertEqual(detector.from_buffer(blob), "image/png")
+            self.assertEqual(detector.from_buffer(bytearray(blob)), "image/png")
+        self.assertEqual(Magic.call_count, 1)
+        self.assertEqual((detector.hits, detector.misses), (3, 1))
+
+    def test_handle_is_reused(self):
+        detector = MimeDetector()
+        with mock.patch.object(magic, "Magic", wraps=magic.Magic) as Magic:
+            detector.from_buffer(png(8))
+            detector.from_buffer(png(9))
+        self.assertEqual(Magic.call_count, 1)
+
+    def test_prefix_only(self):
+        detector = MimeDetector(prefix_size=64)
+        blob = png(256)
+        handle = mock.Mock()
+        handle.from_buffer.return_value = "image/png"
+        with mock.patch.object(detector, "_acquire", return_value=handle):
+            detector.from_buffer(blob)
+        handle.from_buffer.assert_called_once_with(blob[:64])
+
+    def test_maxsize(self):
+        detector = MimeDetector(maxsize=2)
+        for size in (8, 9, 10):
+            detector.from_buffer(png(size))
+        self.assertEqual(len(detector._results), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import base64
+import unittest
+from unittest import mock
+
+from mitama.app.app import dataurl
+from mitama.noimage import AssetRegistry, assets, load_noimage_group, load_noimage_user
+
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+class TestAssets(unittest.TestCase):
+    def test_preloaded(self):
+        with mock.patch("builtins.open") as open_mock:
+            icon = load_noimage_user()
+        open_mock.assert_not_called()
+        self.assertIs(icon, assets["noimage_user"].data)
+        self.assertIs(load_noimage_group(), load_noimage_group())
+        self.assertEqual(icon[:8], b"\x89PNG\r\n\x1a\n")
+
+    def test_asset(self):
+        asset = assets["noimage_app"]
+        self.assertEqual(asset.mime, "image/png")
+        self.assertEqual(asset.etag, '"%s"' % asset.digest)
+        self.assertEqual(len(asset.digest), 32)
+        self.assertEqual(
+            asset.dataurl,
+            "data:image/png;base64," + base64.b64encode(asset.data).decode()
+        )
+
+    def test_dataurl(self):
+        icon = load_noimage_user()
+        with mock.patch("mitama.app.app.guess_mime") as guess_mime:
+            url = dataurl(icon)
+        guess_mime.assert_not_called()
+        self.assertEqual(url, assets["noimage_user"].dataurl)
+        self.assertTrue(dataurl(PNG).startswith("data:image/png;base64,"))
+
+    def test_register(self):
+        registry = AssetRegistry()
+        asset = registry.register("logo", PNG)
+        self.assertIn("logo", registry)
+        self.assertIs(registry.find(PNG), asset)
+        self.assertIsNone(registry.find(bytes(bytearray(PNG))))
+        replaced = registry.register("logo", b"GIF89a" + PNG, mime="image/gif")
+        self.assertIs(registry["logo"], replaced)
+        self.assertEqual(replaced.mime, "image/gif")
+        self.assertIsNone(registry.find(PNG))
+        self.assertEqual(list(registry), [replaced])
+
+
+if __name__ == "__main__":
+    unittest.main()
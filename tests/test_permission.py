@@ -0,0 +1,301 @@
+import unittest
+
+from sqlalchemy import event
+
+from mitama.db import DatabaseManager
+
+from tests.helpers import DatabaseTestCase
+
+from mitama.models import Group, InnerPermission, InnerRole, Permission, Role, User, UserGroup
+from mitama.models.decisions import decisions
+
+
+def legacy_is_accepted(screen_name, node):
+    perm = Permission.retrieve(screen_name=screen_name)
+    if isinstance(node, User):
+        for role in perm.roles:
+            if node in role.users:
+                return True
+            for group in role.groups:
+                if node in group.users:
+                    return True
+    elif isinstance(node, Group):
+        for role in perm.roles:
+            if node in role.groups:
+                return True
+    return False
+
+
+def legacy_inner_is_accepted(screen_name, group, user):
+    rel = UserGroup.retrieve(user=user, group=group)
+    perm = InnerPermission.retrieve(screen_name=screen_name)
+    for role in perm.roles:
+        if rel in role.relations:
+            return True
+    return False
+
+
+def make_user(name):
+    user = User()
+    user.name = name
+    user.screen_name = name
+    user.email = name + "@example.com"
+    user.create()
+    return user
+
+
+def make_group(name, parent=None):
+    group = Group()
+    group.name = name
+    group.screen_name = name
+    group.create()
+    if parent is not None:
+        parent.append(group)
+    return group
+
+
+def make_role(name, nodes):
+    role = Role()
+    role.name = name
+    role.create()
+    for node in nodes:
+        role.append(node)
+    role.update()
+    return role
+
+
+def count_statements(test):
+    statements = list()
+
+    def count(*args):
+        statements.append(args)
+
+    engine = DatabaseManager.engine
+    event.listen(engine, "before_cursor_execute", count)
+    test.addCleanup(event.remove, engine, "before_cursor_execute", count)
+    return statements
+
+
+class TestPermission(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.parent = make_group("perm_parent")
+        cls.child = make_group("perm_child", cls.parent)
+        cls.other = make_group("perm_other")
+        cls.direct = make_user("perm_direct")
+        cls.member = make_user("perm_member")
+        cls.nested = make_user("perm_nested")
+        cls.outsider = make_user("perm_outsider")
+        cls.parent.append(cls.member)
+        cls.child.append(cls.nested)
+        cls.other.append(cls.outsider)
+        admins = make_role("perm_admins", [cls.direct, cls.parent])
+        creators = make_role("perm_creators", [cls.other])
+        Permission.accept("admin", admins)
+        Permission.accept("create_group", admins)
+        Permission.accept("create_group", creators)
+        cls.nodes = [
+            cls.parent, cls.child, cls.other,
+            cls.direct, cls.member, cls.nested, cls.outsider,
+        ]
+        cls.names = ["admin", "create_group", "delete_user"]
+
+    def test_same_as_legacy(self):
+        for name in self.names:
+            for node in self.nodes:
+                self.assertEqual(
+                    Permission.is_accepted(name, node),
+                    legacy_is_accepted(name, node),
+                    (name, node.screen_name)
+                )
+        self.assertTrue(Permission.is_accepted("admin", self.member))
+        self.assertFalse(Permission.is_accepted("admin", self.nested))
+        self.assertTrue(Permission.is_forbidden("admin", self.child))
+
+    def test_unknown_permission(self):
+        self.assertFalse(Permission.is_accepted("no_such_permission", self.direct))
+        self.assertFalse(Permission.is_accepted("admin", None))
+
+    def test_batch(self):
+        pairs = [(name, node) for name in self.names + ["no_such_permission"] for node in self.nodes]
+        self.assertEqual(
+            Permission.are_accepted(pairs),
+            [Permission.is_accepted(name, node) for name, node in pairs]
+        )
+        self.assertEqual(Permission.are_accepted([]), [])
+
+    def test_single_query(self):
+        decisions.invalidate()
+        statements = count_statements(self)
+        Permission.is_accepted("admin", self.nested)
+        self.assertEqual(len(statements), 1)
+        Permission.are_accepted([(name, node) for name in self.names for node in self.nodes])
+        self.assertEqual(len(statements), 2)
+
+    def test_revoke(self):
+        role = make_role("perm_revoke", [self.outsider])
+        Permission.accept("delete_user", role)
+        self.assertTrue(Permission.is_accepted("delete_user", self.outsider))
+        Permission.forbit("delete_user", role)
+        self.assertFalse(Permission.is_accepted("delete_user", self.outsider))
+
+
+class TestInnerPermission(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.groups = [make_group("inner_g%d" % i) for i in range(3)]
+        cls.users = [make_user("inner_u%d" % i) for i in range(4)]
+        for i, group in enumerate(cls.groups):
+            group.append_all(cls.users[i:])
+        cls.admins = InnerRole()
+        cls.admins.name = "inner_admins"
+        cls.admins.create()
+        cls.editors = InnerRole()
+        cls.editors.name = "inner_editors"
+        cls.editors.create()
+        InnerPermission.accept("admin", cls.admins)
+        InnerPermission.accept("add_user", cls.admins)
+        InnerPermission.accept("add_user", cls.editors)
+        cls.admins.append(cls.groups[0], cls.users[0])
+        cls.admins.append(cls.groups[1], cls.users[2])
+        cls.editors.append(cls.groups[2], cls.users[3])
+
+    def setUp(self):
+        decisions.invalidate()
+
+    def test_same_as_legacy(self):
+        for name in ["admin", "add_user", "remove_group"]:
+            for i, group in enumerate(self.groups):
+                for user in self.users[i:]:
+                    self.assertEqual(
+                        InnerPermission.is_accepted(name, group, user),
+                        legacy_inner_is_accepted(name, group, user),
+                        (name, group.screen_name, user.screen_name)
+                    )
+                    self.assertEqual(
+                        InnerPermission.is_forbidden(name, group, user),
+                        not legacy_inner_is_accepted(name, group, user),
+                    )
+        self.assertTrue(InnerPermission.is_accepted("admin", self.groups[1], self.users[2]))
+        self.assertFalse(InnerPermission.is_accepted("admin", self.groups[1], self.users[3]))
+
+    def test_not_member(self):
+        self.assertFalse(InnerPermission.is_accepted("admin", self.groups[2], self.users[0]))
+
+    def test_single_query(self):
+        group, user = self.groups[0], self.users[0]
+        group._id, user._id
+        statements = count_statements(self)
+        self.assertTrue(InnerPermission.is_accepted("admin", group, user))
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("mitama_inner_role.", statements[0][2])
+
+
+class TestDecisionCache(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.group = make_group("decision_group")
+        cls.user = make_user("decision_user")
+        cls.member = make_user("decision_member")
+        cls.group.append(cls.member)
+
+    def setUp(self):
+        decisions.invalidate()
+        decisions.reset_stats()
+
+    def test_hit_and_miss(self):
+        self.user._id, self.member._id
+        statements = count_statements(self)
+        for _ in range(5):
+            self.assertFalse(Permission.is_accepted("update_group", self.user))
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(decisions.hits, 4)
+        self.assertEqual(decisions.misses, 1)
+        stats = decisions.to_dict()
+        self.assertEqual(stats["hit_rate"], 0.8)
+
+        pairs = [("update_group", self.user), ("update_group", self.member)]
+        self.assertEqual(Permission.are_accepted(pairs), [False, False])
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(Permission.are_accepted(pairs), [False, False])
+        self.assertEqual(len(statements), 2)
+        self.assertFalse(Permission.is_accepted("update_group", self.member))
+        self.assertEqual(len(statements), 2)
+
+    def test_role_changes(self):
+        role = make_role("decision_role", [])
+        Permission.accept("update_user", role)
+        self.assertFalse(Permission.is_accepted("update_user", self.user))
+        self.assertFalse(Permission.is_accepted("update_user", self.member))
+
+        role.append(self.user)
+        self.assertTrue(Permission.is_accepted("update_user", self.user))
+        role.remove(self.user)
+        self.assertFalse(Permission.is_accepted("update_user", self.user))
+
+        role.append(self.group)
+        self.assertTrue(Permission.is_accepted("update_user", self.member))
+        self.group.remove(self.member)
+        self.assertFalse(Permission.is_accepted("update_user", self.member))
+        self.group.append(self.member)
+        self.assertTrue(Permission.is_accepted("update_user", self.member))
+
+        Permission.forbit("update_user", role)
+        self.assertFalse(Permission.is_accepted("update_user", self.member))
+
+    def test_inner_permission(self):
+        role = InnerRole()
+        role.name = "decision_inner"
+        role.create()
+        InnerPermission.accept("add_user", role)
+        self.assertFalse(InnerPermission.is_accepted("add_user", self.group, self.member))
+        self.assertFalse(InnerPermission.is_accepted("add_user", self.group, self.member))
+        self.assertEqual(decisions.hits, 1)
+
+        role.append(self.group, self.member)
+        self.assertTrue(InnerPermission.is_accepted("add_user", self.group, self.member))
+        role.remove(self.group, self.member)
+        self.assertFalse(InnerPermission.is_accepted("add_user", self.group, self.member))
+        role.append(self.group, self.member)
+        InnerPermission.forbit("add_user", role)
+        self.assertFalse(InnerPermission.is_accepted("add_user", self.group, self.member))
+
+    def test_request_scope(self):
+        DatabaseManager.start_session()
+        try:
+            Permission.is_accepted("delete_group", self.user)
+            Permission.is_accepted("delete_group", self.user)
+        finally:
+            DatabaseManager.close_session()
+        self.assertEqual(decisions.misses, 1)
+        DatabaseManager.start_session()
+        try:
+            Permission.is_accepted("delete_group", self.user)
+        finally:
+            DatabaseManager.close_session()
+        self.assertEqual(decisions.misses, 2)
+
+    def test_shared_ttl(self):
+        decisions.ttl = 60
+        self.addCleanup(setattr, decisions, "ttl", None)
+        for _ in range(2):
+            DatabaseManager.start_session()
+            try:
+                Permission.is_accepted("delete_group", self.user)
+            finally:
+                DatabaseManager.close_session()
+        self.assertEqual((decisions.hits, decisions.misses), (1, 1))
+        decisions.ttl = 0
+        DatabaseManager.start_session()
+        try:
+            Permission.is_accepted("delete_group", self.user)
+        finally:
+            DatabaseManager.close_session()
+        self.assertEqual(decisions.misses, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
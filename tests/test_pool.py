@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import exc
+
+from mitama.db import DatabaseManager
+from mitama.db.pool import MeteredQueuePool, engine_options
+
+STATE = ("engine", "metadata", "metrics", "_registry", "Model")
+
+
+def restore(saved):
+    """DatabaseManagerを、テストで作り直す前の状態に戻します"""
+    for name, value in saved.items():
+        setattr(DatabaseManager, name, value)
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def manager(self, **options):
+        database = {"type": "sqlite", "path": os.path.join(self.dir.name, "pool.sqlite3")}
+        database.update(options)
+        saved = {name: getattr(DatabaseManager, name, None) for name in STATE}
+        self.addCleanup(restore, saved)
+        DatabaseManager(database)
+        self.addCleanup(DatabaseManager.engine.dispose)
+        return DatabaseManager
+
+    def test_engine_options(self):
+        options = engine_options({"type": "postgresql"})
+        self.assertEqual(options["echo"], False)
+        self.assertIs(options["poolclass"], MeteredQueuePool)
+        options = engine_options({"type": "sqlite", "path": "db.sqlite3"})
+        self.assertEqual(options, {"echo": False})
+        options = engine_options({
+            "type": "mysql",
+            "pool_size": 10,
+            "max_overflow": 5,
+            "pool_recycle": 3600,
+            "pool_pre_ping": True,
+            "echo": True,
+        })
+        self.assertEqual(options["pool_size"], 10)
+        self.assertEqual(options["max_overflow"], 5)
+        self.assertEqual(options["pool_recycle"], 3600)
+        self.assertEqual(options["pool_pre_ping"], True)
+        self.assertEqual(options["echo"], True)
+
+    def test_metrics(self):
+        manager = self.manager(pool_size=1, max_overflow=1, pool_timeout=0.1)
+        pool = manager.engine.pool
+        self.assertIsInstance(pool, MeteredQueuePool)
+        self.assertFalse(manager.engine.echo)
+
+        first = manager.engine.connect()
+        second = manager.engine.connect()
+        status = manager.pool_status()
+        self.assertEqual(status["in_use"], 2)
+        self.assertEqual(status["checked_out"], 2)
+        self.assertEqual(status["overflows"], 1)
+        with self.assertRaises(exc.TimeoutError):
+            manager.engine.connect()
+        status = manager.pool_status()
+        self.assertEqual(status["timeouts"], 1)
+        self.assertGreaterEqual(status["max_wait_time"], 0.1)
+
+        first.close()
+        second.close()
+        status = manager.pool_status()
+        self.assertEqual(status["in_use"], 0)
+        self.assertEqual(status["max_in_use"], 2)
+        self.assertEqual(status["checkouts"], 2)
+        self.assertEqual(status["checkins"], 2)
+
+    def test_reinitialize(self):
+        manager = self.manager(pool_size=2)
+        manager.engine.connect().close()
+        manager.reinitialize()
+        manager.engine.connect().close()
+        status = manager.pool_status()
+        self.assertEqual(status["checkouts"], 2)
+        self.assertEqual(status["connects"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
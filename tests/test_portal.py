@@ -0,0 +1,78 @@
+import cProfile
+import os
+import pstats
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+os.environ.setdefault("MITAMA_SESSION_KEY", "MDEyMzQ1Njc4OWFiY2RlZg==")
+
+from mitama.app.method import _Path
+from mitama.app.router import Router
+from mitama.project import Project, include
+
+
+def call(project, path):
+    environ = {"PATH_INFO": path}
+    setup_testing_defaults(environ)
+    status = list()
+
+    def start_response(state, headers):
+        status.append(state)
+
+    project.wsgi(environ, start_response)
+    return status[0]
+
+
+class TestPortal(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.project = Project(include("mitama.portal", path="/portal"))
+        cls.portal = cls.project.app("mitama.portal")
+
+    def test_router_is_frozen(self):
+        self.assertIs(self.portal.router, self.portal.router)
+        self.assertTrue(self.portal.router.frozen)
+
+    def test_no_route_construction_per_request(self):
+        call(self.project, "/portal/login")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for i in range(5):
+            self.assertEqual(call(self.project, "/portal/login"), "401 Unauthorized")
+        profiler.disable()
+        stats = pstats.Stats(profiler).stats
+        constructors = [
+            func for func in stats
+            if func[2] == "__init__" and func[0] in (
+                _Path.__init__.__code__.co_filename,
+                Router.__init__.__code__.co_filename,
+            )
+        ]
+        self.assertEqual(constructors, [])
+
+    def test_resize_icon(self):
+        from io import BytesIO
+
+        from PIL import Image
+
+        from mitama.app.forms import ValidationError
+        from mitama.portal.controller import resize_icon
+
+        output = BytesIO()
+        Image.new("RGB", (1600, 1200), (200, 40, 40)).save(output, "JPEG")
+        icon = resize_icon(output.getvalue())
+        image = Image.open(BytesIO(icon))
+        self.assertEqual(image.format, "PNG")
+        self.assertEqual(image.size, (200, 200))
+        self.assertIsNone(resize_icon(None))
+        with self.assertRaises(ValidationError):
+            resize_icon(b"not an image")
+
+    def test_preview_icon(self):
+        from mitama.portal.controller import preview_icon
+
+        self.assertEqual(preview_icon(b"not an image", b"default"), b"default")
+        self.assertEqual(preview_icon(None, b"default"), b"default")
@@ -0,0 +1,91 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import unittest
+import urllib.request
+
+from mitama.app.http.prefork import parse_bind
+
+SERVER = """
+import os
+from mitama.app import App, Router
+from mitama.app.http import Response, run_app
+from mitama.app.method import view
+
+def pid(request):
+    return Response(text=str(os.getpid()))
+
+class PidApp(App):
+    router = Router([view("/", pid)])
+
+app = PidApp("pid", "/", "pid", project_dir=".")
+run_app(app, 0, bind="127.0.0.1:0", workers=%d, max_requests=%d, graceful_timeout=5)
+"""
+
+
+class TestPrefork(unittest.TestCase):
+    def start(self, workers, max_requests=0):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        process = subprocess.Popen(
+            [sys.executable, "-c", SERVER % (workers, max_requests)],
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        self.addCleanup(self.stop, process)
+        line = process.stdout.readline().decode()
+        self.assertIn("with %d workers" % workers, line)
+        address = line.split()[2]
+        return process, "http://%s/" % address
+
+    def stop(self, process):
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(10)
+        process.stdout.close()
+
+    def get(self, url):
+        for _ in range(50):
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    return int(response.read())
+            except OSError:
+                time.sleep(0.1)
+        self.fail("server did not respond")
+
+    def test_parse_bind(self):
+        self.assertEqual(parse_bind("localhost", 8080), ("localhost", 8080))
+        self.assertEqual(parse_bind("0.0.0.0:80", 8080), ("0.0.0.0", 80))
+        self.assertEqual(parse_bind("[::1]:81", 8080), ("::1", 81))
+        self.assertEqual(parse_bind(":82", 8080), ("0.0.0.0", 82))
+
+    def test_workers(self):
+        process, url = self.start(2)
+        pids = set(self.get(url) for _ in range(20))
+        self.assertNotIn(process.pid, pids)
+        self.assertLessEqual(len(pids), 2)
+
+    def test_max_requests(self):
+        process, url = self.start(1, max_requests=2)
+        pids = set(self.get(url) for _ in range(6))
+        self.assertGreaterEqual(len(pids), 3)
+
+    def test_graceful_restart_and_stop(self):
+        process, url = self.start(2)
+        before = set(self.get(url) for _ in range(10))
+        process.send_signal(signal.SIGHUP)
+        after = None
+        for _ in range(50):
+            after = self.get(url)
+            if after not in before:
+                break
+            time.sleep(0.1)
+        self.assertNotIn(after, before)
+        process.send_signal(signal.SIGTERM)
+        self.assertEqual(process.wait(10), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
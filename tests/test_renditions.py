@@ -0,0 +1,170 @@
+import io
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from PIL import Image
+from sqlalchemy import select
+
+from mitama.db import DatabaseManager
+
+from tests.helpers import DatabaseTestCase
+
+from mitama.models import User
+from mitama.models.renditions import (
+    RenditionPipeline,
+    normalize,
+    pipeline,
+    render,
+    rendition_table,
+    supported_formats,
+)
+
+
+def png(width, height, color=(0, 128, 255)):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+def stored(digest):
+    with DatabaseManager.engine.connect() as conn:
+        rows = conn.execute(
+            select([rendition_table.c.size, rendition_table.c.format])
+            .where(rendition_table.c.digest == digest)
+        ).fetchall()
+    return sorted((row[0], row[1]) for row in rows)
+
+
+class DeferredExecutor:
+    def __init__(self):
+        self.tasks = list()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.tasks.append((future, fn, args))
+        return future
+
+    def run(self):
+        for future, fn, args in self.tasks:
+            future.set_result(fn(*args))
+
+
+class TestRender(unittest.TestCase):
+    def test_deterministic(self):
+        blob = png(300, 200)
+        for format in ("webp", "png"):
+            self.assertEqual(render(blob, 80, format), render(blob, 80, format))
+
+    def test_render_all(self):
+        blob = png(300, 200)
+        renditions = pipeline.render_all(blob)
+        self.assertEqual(len(renditions), 6)
+        self.assertEqual(renditions[(80, "webp")], render(blob, 80, "webp"))
+
+    def test_normalize(self):
+        img = Image.open(io.BytesIO(normalize(png(1200, 900))))
+        self.assertEqual(img.size, (200, 200))
+        self.assertEqual(img.format, "PNG")
+        with self.assertRaises(ValueError):
+            normalize(b"not an image")
+
+    def test_errors_other_than_decoding_are_raised(self):
+        with mock.patch("mitama.models.renditions._save", side_effect=KeyError("WEBP")):
+            with self.assertRaises(KeyError):
+                pipeline.render_all(png(60, 60))
+
+    def test_without_webp(self):
+        with mock.patch("PIL.features.check", return_value=False):
+            self.assertEqual(supported_formats(), ("png",))
+            self.assertEqual(RenditionPipeline().formats, ("png",))
+
+    def test_square(self):
+        img = Image.open(io.BytesIO(render(png(300, 200), 40, "png")))
+        self.assertEqual(img.size, (40, 40))
+        self.assertEqual(img.format, "PNG")
+
+
+class TestRenditionPipeline(DatabaseTestCase):
+    def create_user(self, name, icon):
+        user = User()
+        user.name = user.screen_name = name
+        user.email = name + "@example.com"
+        user.icon = icon
+        user.create()
+        return user
+
+    def test_created_on_save(self):
+        user = self.create_user("rendition_user", png(120, 120, (1, 2, 3)))
+        expected = sorted(
+            (size, format) for size in pipeline.sizes for format in pipeline.formats
+        )
+        self.assertEqual(stored(user.icon_hash), expected)
+
+    def test_same_icon_is_rendered_once(self):
+        blob = png(120, 120, (4, 5, 6))
+        self.create_user("rendition_first", blob)
+        with mock.patch("mitama.models.renditions._open") as render_mock:
+            self.create_user("rendition_second", blob)
+        render_mock.assert_not_called()
+
+    def test_update(self):
+        user = self.create_user("rendition_update", png(120, 120, (7, 8, 9)))
+        user.icon = png(120, 120, (10, 11, 12))
+        user.update()
+        self.assertEqual(len(stored(user.icon_hash)), 6)
+
+    def test_invalid_icon(self):
+        user = self.create_user("rendition_invalid", b"not an image")
+        self.assertEqual(stored(user.icon_hash), [])
+        self.assertIsNone(pipeline.get(user.icon_hash, 80, "png", lambda: user.icon))
+
+    def test_invalid_is_bounded(self):
+        bounded = RenditionPipeline(invalid_maxsize=2)
+        for digest in ("invalid-1", "invalid-2", "invalid-3"):
+            bounded.process(digest, b"not an image")
+        self.assertFalse(bounded.is_invalid("invalid-1"))
+        self.assertTrue(bounded.is_invalid("invalid-3"))
+        bounded.clear()
+        self.assertFalse(bounded.is_invalid("invalid-3"))
+
+    def test_unknown_size(self):
+        self.assertIsNone(pipeline.get("digest", 81, "png", lambda: png(10, 10)))
+
+    def test_get_renders_missing(self):
+        blob = png(60, 60, (13, 14, 15))
+        data = pipeline.get("missing-digest", 40, "webp", lambda: blob)
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (40, 40))
+        self.assertEqual(len(stored("missing-digest")), 6)
+
+    def test_executor(self):
+        executor = DeferredExecutor()
+        background = RenditionPipeline(sizes=(40,), formats=("png",), executor=executor)
+        blob = png(60, 60, (16, 17, 18))
+        first = background.submit("background-digest", blob)
+        second = background.submit("background-digest", blob)
+        self.assertIs(first, second)
+        self.assertEqual(stored("background-digest"), [])
+        executor.run()
+        first.result()
+        self.assertEqual(len(executor.tasks), 1)
+        self.assertEqual(stored("background-digest"), [(40, "png")])
+        self.assertIsNot(background.submit("background-digest", blob), first)
+
+    def test_concurrent_insert(self):
+        blob = png(60, 60, (19, 20, 21))
+        pipeline.process("concurrent-digest", blob)
+        # 別のワーカーが、存在の確認と保存の間に同じ縮小画像を保存した場合
+        with mock.patch.object(RenditionPipeline, "_exists", side_effect=[False, False, True]):
+            pipeline.process("concurrent-digest", blob)
+        self.assertEqual(len(stored("concurrent-digest")), 6)
+
+    def test_commit_does_not_fail(self):
+        with mock.patch.object(pipeline, "submit", side_effect=RuntimeError), \
+                mock.patch("builtins.print"):
+            user = self.create_user("rendition_commit", png(120, 120, (22, 23, 24)))
+        self.assertEqual(User.retrieve(user._id).icon_hash, user.icon_hash)
+
+
+if __name__ == "__main__":
+    unittest.main()
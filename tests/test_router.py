@@ -2,6 +2,7 @@ import unittest
 from wsgiref.util import setup_testing_defaults
 
 from mitama.app import Controller, Router
+from mitama.app.router import RoutingError
 from mitama.app.http import Request
 from mitama.app.method import *
 
@@ -19,3 +20,24 @@ class TestRouter(unittest.TestCase):
         router = Router([view("/", TestController)])
         request_, handle, method = router.match(request)
         self.assertTrue(callable(handle))
+
+    def test_freeze(self):
+        class TestController(Controller):
+            def handle(self, request):
+                return "dadada"
+
+        inner = Router([view("/inner", TestController)])
+        router = Router([view("/", TestController), inner])
+        self.assertIs(router.freeze(), router)
+        self.assertTrue(router.frozen)
+        self.assertTrue(inner.frozen)
+        with self.assertRaises(RoutingError):
+            router.add_route(view("/hoge", TestController))
+        with self.assertRaises(RoutingError):
+            inner.add_middleware(TestController)
+
+        environ = {"PATH_INFO": "/inner/"}
+        setup_testing_defaults(environ)
+        request = Request(environ)
+        request_, handle, method = router.match(request)
+        self.assertEqual(handle(request_), "dadada")
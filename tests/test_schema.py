@@ -0,0 +1,94 @@
+import unittest
+
+from sqlalchemy import create_engine, inspect, select
+
+from mitama.db import DatabaseManager
+
+DatabaseManager.test()
+
+from mitama.db.migration import Migrator
+from mitama.db.schema import SchemaError
+from mitama.models import schema
+from mitama.models.nodes import Group, User, role_relation, role_user, user_group
+
+DatabaseManager.create_all()
+
+
+def legacy_engine():
+    engine = create_engine("sqlite://")
+    tables = schema.tables()
+    DatabaseManager.metadata.create_all(engine, tables=tables)
+    for table in tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+    return engine
+
+
+class TestSchemaUpgrade(unittest.TestCase):
+    def test_upgrade(self):
+        engine = legacy_engine()
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert(), [
+                {"_id": "u1", "screen_name": "alice", "email": "a@example.com"},
+                {"_id": "u2", "screen_name": "bob", "email": "b@example.com"},
+            ])
+            conn.execute(Group.__table__.insert(), [{"_id": "g1", "screen_name": "team"}])
+            conn.execute(user_group.insert(), [
+                {"_id": "ug1", "group_id": "g1", "user_id": "u1"},
+                {"_id": "ug2", "group_id": "g1", "user_id": "u1"},
+                {"_id": "ug3", "group_id": "g1", "user_id": "u2"},
+            ])
+            conn.execute(role_relation.insert(), [
+                {"_id": "rr1", "role_id": "r1", "relation_id": "ug1"},
+                {"_id": "rr2", "role_id": "r1", "relation_id": "ug2"},
+                {"_id": "rr3", "role_id": "r2", "relation_id": "ug2"},
+            ])
+            conn.execute(role_user.insert(), [
+                {"role_id": "r1", "user_id": "u1"},
+                {"role_id": "r1", "user_id": "u1"},
+                {"role_id": "r1", "user_id": "u2"},
+            ])
+
+        self.assertIn("ix_mitama_user_screen_name", schema.pending(engine))
+        self.assertIn("uq_mitama_user_group_group_id_user_id", schema.pending(engine))
+        migrator = Migrator(engine)
+        migrator.upgrade(prefix="mitama")
+        self.assertEqual(schema.pending(engine), [])
+        self.assertEqual(migrator.upgrade(prefix="mitama"), [])
+
+        inspector = inspect(engine)
+        names = set(index["name"] for index in inspector.get_indexes("mitama_role_user"))
+        self.assertIn("uq_mitama_role_user_role_id_user_id", names)
+        with engine.connect() as conn:
+            self.assertEqual(
+                sorted(tuple(row) for row in conn.execute(select([user_group.c._id, user_group.c.user_id]))),
+                [("ug1", "u1"), ("ug3", "u2")]
+            )
+            self.assertEqual(
+                sorted(tuple(row) for row in conn.execute(select([role_relation.c.role_id, role_relation.c.relation_id]))),
+                [("r1", "ug1"), ("r2", "ug1")]
+            )
+            self.assertEqual(
+                sorted(tuple(row) for row in conn.execute(select([role_user.c.role_id, role_user.c.user_id]))),
+                [("r1", "u1"), ("r1", "u2")]
+            )
+
+    def test_duplicated_screen_name(self):
+        engine = legacy_engine()
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert(), [
+                {"_id": "u1", "screen_name": "alice", "email": "a@example.com"},
+                {"_id": "u2", "screen_name": "alice", "email": "b@example.com"},
+            ])
+        migrator = Migrator(engine)
+        with self.assertRaises(SchemaError):
+            migrator.upgrade(prefix="mitama")
+        self.assertIn("ix_mitama_user_screen_name", schema.pending(engine))
+        self.assertIn("0001", [m.version for m in migrator.pending("mitama")])
+
+    def test_fresh_database(self):
+        self.assertEqual(schema.pending(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
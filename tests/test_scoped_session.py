@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import gevent
+
+from mitama.db import BaseDatabase, DatabaseManager
+from mitama.db.types import Column, String
+
+# DatabaseManagerが初期化されていなければ初期化します
+import tests.helpers  # noqa: F401
+
+STATE = ("engine", "metadata", "metrics", "_registry", "Model", "scope")
+
+
+class Database(BaseDatabase):
+    pass
+
+
+db = Database(prefix="scope")
+
+
+class Item(db.Model):
+    name = Column(String)
+
+
+def handle_request(i):
+    DatabaseManager.start_session()
+    try:
+        session = DatabaseManager.session
+        item = Item()
+        item.name = "item%d" % i
+        item.create()
+        time.sleep(0.001)
+        assert Item.query.session is session
+        assert db.session is session
+        time.sleep(0.001)
+        found = Item.query.filter(Item.name == item.name).one()
+        assert found is item
+        return session
+    finally:
+        DatabaseManager.close_session()
+
+
+class TestScopedSession(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.saved = {name: getattr(DatabaseManager, name, None) for name in STATE}
+        cls.workdir = tempfile.TemporaryDirectory()
+        DatabaseManager({"type": "sqlite", "path": os.path.join(cls.workdir.name, "scope.sqlite3")})
+        Item.__table__.create(bind=DatabaseManager.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        DatabaseManager._registry.remove()
+        DatabaseManager.engine.dispose()
+        for name, value in cls.saved.items():
+            setattr(DatabaseManager, name, value)
+        cls.workdir.cleanup()
+
+    def test_concurrent_requests(self):
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            sessions = list(executor.map(handle_request, range(200)))
+        self.assertEqual(len(set(map(id, sessions))), len(sessions))
+        self.assertEqual(Item.query.filter(Item.name.like("item%")).count(), 200)
+
+    def test_nested_scope(self):
+        DatabaseManager.start_session()
+        outer = DatabaseManager.session
+        DatabaseManager.start_session()
+        inner = DatabaseManager.session
+        self.assertIsNot(outer, inner)
+        DatabaseManager.close_session()
+        self.assertIs(DatabaseManager.session, outer)
+        DatabaseManager.close_session()
+
+    def test_global_scope(self):
+        DatabaseManager.scope = "global"
+        self.addCleanup(setattr, DatabaseManager, "scope", "request")
+
+        def current(i):
+            return DatabaseManager.session
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            sessions = list(executor.map(current, range(8)))
+        self.assertEqual(len(set(map(id, sessions))), 1)
+
+    def test_thread_scope_per_greenlet(self):
+        DatabaseManager.scope = "thread"
+        self.addCleanup(setattr, DatabaseManager, "scope", "request")
+
+        def current():
+            session = DatabaseManager.session
+            gevent.sleep(0)
+            self.assertIs(DatabaseManager.session, session)
+            DatabaseManager._registry.remove()
+            return session
+
+        # monkey patchされていない場合、threading.get_identは同じスレッドのgreenletで同じ値になる
+        with mock.patch("threading.get_ident", return_value=1):
+            greenlets = [gevent.spawn(current) for i in range(4)]
+            gevent.joinall(greenlets)
+        self.assertEqual(len(set(id(greenlet.value) for greenlet in greenlets)), 4)
+
+    def test_unknown_scope(self):
+        with self.assertRaises(ValueError):
+            DatabaseManager({"type": "sqlite", "path": ":memory:", "session_scope": "process"})
+        self.assertEqual(DatabaseManager.scope, "request")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import base64
+import unittest
+from unittest import mock
+
+from mitama.app.http import Response
+from mitama.app.http import session as session_module
+from mitama.app.http.session import AEADCookieStorage
+
+KEY = base64.urlsafe_b64decode("MDEyMzQ1Njc4OWFiY2RlZg==")
+
+
+class FakeRequest:
+    def __init__(self, cookie=None, name="MITAMA_SESSION"):
+        self.cookies = dict()
+        if cookie is not None:
+            self.cookies[name] = cookie
+
+
+def saved(response, name="MITAMA_SESSION"):
+    if name not in response._cookies:
+        return None
+    return response._cookies[name].value
+
+
+def roundtrip(storage, cookie=None):
+    request = FakeRequest(cookie)
+    session = storage.load_session(request)
+    return request, session
+
+
+class TestAEADCookieStorage(unittest.TestCase):
+    def setUp(self):
+        self.storage = AEADCookieStorage(KEY)
+
+    def write(self, data, cookie=None):
+        request, session = roundtrip(self.storage, cookie)
+        session.update(data)
+        response = Response()
+        self.storage.save_session(request, response, session)
+        return saved(response)
+
+    def test_roundtrip(self):
+        cookie = self.write({"jwt_token": "token", "n": 1, "items": [1, 2]})
+        _, session = roundtrip(self.storage, cookie)
+        self.assertFalse(session.new)
+        self.assertEqual(dict(session), {"jwt_token": "token", "n": 1, "items": [1, 2]})
+        self.assertNotIn("=", cookie)
+
+    def test_tampered_cookie(self):
+        cookie = self.write({"jwt_token": "token"})
+        raw = bytearray(base64.urlsafe_b64decode(cookie + "=" * (-len(cookie) % 4)))
+        raw[-20] ^= 1
+        tampered = base64.urlsafe_b64encode(bytes(raw)).decode().rstrip("=")
+        _, session = roundtrip(self.storage, tampered)
+        self.assertTrue(session.new)
+        self.assertTrue(session.empty)
+        _, session = roundtrip(self.storage, "not a cookie")
+        self.assertTrue(session.new)
+
+    def test_bound_to_cookie_name(self):
+        other = AEADCookieStorage(KEY, cookie_name="OTHER")
+        cookie = self.write({"jwt_token": "token"})
+        self.assertTrue(other.load_session(FakeRequest(cookie, "OTHER")).new)
+
+    def test_unchanged_session_is_not_saved(self):
+        cookie = self.write({"jwt_token": "token"})
+        request, session = roundtrip(self.storage, cookie)
+        session["jwt_token"] = "token"
+        response = Response()
+        with mock.patch.object(self.storage, "encode") as encode:
+            self.storage.save_session(request, response, session)
+        encode.assert_not_called()
+        self.assertIsNone(saved(response))
+
+        session["jwt_token"] = "other"
+        response = Response()
+        self.storage.save_session(request, response, session)
+        self.assertNotEqual(saved(response), cookie)
+
+    def test_empty_session_deletes_cookie(self):
+        cookie = self.write({"jwt_token": "token"})
+        request, session = roundtrip(self.storage, cookie)
+        session.invalidate()
+        response = Response()
+        self.storage.save_session(request, response, session)
+        self.assertEqual(saved(response), "")
+        self.assertIn("1970", response._cookies["MITAMA_SESSION"]["expires"])
+
+    def test_serializers(self):
+        storage = AEADCookieStorage(KEY, serializer="json")
+        request, session = roundtrip(storage)
+        session["jwt_token"] = "token"
+        response = Response()
+        storage.save_session(request, response, session)
+        _, session = roundtrip(self.storage, saved(response))
+        self.assertEqual(session["jwt_token"], "token")
+        with self.assertRaises(ValueError):
+            AEADCookieStorage(KEY, serializer="pickle")
+
+    @unittest.skipIf(session_module.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        storage = AEADCookieStorage(KEY, serializer="msgpack")
+        request, session = roundtrip(storage)
+        session["jwt_token"] = "token"
+        response = Response()
+        storage.save_session(request, response, session)
+        cookie = saved(response)
+        self.assertEqual(base64.urlsafe_b64decode(cookie[:4])[0], 2)
+        _, session = roundtrip(self.storage, cookie)
+        self.assertEqual(session["jwt_token"], "token")
+
+    def test_cipher_fallback(self):
+        cookie = self.write({"jwt_token": "token"})
+        with mock.patch.object(session_module, "AESGCM", None):
+            storage = AEADCookieStorage(KEY)
+        _, session = roundtrip(storage, cookie)
+        self.assertEqual(session["jwt_token"], "token")
+        request, session = roundtrip(storage)
+        session["jwt_token"] = "token2"
+        response = Response()
+        storage.save_session(request, response, session)
+        _, session = roundtrip(self.storage, saved(response))
+        self.assertEqual(session["jwt_token"], "token2")
+
+    def test_max_age(self):
+        storage = AEADCookieStorage(KEY, max_age=60)
+        request, session = roundtrip(storage)
+        session["jwt_token"] = "token"
+        response = Response()
+        storage.save_session(request, response, session)
+        self.assertEqual(response._cookies["MITAMA_SESSION"]["max-age"], 60)
+        with mock.patch("time.time", return_value=session.created + 120):
+            _, session = roundtrip(storage, saved(response))
+        self.assertTrue(session.empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
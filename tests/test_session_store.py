@@ -0,0 +1,297 @@
+import base64
+import os
+import socketserver
+import threading
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from mitama.app.http import Request, Response
+from mitama.app.registry import _session_middleware
+from mitama.app.http.session_store import (
+    MemoryBackend,
+    RedisBackend,
+    ServerSideStorage,
+    SQLBackend,
+)
+
+KEY = base64.urlsafe_b64decode("MDEyMzQ1Njc4OWFiY2RlZg==")
+
+
+class FakeRequest:
+    def __init__(self, cookie=None):
+        self.cookies = dict()
+        if cookie is not None:
+            self.cookies["MITAMA_SESSION"] = cookie
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """テスト用のRedisプロトコルのサーバー"""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = list()
+        for _ in range(int(line[1:-2])):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+        else:
+            self.wfile.write(b"+%s\r\n" % value.encode())
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            self.server.commands.append(command)
+            now = time.time()
+            for key in [key for key, (_, expires) in data.items() if expires <= now]:
+                del data[key]
+            if command == b"GET":
+                entry = data.get(args[1])
+                self.reply(entry[0] if entry else None)
+            elif command == b"SET":
+                data[args[1]] = (args[2], now + int(args[4]))
+                self.reply("OK")
+            elif command == b"DEL":
+                self.reply(1 if data.pop(args[1], None) else 0)
+            elif command == b"EXPIRE":
+                if args[1] in data:
+                    data[args[1]] = (data[args[1]][0], now + int(args[2]))
+                self.reply(1 if args[1] in data else 0)
+            elif command == b"PTTL":
+                entry = data.get(args[1])
+                self.reply(int((entry[1] - now) * 1000) if entry else -2)
+            elif command == b"SELECT":
+                self.reply("OK")
+
+
+class BackendTests:
+    def test_set_get_delete(self):
+        self.backend.set("a", b"payload", 60)
+        payload, expires_at = self.backend.get("a")
+        self.assertEqual(payload, b"payload")
+        self.assertGreater(expires_at, time.time() + 50)
+        self.backend.set("a", b"changed", 60)
+        self.assertEqual(self.backend.get("a")[0], b"changed")
+        self.backend.delete("a")
+        self.assertIsNone(self.backend.get("a"))
+        self.assertIsNone(self.backend.get("missing"))
+
+    def test_expiry(self):
+        self.backend.set("a", b"payload", 1)
+        self.backend.set("b", b"payload", 60)
+        with mock.patch("time.time", return_value=time.time() + 2):
+            self.assertIsNone(self.backend.get("a"))
+            self.backend.sweep()
+            self.assertIsNotNone(self.backend.get("b"))
+
+    def test_touch(self):
+        self.backend.set("a", b"payload", 1)
+        self.backend.touch("a", 60)
+        with mock.patch("time.time", return_value=time.time() + 2):
+            self.assertEqual(self.backend.get("a")[0], b"payload")
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend(maxsize=3)
+
+    def test_lru(self):
+        for sid in "abc":
+            self.backend.set(sid, b"payload", 60)
+        self.backend.get("a")
+        self.backend.set("d", b"payload", 60)
+        self.assertIsNone(self.backend.get("b"))
+        self.assertIsNotNone(self.backend.get("a"))
+        self.assertEqual(len(self.backend), 3)
+
+    def test_sweep_count(self):
+        self.backend.set("a", b"payload", 1)
+        with mock.patch("time.time", return_value=time.time() + 2):
+            self.assertEqual(self.backend.sweep(), 1)
+        self.assertEqual(len(self.backend), 0)
+
+
+class TestSQLBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.backend = SQLBackend(create_engine("sqlite://"))
+
+
+class TestRedisBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RESPHandler)
+        self.server.daemon_threads = True
+        self.server.data = dict()
+        self.server.commands = list()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.backend = RedisBackend(port=self.server.server_address[1], db=1)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.backend._close)
+
+    def test_expiry(self):
+        self.backend.set("a", b"payload", 1)
+        self.assertIn(b"mitama:session:a", self.server.data)
+        self.assertEqual(self.backend.sweep(), 0)
+
+    def test_touch(self):
+        self.backend.set("a", b"payload", 1)
+        self.backend.touch("a", 60)
+        self.assertGreater(self.backend.get("a")[1], time.time() + 50)
+
+    def test_connection_reused(self):
+        self.backend.set("a", b"payload", 60)
+        self.backend.get("a")
+        self.assertEqual(self.server.commands, [b"SELECT", b"SET", b"GET", b"PTTL"])
+
+
+class TestServerSideStorage(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.storage = ServerSideStorage(KEY, self.backend, ttl=60)
+
+    def save(self, request, session):
+        response = Response()
+        self.storage.save_session(request, response, session)
+        if "MITAMA_SESSION" in response._cookies:
+            return response._cookies["MITAMA_SESSION"].value
+        return None
+
+    def login(self, data):
+        request = FakeRequest()
+        session = self.storage.load_session(request)
+        session.update(data)
+        return self.save(request, session)
+
+    def test_roundtrip(self):
+        cookie = self.login({"jwt_token": "token", "mitama_csrf_token": "csrf"})
+        session = self.storage.load_session(FakeRequest(cookie))
+        self.assertFalse(session.new)
+        self.assertEqual(session["jwt_token"], "token")
+        self.assertEqual(len(self.backend), 1)
+
+    def test_cookie_size_is_constant(self):
+        small = self.login({"jwt_token": "t"})
+        large = self.login({"jwt_token": "t" * 2000})
+        self.assertEqual(len(small), len(large))
+
+    def test_forged_cookie(self):
+        cookie = self.login({"jwt_token": "token"})
+        sid = cookie.split(".")[0]
+        for forged in (sid, sid + ".forged", "other." + cookie.split(".")[1], ""):
+            self.assertTrue(self.storage.load_session(FakeRequest(forged)).new)
+
+    def test_changes_are_written_without_new_cookie(self):
+        cookie = self.login({"jwt_token": "token"})
+        request = FakeRequest(cookie)
+        session = self.storage.load_session(request)
+        session["mitama_csrf_token"] = "csrf"
+        self.assertIsNone(self.save(request, session))
+        self.assertEqual(self.storage.load_session(request)["mitama_csrf_token"], "csrf")
+
+    def test_unchanged_session_is_not_written(self):
+        cookie = self.login({"jwt_token": "token"})
+        request = FakeRequest(cookie)
+        session = self.storage.load_session(request)
+        session["jwt_token"] = "token"
+        with mock.patch.object(self.backend, "set") as set_:
+            self.assertIsNone(self.save(request, session))
+        set_.assert_not_called()
+
+    def test_sliding_expiry(self):
+        cookie = self.login({"jwt_token": "token"})
+        request = FakeRequest(cookie)
+        with mock.patch.object(self.backend, "touch", wraps=self.backend.touch) as touch:
+            self.storage.load_session(request)
+            touch.assert_not_called()
+            with mock.patch("time.time", return_value=time.time() + 40):
+                self.storage.load_session(request)
+            touch.assert_called_once()
+
+    def test_empty_session_is_deleted(self):
+        cookie = self.login({"jwt_token": "token"})
+        request = FakeRequest(cookie)
+        session = self.storage.load_session(request)
+        session.invalidate()
+        self.assertEqual(self.save(request, session), "")
+        self.assertEqual(len(self.backend), 0)
+
+    def test_regenerate(self):
+        anonymous = self.login({"mitama_csrf_token": "csrf"})
+        request = FakeRequest(anonymous)
+        session = self.storage.load_session(request)
+        self.storage.regenerate(session)
+        session["jwt_token"] = "token"
+        cookie = self.save(request, session)
+        self.assertNotEqual(cookie.split(".")[0], anonymous.split(".")[0])
+        self.assertEqual(self.storage.load_session(FakeRequest(cookie))["jwt_token"], "token")
+        fixed = self.storage.load_session(FakeRequest(anonymous))
+        self.assertTrue(fixed.new)
+        self.assertNotIn("jwt_token", fixed)
+        self.assertEqual(len(self.backend), 1)
+
+    def test_request_regenerate_session(self):
+        anonymous = self.login({"mitama_csrf_token": "csrf"})
+
+        def request(cookie):
+            request = Request({
+                "wsgi.input": None,
+                "HTTP_COOKIE": "MITAMA_SESSION=" + cookie,
+            })
+            request["mitama_session_storage"] = self.storage
+            return request
+
+        login = request(anonymous)
+        login.regenerate_session()["jwt_token"] = "token"
+        cookie = self.save(login, login.session())
+        self.assertEqual(request(cookie).session()["jwt_token"], "token")
+        self.assertNotIn("jwt_token", request(anonymous).session())
+
+    def test_sweep_interval(self):
+        storage = ServerSideStorage(KEY, self.backend, ttl=60, sweep_interval=30)
+        with mock.patch.object(self.backend, "sweep") as sweep:
+            storage.load_session(FakeRequest())
+            sweep.assert_not_called()
+            with mock.patch("time.monotonic", return_value=time.monotonic() + 31):
+                storage.load_session(FakeRequest())
+                storage.load_session(FakeRequest())
+            sweep.assert_called_once()
+
+    def test_sql_backend(self):
+        storage = ServerSideStorage(KEY, SQLBackend(create_engine("sqlite://")))
+        request = FakeRequest()
+        session = storage.load_session(request)
+        session["jwt_token"] = "token"
+        response = Response()
+        storage.save_session(request, response, session)
+        cookie = response._cookies["MITAMA_SESSION"].value
+        self.assertEqual(storage.load_session(FakeRequest(cookie))["jwt_token"], "token")
+
+    def test_middleware_shares_storage(self):
+        os.environ.setdefault("MITAMA_SESSION_KEY", "MDEyMzQ1Njc4OWFiY2RlZg==")
+        factory = mock.Mock(side_effect=lambda key: ServerSideStorage(key))
+        SessionMiddleware = _session_middleware(factory)
+        first = SessionMiddleware(object())
+        second = SessionMiddleware(object())
+        self.assertIs(first.storage, second.storage)
+        factory.assert_called_once_with(KEY)
+
+
+if __name__ == "__main__":
+    unittest.main()
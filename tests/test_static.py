@@ -0,0 +1,195 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from email.utils import formatdate
+from mimetypes import guess_type
+from pathlib import Path
+from unittest import mock
+from wsgiref.util import FileWrapper, setup_testing_defaults
+
+from mitama.app.http import Request
+from mitama.app.http.static import StaticFiles, parse_range
+
+BODY = b"".join(b"line %04d\n" % i for i in range(1000))
+
+
+def make_request(method="GET", **headers):
+    env = {"REQUEST_METHOD": method, "PATH_INFO": "/"}
+    env.update(headers)
+    setup_testing_defaults(env)
+    return Request(env)
+
+
+def send(response, request):
+    result = dict()
+
+    def start_response(status, headers):
+        result["status"] = status
+        result["headers"] = dict(headers)
+
+    body = response.start(request, start_response)
+    try:
+        data = b"".join(body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return result["status"], result["headers"], data, body
+
+
+class TestParseRange(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=50-1000", 100), (50, 99))
+        self.assertIs(parse_range("bytes=100-", 100), False)
+        self.assertIs(parse_range("bytes=9-0", 100), False)
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(parse_range("items=0-1", 100))
+        self.assertIsNone(parse_range("bytes=a-b", 100))
+
+
+class TestStaticFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.root = self.dir / "static"
+        (self.root / "docs").mkdir(parents=True)
+        (self.root / "app.js").write_bytes(BODY)
+        (self.root / "docs" / "index.html").write_bytes(b"<p>docs</p>")
+        (self.dir / "secret.txt").write_bytes(b"secret")
+        self.files = StaticFiles([self.root], cache_control="public, max-age=60")
+
+    def get(self, path, method="GET", **headers):
+        request = make_request(method, **headers)
+        response = self.files.response(request, path)
+        if response is None:
+            return None
+        return send(response, request)
+
+    def test_file(self):
+        status, headers, data, _ = self.get("app.js")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(data, BODY)
+        self.assertEqual(headers["Content-Type"], guess_type("app.js")[0])
+        self.assertEqual(headers["Content-Length"], str(len(BODY)))
+        self.assertEqual(headers["Cache-Control"], "public, max-age=60")
+        self.assertEqual(headers["Accept-Ranges"], "bytes")
+        stat = os.stat(self.root / "app.js")
+        self.assertEqual(headers["ETag"], '"%x-%x"' % (stat.st_mtime_ns, stat.st_size))
+        self.assertEqual(headers["Last-Modified"], formatdate(stat.st_mtime, usegmt=True))
+        self.assertNotIn("Vary", headers)
+
+    def test_index_and_missing(self):
+        self.assertEqual(self.get("docs")[2], b"<p>docs</p>")
+        self.assertEqual(self.get("/docs/")[2], b"<p>docs</p>")
+        self.assertIsNone(self.get("nothing.js"))
+
+    def test_outside_root(self):
+        self.assertIsNone(self.get("../secret.txt"))
+        self.assertIsNone(self.get("docs/../../secret.txt"))
+        os.symlink(self.dir / "secret.txt", self.root / "link.txt")
+        self.assertIsNone(self.get("link.txt"))
+
+    def test_not_modified(self):
+        etag = self.get("app.js")[1]["ETag"]
+        status, headers, data, _ = self.get("app.js", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(data, b"")
+        self.assertEqual(headers["ETag"], etag)
+        self.assertEqual(self.get("app.js", HTTP_IF_NONE_MATCH="W/" + etag)[0], "304 Not Modified")
+        self.assertEqual(self.get("app.js", HTTP_IF_NONE_MATCH='"other"')[0], "200 OK")
+
+    def test_if_modified_since(self):
+        last_modified = self.get("app.js")[1]["Last-Modified"]
+        status = self.get("app.js", HTTP_IF_MODIFIED_SINCE=last_modified)[0]
+        self.assertEqual(status, "304 Not Modified")
+        old = formatdate(0, usegmt=True)
+        self.assertEqual(self.get("app.js", HTTP_IF_MODIFIED_SINCE=old)[0], "200 OK")
+        self.assertEqual(self.get("app.js", HTTP_IF_MODIFIED_SINCE="garbage")[0], "200 OK")
+
+    def test_range(self):
+        status, headers, data, _ = self.get("app.js", HTTP_RANGE="bytes=10-19")
+        self.assertEqual(status, "206 Partial Content")
+        self.assertEqual(data, BODY[10:20])
+        self.assertEqual(headers["Content-Range"], "bytes 10-19/%d" % len(BODY))
+        self.assertEqual(headers["Content-Length"], "10")
+        self.assertEqual(self.get("app.js", HTTP_RANGE="bytes=-5")[2], BODY[-5:])
+
+    def test_range_not_satisfiable(self):
+        status, headers, _, _ = self.get("app.js", HTTP_RANGE="bytes=99999-")
+        self.assertEqual(status, "416 Requested Range Not Satisfiable")
+        self.assertEqual(headers["Content-Range"], "bytes */%d" % len(BODY))
+
+    def test_if_range(self):
+        etag = self.get("app.js")[1]["ETag"]
+        self.assertEqual(self.get("app.js", HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=etag)[0], "206 Partial Content")
+        self.assertEqual(self.get("app.js", HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"old"')[0], "200 OK")
+
+    def test_precompressed(self):
+        (self.root / "app.js.gz").write_bytes(gzip.compress(BODY))
+        (self.root / "app.js.br").write_bytes(b"brotli")
+        self.files.clear()
+        status, headers, data, _ = self.get("app.js", HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(headers["Content-Encoding"], "br")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(headers["Content-Type"], guess_type("app.js")[0])
+        self.assertTrue(headers["ETag"].endswith('-br"'))
+        self.assertEqual(data, b"brotli")
+        status, headers, data, _ = self.get("app.js", HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(data), BODY)
+        status, headers, data, _ = self.get("app.js")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(data, BODY)
+        data = self.get("app.js", HTTP_ACCEPT_ENCODING="br", HTTP_RANGE="bytes=0-4")[2]
+        self.assertEqual(data, BODY[:5])
+
+    def test_head(self):
+        status, headers, data, _ = self.get("app.js", method="HEAD")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Length"], str(len(BODY)))
+        self.assertEqual(data, b"")
+
+    def test_file_wrapper(self):
+        request = make_request(**{"wsgi.file_wrapper": FileWrapper})
+        body = send(self.files.response(request, "app.js"), request)[3]
+        self.assertIsInstance(body, FileWrapper)
+        request = make_request(HTTP_RANGE="bytes=0-1", **{"wsgi.file_wrapper": FileWrapper})
+        body = send(self.files.response(request, "app.js"), request)[3]
+        self.assertNotIsInstance(body, FileWrapper)
+
+    def test_resolution_is_cached(self):
+        self.get("app.js")
+        with mock.patch("mitama.app.http.static.os.path.isfile") as isfile, \
+                mock.patch("mitama.app.http.static.open") as open_mock:
+            response = self.files.response(make_request(), "app.js")
+        isfile.assert_not_called()
+        open_mock.assert_not_called()
+        self.assertEqual(response.headers["Content-Length"], str(len(BODY)))
+        self.assertEqual(len(self.files), 1)
+
+    def test_changed_file(self):
+        etag = self.get("app.js")[1]["ETag"]
+        (self.root / "app.js").write_bytes(b"changed")
+        os.utime(self.root / "app.js", ns=(0, 10 ** 9))
+        status, headers, data, _ = self.get("app.js", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(data, b"changed")
+
+    def test_removed_file(self):
+        (self.root / "app.js.gz").write_bytes(gzip.compress(BODY))
+        self.get("app.js")
+        os.remove(self.root / "app.js.gz")
+        status, headers, data, _ = self.get("app.js", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(data, BODY)
+        self.assertNotIn("Content-Encoding", headers)
+        os.remove(self.root / "app.js")
+        self.assertIsNone(self.get("app.js"))
+
+
+if __name__ == "__main__":
+    unittest.main()
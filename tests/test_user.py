@@ -6,6 +6,8 @@ DatabaseManager.test()
 
 from mitama.models import User
 
+DatabaseManager.create_all()
+
 class TestUser(unittest.TestCase):
     def test_user(self):
         user = User()
@@ -0,0 +1,42 @@
+import unittest
+
+from mitama.app import App, Router
+from mitama.app.app import MemoryBytecodeCache
+
+
+class ViewApp(App):
+    router = Router()
+
+
+class ReloadApp(App):
+    router = Router()
+    template_auto_reload = True
+
+
+class TestView(unittest.TestCase):
+    def test_view_is_cached(self):
+        app = ViewApp("view", "/", "view", project_dir=".")
+        self.assertIs(app.view, app.view)
+        self.assertIs(app.view.get_template("404.html"), app.view.get_template("404.html"))
+        self.assertFalse(app.view.auto_reload)
+
+    def test_view_per_app(self):
+        app1 = ViewApp("view1", "/a", "view", project_dir=".")
+        app2 = ViewApp("view2", "/b", "view", project_dir=".")
+        self.assertIsNot(app1.view, app2.view)
+        self.assertEqual(app1.view.globals["url"]("/hoge"), "/a/hoge")
+        self.assertEqual(app2.view.globals["url"]("/hoge"), "/b/hoge")
+
+    def test_auto_reload(self):
+        app = ReloadApp("reload", "/", "reload", project_dir=".")
+        self.assertTrue(app.view.auto_reload)
+
+    def test_bytecode_cache_is_bounded(self):
+        cache = MemoryBytecodeCache(capacity=2)
+        app = ViewApp("bounded", "/", "view", project_dir=".")
+        app.view.bytecode_cache = cache
+        for name in ["400.html", "401.html", "403.html"]:
+            app.view.get_template(name)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)